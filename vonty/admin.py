@@ -3,17 +3,133 @@
 from django import forms
 from django.contrib import admin, messages
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connections
+from django.db.models import Case, Prefetch, When
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext_lazy as _
 
 from treebeard.admin import TreeAdmin
 from treebeard.forms import movenodeform_factory
 
-from .models import Problem, Tag
+from . import autocomplete, duplicates, versioning
+from .models import Change, Problem, Tag
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that estimates the size of unfiltered listings of large tables,
+    so that the changelist does not run an exact COUNT(*) on every page.
+    """
+
+    # Tables with fewer rows than this are always counted exactly
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate(queryset)
+            if estimate >= self.threshold:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(queryset):
+        """Estimate the number of rows of the table of the queryset."""
+        connection = connections[queryset.db]
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+            else:
+                # Reading the largest primary key is an index lookup
+                pk = connection.ops.quote_name(queryset.model._meta.pk.column)
+                cursor.execute(f"SELECT MAX({pk}) FROM {table}")
+            row = cursor.fetchone()
+        return max(row[0] or 0, 0) if row else 0
+
+
+class TagSubtreeListFilter(admin.SimpleListFilter):
+    """Filter problems by a tag and all of its descendants."""
+
+    title = _("tag")
+    parameter_name = "tag"
+    # Deeper tags are left out of the sidebar but still work as parameters
+    max_depth = 2
+
+    def lookups(self, request, model_admin):
+        tags = (
+            Tag.objects.filter(depth__lte=self.max_depth)
+            .order_by("path")
+            .values_list("pk", "name", "depth", "subtree_problem_count")
+        )
+        return [
+            (str(pk), "\u2014 " * (depth - 1) + f"{name} ({count})")
+            for pk, name, depth, count in tags
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            tag = Tag.objects.get(pk=self.value())
+        except (Tag.DoesNotExist, ValueError):
+            return queryset.none()
+        return queryset.with_tags(tag)
 
 
 class ProblemAdmin(admin.ModelAdmin):
     save_on_top = True
+    list_display = ("desc", "source", "hardness", "proposer", "tag_list")
+    list_select_related = ("proposer",)
+    list_filter = (TagSubtreeListFilter, "hardness")
+    search_fields = ("source", "author", "desc")
+    autocomplete_fields = ("tags", "proposer")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch("tags", queryset=Tag.objects.only("name"))
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index rather than icontains scans
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Warn about near-duplicates, found through the similarity index
+        matches = duplicates.find_duplicates([obj])[0]
+        if matches:
+            links = format_html_join(
+                ", ", '<a href="{}">{}</a> ({})',
+                (
+                    (
+                        reverse("admin:vonty_problem_change", args=[other.pk]),
+                        other.source or other.desc,
+                        f"{score:.0%}",
+                    )
+                    for score, other in matches
+                ),
+            )
+            self.message_user(
+                request,
+                format_html(_("This problem looks like {}"), links),
+                messages.WARNING,
+            )
+
+    @admin.display(description=_("tags"))
+    def tag_list(self, obj):
+        return ", ".join(tag.name for tag in obj.tags.all())
 
 
 class TagForm(movenodeform_factory(Tag)):
@@ -40,21 +156,33 @@ class TagForm(movenodeform_factory(Tag)):
             .split()
         )
         cleaned_children_names = []
-        queryset = self.Meta.model.objects
+        seen = set()
 
         for name in children_names:
-            if queryset.filter(name=name).exists():
-                raise ValidationError(
-                    _("A tag named %(name)s already exists"),
-                    params = {"name": name},
-                )
-            if name in cleaned_children_names:
+            if name in seen:
                 raise ValidationError(
                     _("Found 2 children with the same name: %(name)s"),
                     params = {"name": name},
                 )
+            seen.add(name)
             cleaned_children_names.append(name)
 
+        # Look up every pasted name at once instead of one query per name
+        existing = set(
+            self.Meta.model.objects
+            .filter(name__in=cleaned_children_names)
+            .order_by()
+            .values_list("name", flat=True)
+        )
+        if existing:
+            raise ValidationError([
+                ValidationError(
+                    _("A tag named %(name)s already exists"),
+                    params = {"name": name},
+                )
+                for name in cleaned_children_names if name in existing
+            ])
+
         return cleaned_children_names
 
 
@@ -71,11 +199,30 @@ class TagForm(movenodeform_factory(Tag)):
 
 class TagAdmin(TreeAdmin):
     form = TagForm
+    search_fields = ("name",)
     actions = ["use_filter", "disable_use_filter"]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Tag selects of other forms complete from the in-memory trie
+        match = request.resolver_match
+        if not search_term.strip() or not match or match.url_name != "autocomplete":
+            return super().get_search_results(request, queryset, search_term)
+        pks = [
+            row[0]
+            for row in autocomplete.complete(search_term, autocomplete.MAX_LIMIT)
+        ]
+        return queryset.filter(pk__in=pks).order_by(Case(
+            *(When(pk=pk, then=rank) for rank, pk in enumerate(pks))
+        )), False
+
     @admin.action(description="Use selected tags as filters")
     def use_filter(self, request, queryset):
+        pks = list(queryset.values_list("pk", flat=True))
         queryset.update(use_filter=True)
+        # update() sends no signals
+        autocomplete.tags_changed(pks)
+        versioning.bump_on_commit()
+        Change.record(Change.TAG, pks)
         self.message_user(
             request,
             _("Succefully enabled the selected tags as filters."),
@@ -84,7 +231,12 @@ class TagAdmin(TreeAdmin):
 
     @admin.action(description="Disable use of selected tags as filters")
     def disable_use_filter(self, request, queryset):
+        pks = list(queryset.values_list("pk", flat=True))
         queryset.update(use_filter=False)
+        # update() sends no signals
+        autocomplete.tags_changed(pks)
+        versioning.bump_on_commit()
+        Change.record(Change.TAG, pks)
         self.message_user(
             request,
             _("Succefully disabled the selected tags as filters."),
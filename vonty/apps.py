@@ -1,6 +1,37 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def repair_fulltext(using, **kwargs):
+    # SQLite drops the index triggers whenever a migration
+    # remakes the problem table, so make sure they still exist.
+    from django.db import connections
+
+    from . import fulltext
+
+    fulltext.repair(connections[using])
 
 
 class VontyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vonty'
+
+    def ready(self):
+        # Importing tagcounts connects the receivers maintaining the counts,
+        # exporter the ones stamping the problems whose tags change,
+        # picker the ones dropping its pool, tagindex the ones updating it,
+        # query the ones clearing its plans, duplicates the ones
+        # updating the similarity buckets and versioning the ones
+        # bumping the data version, autocomplete the ones syncing its trie
+        # and changes the ones appending to the change feed
+        from . import (  # noqa: F401
+            autocomplete, changes, duplicates, exporter, picker, query,
+            tagcounts, tagindex, versioning,
+        )
+        from .db import tune_connection
+        from .profiling import install_recorder
+
+        connection_created.connect(tune_connection)
+        connection_created.connect(install_recorder)
+        post_migrate.connect(repair_fulltext, sender=self)
@@ -0,0 +1,241 @@
+"""
+Vonty tag autocomplete.
+
+Tags are completed from an in-memory prefix trie over their names, the
+words of their names, so that "chase" finds angle-chase, and the words of
+their descriptions. Terms are normalized to lowercase letters and digits,
+so "angle chase", "Angle-Chase" (the __str__ of the tag) and "anglechase"
+all reach the same node.
+
+Every node of the trie holds the tags with a term through it, and caches
+the best MAX_LIMIT of them: name matches first, then name word matches,
+then description matches, each ranked by use_filter and problem count.
+A completion walks one node per character of the query and returns the
+cached list.
+
+The trie is synced when tags are saved or deleted, once the change
+commits: only the rows of those tags are fetched again. Moves change the
+counts of other tags and sync the whole table, re-inserting only the
+tags whose row changed. Problem counts change without signals, so it is
+also synced every VONTY_AUTOCOMPLETE_TTL seconds.
+"""
+
+import functools
+import re
+import threading
+import time
+
+from django import forms
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from .models import Tag
+from .signals import tag_moved
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+# Ranks of the kinds of terms, lower is better
+NAME, NAME_WORD, DESC_WORD = 0, 1, 2
+# Description words shorter than this are not indexed
+MIN_WORD_LENGTH = 3
+
+WORD_RE = re.compile(r"[^\W_]+")
+NOT_ALNUM_RE = re.compile(r"[\W_]+")
+
+_trie = None
+_lock = threading.Lock()
+
+
+def normalize(text):
+    return NOT_ALNUM_RE.sub("", text.lower())
+
+
+def tag_terms(name, desc):
+    """The (term, kind) pairs of a tag, best kind first."""
+    words = WORD_RE.findall(name.lower())
+    yield "".join(words), NAME
+    for start in range(1, len(words)):
+        yield "".join(words[start:]), NAME_WORD
+    for word in WORD_RE.findall(desc.lower()):
+        if len(word) >= MIN_WORD_LENGTH:
+            yield word, DESC_WORD
+
+
+class Node:
+    __slots__ = ("children", "tags", "top")
+
+    def __init__(self):
+        self.children = {}
+        # Best kind of term of every tag reaching the node
+        self.tags = {}
+        # Cached best tags, None until asked for
+        self.top = None
+
+
+class TagTrie:
+    """A prefix trie of the tag terms, see the module docstring."""
+
+    def __init__(self):
+        self.root = Node()
+        # Tag id -> (name, desc, use_filter, problem count)
+        self.rows = {}
+        self.synced_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        trie = cls()
+        trie.sync(fetch_rows())
+        return trie
+
+    def sync(self, rows, pks=None):
+        """
+        Bring the trie up to date with the (pk, name, desc, use_filter,
+        problem count) rows of every tag, or of the tags with the given
+        primary keys, touching only the changed tags.
+        """
+        seen = set()
+        for pk, *row in rows:
+            seen.add(pk)
+            row = tuple(row)
+            old = self.rows.get(pk)
+            if old == row:
+                continue
+            if old is None or old[:2] != row[:2]:
+                if old is not None:
+                    self.remove(pk)
+                self.insert(pk, row)
+            else:
+                # Only the rank changed
+                self.rows[pk] = row
+                self.clear_top(pk, row)
+        known = self.rows.keys() if pks is None else self.rows.keys() & pks
+        for pk in known - seen:
+            self.remove(pk)
+        if pks is None:
+            self.synced_at = time.monotonic()
+
+    def paths(self, name, desc):
+        """Yield the nodes along every term, with the kind of the term."""
+        for term, kind in tag_terms(name, desc):
+            node = self.root
+            yield node, kind
+            for char in term:
+                node = node.children.setdefault(char, Node())
+                yield node, kind
+
+    def insert(self, pk, row):
+        self.rows[pk] = row
+        for node, kind in self.paths(*row[:2]):
+            if kind < node.tags.get(pk, DESC_WORD + 1):
+                node.tags[pk] = kind
+            node.top = None
+
+    def remove(self, pk):
+        row = self.rows.pop(pk)
+        for node, _kind in self.paths(*row[:2]):
+            node.tags.pop(pk, None)
+            node.top = None
+
+    def clear_top(self, pk, row):
+        for node, _kind in self.paths(*row[:2]):
+            node.top = None
+
+    def rank(self, node, pk):
+        name, _desc, use_filter, count = self.rows[pk]
+        return node.tags[pk], not use_filter, -count, name
+
+    def complete(self, text, limit=DEFAULT_LIMIT):
+        """The ids of the best tags completing text, best first."""
+        node = self.root
+        for char in normalize(text):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        top = node.top
+        if top is None:
+            top = node.top = sorted(
+                node.tags, key=lambda pk: self.rank(node, pk)
+            )[:MAX_LIMIT]
+        return top[:limit]
+
+
+def fetch_rows(pks=None):
+    queryset = Tag.objects.order_by()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return queryset.values_list(
+        "pk", "name", "desc", "use_filter", "subtree_problem_count",
+    )
+
+
+def get_trie():
+    global _trie
+    ttl = getattr(settings, "VONTY_AUTOCOMPLETE_TTL", 300)
+    with _lock:
+        if _trie is None:
+            _trie = TagTrie.load()
+        elif time.monotonic() - _trie.synced_at > ttl:
+            _trie.sync(fetch_rows())
+        return _trie
+
+
+def complete(text, limit=DEFAULT_LIMIT):
+    """The best tags completing text, best first."""
+    trie = get_trie()
+    with _lock:
+        pks = trie.complete(text, limit)
+        return [(pk, *trie.rows[pk]) for pk in pks]
+
+
+def sync(pks=None):
+    """
+    Sync the trie with the Tag table, or only the tags with the given
+    primary keys, if loaded.
+    """
+    with _lock:
+        if _trie is not None:
+            _trie.sync(fetch_rows(pks), pks)
+
+
+def invalidate(**kwargs):
+    """Drop the trie, it is rebuilt by the next completion."""
+    global _trie
+    with _lock:
+        _trie = None
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(instance, **kwargs):
+    tags_changed([instance.pk])
+
+
+@receiver(tag_moved)
+def tags_changed(pks=None, **kwargs):
+    """
+    Sync the tags with the given primary keys, or every tag,
+    once the current transaction commits.
+    """
+    if pks is not None:
+        pks = set(pks)
+    transaction.on_commit(functools.partial(sync, pks))
+
+
+class TagAutocompleteForm(forms.Form):
+    q = forms.CharField(
+        required=False, max_length=100,
+        help_text=_("Start of a tag name or of a word of its description."),
+    )
+    limit = forms.IntegerField(
+        required=False, min_value=1, max_value=MAX_LIMIT,
+        help_text=_("Number of tags. Defaults to 10."),
+    )
+
+    def get_tags(self):
+        """The (pk, name, desc, use_filter, problem count) of the best tags."""
+        return complete(
+            self.cleaned_data["q"], self.cleaned_data["limit"] or DEFAULT_LIMIT
+        )
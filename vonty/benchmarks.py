@@ -0,0 +1,240 @@
+"""
+Vonty benchmarks.
+
+Each benchmark is registered with @benchmark and returns the operation
+to measure, after doing its setup. run() calls every operation a few
+times in a rolled back transaction, recording the median wall time and
+the number of queries, and compare() checks the results against
+a baseline saved by an earlier run, e.g. on a synthetic archive.
+"""
+
+import json
+import statistics
+import time
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import picker, tagindex, versioning, views
+from .admin import TagForm
+from .exporter import export_lines
+from .importer import ProblemImporter
+from .models import Problem, Tag
+from .search import ProblemSearchForm
+from .synthetic import ProblemGenerator
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark setup function under a name."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def busiest_tag(**filters):
+    return (
+        Tag.objects.filter(**filters)
+        .order_by("-subtree_problem_count", "path").first()
+    )
+
+
+@benchmark("tag_subtree")
+def tag_subtree():
+    tag = busiest_tag(depth=1)
+    return lambda: (
+        Problem.objects.with_tags(tag).count(),
+        list(Problem.objects.with_tags(tag).order_by("hardness", "pk")[:50]),
+    )
+
+
+@benchmark("search")
+def search():
+    tag = busiest_tag(depth=2)
+
+    def run():
+        for data in (
+            {"q": "inequality", "limit": 50},
+            {"q": "fiend*", "hardness_min": 20, "limit": 50},
+            {"tags": tag.name if tag else "", "hardness_max": 30, "limit": 50},
+        ):
+            form = ProblemSearchForm(data)
+            assert form.is_valid(), form.errors
+            form.get_page()
+    return run
+
+
+@benchmark("tag_query")
+def tag_query():
+    names = list(
+        Tag.objects.filter(depth=2)
+        .order_by("-subtree_problem_count", "path")[:3]
+        .values_list("name", flat=True)
+    )
+    tagindex.get_index()
+    if len(names) < 3:
+        return lambda: None
+    query = f"{names[0]} AND ({names[1]} OR {names[2]}) AND NOT {names[1]}"
+    return lambda: list(
+        tagindex.filter_problems(Problem.objects.all(), query)
+        .order_by("hardness", "source", "pk")[:50]
+    )
+
+
+@benchmark("similar")
+def similar_problems():
+    index = tagindex.get_index()
+    pks = sorted(index.direct_tags)[::max(len(index.direct_tags) // 20, 1)]
+
+    def run():
+        # Measure the lookups, not the response cache
+        versioning.clear_responses()
+        for pk in pks:
+            request = RequestFactory().get(reverse("similar", args=[pk]))
+            views.similar(request, pk)
+    return run
+
+
+@benchmark("pick")
+def pick():
+    tag = busiest_tag(depth=1)
+    picker.get_pool()
+    return lambda: picker.pick_problems(
+        [10, 15, 25, 30, 35, 45], required=[tag] if tag else [], seed=0,
+    )
+
+
+@benchmark("admin_changelist")
+def admin_changelist():
+    model_admin = admin.site._registry[Problem]
+    user = get_user_model()(is_active=True, is_staff=True, is_superuser=True)
+    tag = busiest_tag(depth=1)
+    urls = [reverse("admin:vonty_problem_changelist")]
+    if tag:
+        urls.append(f"{urls[0]}?tag={tag.pk}")
+
+    def run():
+        for url in urls:
+            request = RequestFactory().get(url)
+            request.user = user
+            model_admin.changelist_view(request).render()
+    return run
+
+
+def import_batch(check_duplicates):
+    batch = list(ProblemGenerator(seed=1).generate(1000))
+    for problem, _tag_ids in batch:
+        problem.source = f"Benchmark {problem.source}"[:50]
+
+    def run():
+        ProblemImporter(check_duplicates=check_duplicates).write([
+            (Problem(**{
+                field.attname: getattr(problem, field.attname)
+                for field in Problem._meta.concrete_fields
+            }), tag_ids)
+            for problem, tag_ids in batch
+        ])
+    return run
+
+
+@benchmark("bulk_import")
+def bulk_import():
+    return import_batch(check_duplicates=False)
+
+
+@benchmark("bulk_import_checked")
+def bulk_import_checked():
+    # The same batch listing the likely duplicates of every problem
+    return import_batch(check_duplicates=True)
+
+
+@benchmark("export")
+def export():
+    return lambda: sum(1 for _ in export_lines("ndjson"))
+
+
+@benchmark("tag_form")
+def tag_form():
+    data = {
+        "name": "benchmark-tag",
+        "treebeard_position": "first-child",
+        "children_names": " ".join(f"benchmark-{i}" for i in range(200)),
+    }
+
+    def run():
+        form = TagForm(data=data)
+        assert form.is_valid(), form.errors
+        form.save()
+    return run
+
+
+def measure(setup, repeat=5):
+    """
+    Run a benchmark repeat times, each in a rolled back transaction.
+    Returns the median time in seconds and the queries of the last run.
+    """
+    timings = []
+    with transaction.atomic():
+        operation = setup()
+        for _ in range(repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    operation()
+                    timings.append(time.perf_counter() - start)
+                transaction.set_rollback(True)
+        transaction.set_rollback(True)
+    return {"time": statistics.median(timings), "queries": len(queries)}
+
+
+def run(names=None, repeat=5):
+    """Measure the given benchmarks, or all of them."""
+    results = {
+        name: measure(BENCHMARKS[name], repeat)
+        for name in names or BENCHMARKS
+    }
+    results["_dataset"] = {
+        "problems": Problem.objects.count(),
+        "tags": Tag.objects.count(),
+    }
+    return results
+
+
+def compare(results, baseline, tolerance=2.0):
+    """
+    List the regressions of the results against the baseline:
+    any extra query, or a time above tolerance times the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name.startswith("_") or name not in baseline:
+            continue
+        expected = baseline[name]
+        if result["queries"] > expected["queries"]:
+            regressions.append(
+                f"{name}: {result['queries']} queries, "
+                f"baseline {expected['queries']}"
+            )
+        if result["time"] > expected["time"] * tolerance:
+            regressions.append(
+                f"{name}: {result['time']:.3f}s, "
+                f"baseline {expected['time']:.3f}s"
+            )
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_baseline(results, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
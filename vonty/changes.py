@@ -0,0 +1,180 @@
+"""
+Vonty change feed.
+
+Every write to the problems and tags appends a Change row naming the
+problem or tag and whether it was saved or deleted. The id of the row is
+a sequence number, so a client keeps the last one it has seen as a cursor
+and asks for the changes after it, which come with the current state of
+the changed objects, instead of pulling whole tables again.
+
+Rows are appended by signal receivers within the transaction of the
+write, so they commit or roll back with it. The bulk paths send no
+signals and call Change.record themselves. Tag counts are maintained
+without any signal and are not part of the feed, and deleting a tag
+removes it from its problems without a change of the problems.
+
+The feed starts, from migration 0018, with a change for every tag, parents
+first, and every problem, so that the changes after 0 are the whole archive.
+
+compact() deletes the changes followed by a later change of the same
+object: a client only needs the last one, so every cursor stays valid.
+The last change of a deleted object is kept, for the clients to drop it.
+"""
+
+from django import forms
+from django.db.models import Max, Prefetch
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from .models import Change, Problem, Tag
+from .search import serialize_problem
+from .signals import tag_moved
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 100000
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def problem_changed(sender, instance, signal, **kwargs):
+    Change.record(Change.PROBLEM, [instance.pk], deleted=signal is post_delete)
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if action != "pre_clear" and not pk_set:
+        # Nothing was added or removed
+        return
+    if not reverse:
+        Change.record(Change.PROBLEM, [instance.pk])
+    elif action == "pre_clear":
+        Change.record(
+            Change.PROBLEM, instance.problem_set.values_list("pk", flat=True)
+        )
+    else:
+        Change.record(Change.PROBLEM, pk_set)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, signal, **kwargs):
+    Change.record(Change.TAG, [instance.pk], deleted=signal is post_delete)
+
+
+@receiver(tag_moved)
+def tag_moved_changed(sender, tag, **kwargs):
+    # Only the parent of the moved tag changes
+    Change.record(Change.TAG, [tag.pk])
+
+
+def bounds(since, limit):
+    """
+    The sequence number of the last change of the page of at most limit
+    changes after since, and whether more changes follow it.
+    """
+    queryset = Change.objects.filter(pk__gt=since).order_by("pk")
+    last = list(queryset.values_list("pk", flat=True)[limit - 1:limit + 1])
+    if last:
+        return last[0], len(last) > 1
+    end = queryset.aggregate(end=Max("pk"))["end"]
+    return (since if end is None else end), False
+
+
+def serialize_tags(pks):
+    """The tags with the given primary keys, by primary key."""
+    tags = Tag.objects.in_bulk(pks)
+    parents = dict(
+        Tag.objects.filter(
+            path__in={tag.path[:-Tag.steplen] for tag in tags.values()}
+        ).values_list("path", "pk")
+    )
+    return {
+        pk: {
+            "id": pk,
+            "name": tag.name,
+            # By id rather than by name, as names change
+            "parent": parents.get(tag.path[:-Tag.steplen]),
+            "desc": tag.desc,
+            "use_filter": tag.use_filter,
+        }
+        for pk, tag in tags.items()
+    }
+
+
+def serialize_problems(pks):
+    """The problems with the given primary keys, by primary key."""
+    problems = (
+        Problem.objects.select_related("proposer")
+        .prefetch_related(Prefetch("tags", queryset=Tag.objects.only("name")))
+        .in_bulk(pks)
+    )
+    return {pk: serialize_problem(problem) for pk, problem in problems.items()}
+
+
+def iter_changes(since, end, chunk_size=1000):
+    """
+    Yield the changes after since, up to and including end, as dicts,
+    fetching the changed objects of each chunk of changes in bulk.
+    """
+    while since < end:
+        chunk = list(
+            Change.objects.filter(pk__gt=since, pk__lte=end).order_by("pk")
+            .values_list("pk", "kind", "object_id", "deleted", "created")
+            [:chunk_size]
+        )
+        if not chunk:
+            return
+        since = chunk[-1][0]
+        # Only the last change of an object in the chunk is sent
+        last = {(row[1], row[2]): row for row in chunk}
+        saved = {Change.PROBLEM: [], Change.TAG: []}
+        for (kind, pk), row in last.items():
+            if not row[3]:
+                saved[kind].append(pk)
+        data = {
+            Change.PROBLEM: serialize_problems(saved[Change.PROBLEM]),
+            Change.TAG: serialize_tags(saved[Change.TAG]),
+        }
+        for seq, kind, pk, deleted, created in chunk:
+            if last[kind, pk][0] != seq:
+                continue
+            change = {
+                "seq": seq, "type": kind, "id": pk, "deleted": deleted,
+                "time": created.isoformat(),
+            }
+            if not deleted:
+                if pk not in data[kind]:
+                    # Deleted since, by a change after end
+                    continue
+                change["data"] = data[kind][pk]
+            yield change
+
+
+def compact():
+    """
+    Delete the changes followed by a later change of the same object.
+    Returns the number of changes deleted.
+    """
+    last = (
+        Change.objects.order_by().values("kind", "object_id")
+        .annotate(last=Max("pk")).values("last")
+    )
+    deleted, _rows = Change.objects.exclude(pk__in=last).delete()
+    return deleted
+
+
+class ChangeFeedForm(forms.Form):
+    since = forms.IntegerField(
+        required=False, min_value=0,
+        help_text=_(
+            "Sequence number of the last change seen, from the Vonty-Cursor "
+            "header of the previous response. Defaults to 0, every change."
+        ),
+    )
+    limit = forms.IntegerField(
+        required=False, min_value=1, max_value=MAX_LIMIT,
+        help_text=_("Maximum number of changes. Defaults to 1000."),
+    )
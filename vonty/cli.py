@@ -0,0 +1,164 @@
+"""
+Vonty command line tool.
+
+Queries a snapshot written by the export_snapshot command, without
+Django or a database, e.g.
+
+    python -m vonty search --contest ISL --tag geometry --hardness 20-30
+    python -m vonty show "ISL 2019/G3"
+    python -m vonty tags geometry
+
+The snapshot is the file given by --snapshot, else by the VONTY_SNAPSHOT
+environment variable, else vonty.snapshot in the current directory.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from .snapshot import NULL, Snapshot, SnapshotError, iter_rows
+
+DEFAULT_SNAPSHOT = "vonty.snapshot"
+
+
+def parse_range(text):
+    """Parse "20-30", "20-", "-30" or "25" into a (low, high) pair."""
+    low, sep, high = text.partition("-")
+    try:
+        low = int(low) if low else None
+        high = int(high) if high else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range {text!r}")
+    return (low, high) if sep else (low, low)
+
+
+def format_problem(problem):
+    hardness = "" if problem["hardness"] is None else problem["hardness"]
+    return (
+        f"{problem['source'] or '#' + str(problem['id']):<20} {hardness:>3}  "
+        f"{problem['desc']}  [{' '.join(problem['tags'])}]"
+    )
+
+
+def search(snapshot, args):
+    bitmap = snapshot.everything()
+    for name in args.tag:
+        if name not in snapshot.tag_indexes:
+            raise SnapshotError(f"Unknown tag {name!r}")
+        bitmap &= snapshot.tag_bitmap(name)
+    if args.contest is not None:
+        bitmap &= snapshot.contest_bitmap(args.contest, *args.year)
+    elif args.year != (None, None):
+        bitmap &= snapshot.year_bitmap(*args.year)
+    if args.hardness != (None, None):
+        bitmap &= snapshot.hardness_bitmap(*args.hardness)
+
+    for row in iter_rows(bitmap, args.limit):
+        problem = snapshot.get(row)
+        print(json.dumps(problem) if args.json else format_problem(problem))
+    total = bitmap.bit_count()
+    if total > args.limit:
+        print(f"{args.limit} of {total} problems", file=sys.stderr)
+
+
+def show(snapshot, args):
+    row = snapshot.find(args.problem)
+    if row is None and args.problem.lstrip("#").isdigit():
+        row = snapshot.find_pk(int(args.problem.lstrip("#")))
+    if row is None:
+        raise SnapshotError(f"No problem {args.problem!r}")
+    problem = snapshot.get(row)
+    if args.json:
+        print(json.dumps(problem))
+        return
+    for name, value in problem.items():
+        if name == "tags":
+            value = " ".join(value)
+        if value not in (None, ""):
+            print(f"{name}: {value}")
+
+
+def tags(snapshot, args):
+    start = 0
+    if args.tag is not None:
+        if args.tag not in snapshot.tag_indexes:
+            raise SnapshotError(f"Unknown tag {args.tag!r}")
+        start = snapshot.tag_indexes[args.tag]
+
+    # Tags are in tree order, so a subtree is a run of deeper tags
+    depths = []
+    top = None
+    for index, (_pk, name, parent, _use_filter, _desc, count) in enumerate(
+        snapshot.tags
+    ):
+        depths.append(0 if parent == NULL else depths[parent] + 1)
+        if index < start:
+            continue
+        if top is None:
+            top = depths[index]
+        elif args.tag is not None and depths[index] <= top:
+            break
+        print(f"{'  ' * (depths[index] - top)}{name} ({count})")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="vonty", description="Query an offline vonty snapshot.",
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=os.environ.get("VONTY_SNAPSHOT", DEFAULT_SNAPSHOT),
+        help="Snapshot file written by manage.py export_snapshot.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_search = commands.add_parser("search", help="List problems.")
+    parser_search.add_argument(
+        "-t", "--tag", action="append", default=[],
+        help="Only problems with this tag or a descendant. Can be repeated.",
+    )
+    parser_search.add_argument("-c", "--contest", help="e.g. ISL")
+    parser_search.add_argument(
+        "-y", "--year", type=parse_range, default=(None, None),
+        help="A year or a range of years, e.g. 2010-2015.",
+    )
+    parser_search.add_argument(
+        "-H", "--hardness", type=parse_range, default=(None, None),
+        help="A hardness or a range of hardness, e.g. 20-30.",
+    )
+    parser_search.add_argument("-n", "--limit", type=int, default=50)
+    parser_search.add_argument("--json", action="store_true")
+    parser_search.set_defaults(func=search)
+
+    parser_show = commands.add_parser("show", help="Show a problem.")
+    parser_show.add_argument("problem", help="A source or an id, e.g. IMO 2023/6")
+    parser_show.add_argument("--json", action="store_true")
+    parser_show.set_defaults(func=show)
+
+    parser_tags = commands.add_parser("tags", help="Show the tag tree.")
+    parser_tags.add_argument("tag", nargs="?", help="Only this tag's subtree.")
+    parser_tags.set_defaults(func=tags)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    try:
+        with Snapshot(args.snapshot) as snapshot:
+            args.func(snapshot, args)
+    except FileNotFoundError:
+        print(
+            f"vonty: no snapshot at {args.snapshot}, "
+            "write one with manage.py export_snapshot",
+            file=sys.stderr,
+        )
+        return 1
+    except SnapshotError as exc:
+        print(f"vonty: {exc}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # The output was closed early, e.g. by head, silence the final flush
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    return 0
@@ -0,0 +1,119 @@
+"""
+Vonty database tuning and routing.
+
+Every SQLite connection is tuned with the pragmas of VONTY_SQLITE_PRAGMAS
+when it is opened.
+Read-only code paths (search, export, stats) run inside read_database(),
+which makes ReadDatabaseRouter send their queries to the
+VONTY_READ_DATABASE alias, e.g. a read-only connection or a replica file.
+"""
+
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+# Pragmas that write to the database file and cannot be set read-only
+WRITE_PRAGMAS = {"journal_mode"}
+
+_reading = ContextVar("vonty_reading", default=False)
+
+
+def get_read_alias():
+    return getattr(settings, "VONTY_READ_DATABASE", "readonly")
+
+
+def get_pragmas():
+    return getattr(settings, "VONTY_SQLITE_PRAGMAS", DEFAULT_PRAGMAS)
+
+
+def tune_connection(sender, connection, **kwargs):
+    """Apply the pragmas to a new SQLite connection."""
+    if connection.vendor != "sqlite":
+        return
+    read_only = connection.alias == get_read_alias()
+    with connection.cursor() as cursor:
+        for name, value in get_pragmas().items():
+            if read_only and name in WRITE_PRAGMAS:
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def read_database():
+    """Send the reads of the block to the read database."""
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def reads_from_read_database(view):
+    """
+    Decorate a read-only view, sync or async,
+    so that its queries use the read database.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            with read_database():
+                return await view(*args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with read_database():
+                return view(*args, **kwargs)
+
+    return wrapper
+
+
+def iter_from_read_database(iterable):
+    """
+    Iterate within read_database(), for generators that outlive their view
+    such as the content of streaming responses.
+    """
+    with read_database():
+        yield from iterable
+
+
+class ReadDatabaseRouter:
+    """
+    Route the reads made within read_database() to the read database.
+    Reads made while the default database is inside a transaction
+    stay on it, so that they see the transaction's own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = get_read_alias()
+        if (
+            _reading.get()
+            and alias in settings.DATABASES
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point to the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == get_read_alias():
+            return False
+        return None
@@ -0,0 +1,325 @@
+"""
+Vonty near-duplicate detection.
+
+The source, author and description of a problem are normalized and cut
+into character trigrams. Two problems are near-duplicates when the
+Jaccard similarity of their trigram sets reaches
+VONTY_DUPLICATE_THRESHOLD, e.g. "USAMO 2004/5" "Fiendish inequality"
+and "USAMO 2004 P5" "Fiendish inequality.".
+
+Rather than comparing every pair, every problem is hashed with MinHash
+into NUM_BANDS locality-sensitive buckets stored in SimilarityBucket:
+problems sharing a bucket are candidates, which are then compared
+exactly. With bands of BAND_ROWS hashes, pairs above a similarity of
+about (1 / NUM_BANDS) ** (1 / BAND_ROWS) = 0.37 almost always share one.
+The signature is a one permutation MinHash, hashing every trigram once
+into one of its bins, so a problem is hashed in tens of microseconds.
+The buckets are updated when a problem is saved and by the importer,
+or later by find_duplicates for problems imported without a check.
+"""
+
+import random
+import re
+import struct
+import zlib
+from collections import Counter, defaultdict
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count, Exists, OuterRef
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Problem, SimilarityBucket
+
+TEXT_FIELDS = ("source", "author", "desc")
+SHINGLE_SIZE = 3
+NUM_BANDS = 20
+BAND_ROWS = 3
+NUM_BINS = NUM_BANDS * BAND_ROWS
+# Buckets shared by more problems come from boilerplate text,
+# comparing all of their pairs would be quadratic again
+MAX_BUCKET_SIZE = 25
+# Candidates compared per problem, those sharing the most buckets first
+MAX_CANDIDATES = 10
+# The bins an empty bin copies the first non-empty one of,
+# fixed so that signatures are comparable across processes
+_random = random.Random(0)
+PROBES = [_random.sample(range(NUM_BINS), NUM_BINS) for _bin in range(NUM_BINS)]
+BAND_FORMAT = struct.Struct(f"<{BAND_ROWS}I")
+WORD_RE = re.compile(r"\w+")
+# Keys looked up per query, under the SQLite parameter limit
+LOOKUP_CHUNK = 500
+
+
+def get_threshold():
+    return getattr(settings, "VONTY_DUPLICATE_THRESHOLD", 0.6)
+
+
+def problem_text(problem):
+    return " ".join(
+        getattr(problem, field) or "" for field in TEXT_FIELDS
+    )
+
+
+def shingles(text):
+    """The set of character trigrams of the normalized text."""
+    text = " ".join(WORD_RE.findall(text.lower()))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {
+        text[start:start + SHINGLE_SIZE]
+        for start in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+def similarity(first, second):
+    """The Jaccard similarity of two shingle sets."""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def signature(shingle_set):
+    """
+    The MinHash signature of a non-empty shingle set:
+    the smallest hash falling in each bin, with the empty bins
+    densified from a fixed random choice of the non-empty ones.
+    """
+    bins = [None] * NUM_BINS
+    for shingle in shingle_set:
+        value, bin_index = divmod(zlib.crc32(shingle.encode()), NUM_BINS)
+        if bins[bin_index] is None or value < bins[bin_index]:
+            bins[bin_index] = value
+    return [
+        value if value is not None else next(
+            bins[probe] for probe in PROBES[index] if bins[probe] is not None
+        )
+        for index, value in enumerate(bins)
+    ]
+
+
+def bucket_keys(shingle_set):
+    """The LSH bucket keys of a shingle set, one per band."""
+    if not shingle_set:
+        return []
+    values = signature(shingle_set)
+    return [
+        band << 32 | zlib.crc32(BAND_FORMAT.pack(
+            *values[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+        ))
+        for band in range(NUM_BANDS)
+    ]
+
+
+def hash_problems(problems):
+    """The shingle sets and the bucket keys of problems."""
+    shingle_sets = [shingles(problem_text(problem)) for problem in problems]
+    return shingle_sets, [bucket_keys(shingle_set) for shingle_set in shingle_sets]
+
+
+def insert_buckets(problems, bucket_model=SimilarityBucket, using=None,
+                   keys=None):
+    """
+    Insert the buckets of problems, with their bucket keys
+    if they were already computed by hash_problems.
+    """
+    if keys is None:
+        _shingle_sets, keys = hash_problems(problems)
+    # Millions of rows for a large archive, bulk_create would spend
+    # far longer building model instances than SQLite inserting them
+    connection = connections[using or router.db_for_write(bucket_model)]
+    quote = connection.ops.quote_name
+    insert = "INSERT INTO {} ({}, {}) VALUES (%s, %s)".format(
+        quote(bucket_model._meta.db_table),
+        quote(bucket_model._meta.get_field("key").column),
+        quote(bucket_model._meta.get_field("problem").column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(insert, [
+            (key, problem.pk)
+            for problem, problem_keys in zip(problems, keys)
+            for key in set(problem_keys)
+        ])
+
+
+def index_problems(problems, bucket_model=SimilarityBucket):
+    """Replace the buckets of saved problems."""
+    problems = list(problems)
+    bucket_model.objects.filter(
+        problem_id__in=[problem.pk for problem in problems]
+    ).delete()
+    insert_buckets(problems, bucket_model)
+
+
+def index_pages(queryset, batch_size, using=None):
+    """Insert the buckets of a queryset of problems, batch by batch."""
+    queryset = queryset.only("pk", *TEXT_FIELDS).order_by("pk")
+    count = 0
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        problems = list(page[:batch_size])
+        if not problems:
+            return count
+        last = problems[-1].pk
+        insert_buckets(problems, using=using)
+        count += len(problems)
+
+
+def rebuild(using=None, batch_size=2000):
+    """Rebuild the buckets of every problem. Returns the problem count."""
+    using = using or router.db_for_write(SimilarityBucket)
+    SimilarityBucket.objects.using(using).all().delete()
+    return index_pages(Problem.objects.using(using), batch_size, using)
+
+
+def index_missing(batch_size=2000):
+    """
+    Add the problems without buckets to the index, e.g. the ones
+    imported without a duplicate check. Problems without any text
+    have no buckets and are hashed again every time.
+    Returns the number of problems hashed.
+    """
+    buckets = SimilarityBucket.objects.filter(problem=OuterRef("pk"))
+    return index_pages(Problem.objects.filter(~Exists(buckets)), batch_size)
+
+
+@receiver(post_save, sender=Problem)
+def problem_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(TEXT_FIELDS):
+        return
+    index_problems([instance])
+
+
+def bucket_members(keys, max_size=MAX_BUCKET_SIZE):
+    """
+    The ids of the problems in each of the buckets,
+    leaving out the buckets of over max_size problems.
+    """
+    members = defaultdict(set)
+    keys = sorted(set(keys))
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        # Counted on the key index, the crowded buckets are never read
+        uncrowded = (
+            SimilarityBucket.objects
+            .filter(key__in=keys[start:start + LOOKUP_CHUNK])
+            .order_by().values("key").annotate(size=Count("id"))
+            .filter(size__lte=max_size).values("key")
+        )
+        rows = SimilarityBucket.objects.filter(
+            key__in=uncrowded
+        ).values_list("key", "problem_id")
+        for key, problem_id in rows:
+            members[key].add(problem_id)
+    return members
+
+
+def load_shingles(problem_ids):
+    """The texts and shingle sets of the problems with the given ids."""
+    problem_ids = list(problem_ids)
+    result = {}
+    for start in range(0, len(problem_ids), LOOKUP_CHUNK):
+        rows = Problem.objects.filter(
+            pk__in=problem_ids[start:start + LOOKUP_CHUNK]
+        ).values_list("pk", *TEXT_FIELDS)
+        for pk, *texts in rows:
+            fields = dict(zip(TEXT_FIELDS, texts))
+            result[pk] = (fields, shingles(" ".join(text or "" for text in texts)))
+    return result
+
+
+def find_duplicates(problems, threshold=None, hashed=None):
+    """
+    Find the likely duplicates of problems, saved or not, in the archive
+    and among the earlier problems of the list.
+    hashed may be the result of hash_problems for the problems.
+    Returns, for every problem, a list of (similarity, problem) pairs
+    at or above the threshold, most similar first.
+    Buckets of over MAX_BUCKET_SIZE archived problems are skipped,
+    and at most MAX_CANDIDATES problems are compared to each problem.
+    """
+    if threshold is None:
+        threshold = get_threshold()
+    problems = list(problems)
+    shingle_sets, keys = hashed or hash_problems(problems)
+    members = bucket_members(key for problem_keys in keys for key in problem_keys)
+    own = {problem.pk for problem in problems if problem.pk is not None}
+    candidates = []
+    for problem_keys in keys:
+        # Similar enough problems share several buckets, the crowded ones
+        # left out by bucket_members only add boilerplate matches
+        shared = Counter(
+            pk for key in problem_keys for pk in members[key] if pk not in own
+        )
+        candidates.append([pk for pk, _count in shared.most_common(MAX_CANDIDATES)])
+    archive = load_shingles({pk for pks in candidates for pk in pks})
+
+    seen = {}
+    results = []
+    for index, problem in enumerate(problems):
+        matches = []
+        for pk in candidates[index]:
+            if pk in archive:
+                fields, other_shingles = archive[pk]
+                score = similarity(shingle_sets[index], other_shingles)
+                if score >= threshold:
+                    matches.append((score, Problem(pk=pk, **fields)))
+        # Earlier problems of the list sharing a bucket
+        earlier = Counter(i for key in keys[index] for i in seen.get(key, ()))
+        for other, _count in earlier.most_common(MAX_CANDIDATES):
+            score = similarity(shingle_sets[index], shingle_sets[other])
+            if score >= threshold:
+                matches.append((score, problems[other]))
+        for key in keys[index]:
+            seen.setdefault(key, []).append(index)
+        matches.sort(key=lambda match: -match[0])
+        results.append(matches)
+    return results
+
+
+def find_all_duplicates(threshold=None, max_bucket_size=MAX_BUCKET_SIZE):
+    """
+    Find the near-duplicate pairs of the whole archive,
+    comparing only the problems sharing a bucket.
+    Returns the (similarity, problem, other) triples, most similar first,
+    and the number of buckets skipped for holding over max_bucket_size
+    problems.
+    """
+    if threshold is None:
+        threshold = get_threshold()
+    shared = (
+        SimilarityBucket.objects.order_by().values("key")
+        .annotate(size=Count("id")).filter(size__gt=1).values("key")
+    )
+    rows = (
+        SimilarityBucket.objects.filter(key__in=shared)
+        .order_by("key").values_list("key", "problem_id")
+    )
+    pairs = set()
+    skipped = 0
+    for _key, group in groupby(rows.iterator(), key=lambda row: row[0]):
+        ids = sorted(problem_id for _key, problem_id in group)
+        if len(ids) > max_bucket_size:
+            skipped += 1
+            continue
+        pairs.update(
+            (first, second)
+            for position, first in enumerate(ids)
+            for second in ids[position + 1:]
+        )
+
+    archive = load_shingles({pk for pair in pairs for pk in pair})
+    duplicates = []
+    for first, second in pairs:
+        if first in archive and second in archive:
+            score = similarity(archive[first][1], archive[second][1])
+            if score >= threshold:
+                duplicates.append((
+                    score,
+                    Problem(pk=first, **archive[first][0]),
+                    Problem(pk=second, **archive[second][0]),
+                ))
+    duplicates.sort(key=lambda triple: (-triple[0], triple[1].pk, triple[2].pk))
+    return duplicates, skipped
@@ -0,0 +1,202 @@
+"""
+Vonty problem export.
+
+Problems are streamed in primary key order with iterator(chunk_size=...),
+so the tags of each chunk are fetched with a single prefetch query
+and memory stays flat however large the table is.
+
+Snapshots for the offline command line tool, see vonty.snapshot, are
+rebuilt from the previous snapshot: only the problems modified since
+it was written are fetched again.
+"""
+
+import csv
+import json
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import snapshot
+from .models import Problem, Tag
+from .search import serialize_problem
+
+FORMATS = ("ndjson", "csv")
+CSV_FIELDS = (
+    "id",
+    "source",
+    "problem_number",
+    "author",
+    "desc",
+    "hardness",
+    "aops_url",
+    "git_url",
+    "proposer",
+    "proposal_date",
+    "tags",
+)
+
+
+def iter_problems(chunk_size=2000):
+    """Yield every problem serialized as a dict."""
+    queryset = (
+        Problem.objects.select_related("proposer")
+        .prefetch_related(Prefetch("tags", queryset=Tag.objects.only("name")))
+        .order_by("pk")
+    )
+    for problem in queryset.iterator(chunk_size=chunk_size):
+        yield serialize_problem(problem)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    """A file-like object whose write returns the written value."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for row in rows:
+        row["tags"] = " ".join(row["tags"])
+        yield writer.writerow([row[field] for field in CSV_FIELDS])
+
+
+def export_lines(fmt, chunk_size=2000):
+    """Yield the whole problem table as lines of the given format."""
+    rows = iter_problems(chunk_size)
+    if fmt == "csv":
+        return csv_lines(rows)
+    return ndjson_lines(rows)
+
+
+def encode(lines, compress=False, buffer_size=64 * 1024):
+    """
+    Encode lines to UTF-8 bytes, gzipped if asked to,
+    in pieces of roughly buffer_size bytes.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            data = b"".join(buffer)
+            buffer, size = [], 0
+            yield compressor.compress(data) if compressor else data
+    data = b"".join(buffer)
+    if compressor:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
+
+
+# Problems modified this long before the previous snapshot was written
+# are fetched again, for the transactions that were not committed yet
+# and the clocks of the other servers
+SNAPSHOT_MARGIN = timedelta(minutes=5)
+SNAPSHOT_FIELDS = (
+    "pk", "source", "desc", "author", "hardness", "aops_url",
+    "source_contest", "source_year", "source_number",
+)
+
+
+def snapshot_rows(queryset, chunk_size=2000):
+    """Yield the problems of a queryset as snapshot rows, by pk chunks."""
+    through = Problem.tags.through
+    last = 0
+    while True:
+        chunk = list(
+            queryset.filter(pk__gt=last).order_by("pk")
+            .values_list(*SNAPSHOT_FIELDS)[:chunk_size]
+        )
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        tags = defaultdict(list)
+        for problem_id, tag_id in through.objects.filter(
+            problem_id__in=[row[0] for row in chunk]
+        ).values_list("problem_id", "tag_id"):
+            tags[problem_id].append(tag_id)
+        for row in chunk:
+            yield (*row, tuple(tags[row[0]]))
+
+
+def build_snapshot(path, full=False, chunk_size=2000):
+    """
+    Write the snapshot at path, reusing the rows of the previous one
+    unless full is True. Returns the number of problems
+    and the number of them fetched from the database.
+    """
+    # Taken before reading, so the next snapshot sees what is written meanwhile
+    created = timezone.now()
+    tags = []
+    tag_pks = {}
+    for pk, name, tag_path, use_filter, desc in (
+        Tag.objects.order_by("path")
+        .values_list("pk", "name", "path", "use_filter", "desc")
+    ):
+        tag_pks[tag_path] = pk
+        parent = tag_pks.get(tag_path[:-Tag.steplen])
+        tags.append((pk, name, parent, use_filter, desc))
+
+    rows = {}
+    since = None
+    if not full:
+        try:
+            previous = snapshot.Snapshot(path)
+        except (OSError, snapshot.SnapshotError):
+            previous = None
+        if previous is not None:
+            with previous:
+                since = (
+                    datetime.fromisoformat(previous.meta["created"])
+                    - SNAPSHOT_MARGIN
+                )
+                existing = set(Problem.objects.values_list("pk", flat=True))
+                rows = {
+                    row[0]: row for row in previous.rows() if row[0] in existing
+                }
+            # Problems missing from the previous snapshot, whatever their time
+            missing = sorted(existing.difference(rows))
+
+    fetched = 0
+    if since is None:
+        changed = [Problem.objects.all()]
+    else:
+        changed = [Problem.objects.filter(modified__gte=since)] + [
+            Problem.objects.filter(pk__in=missing[start:start + chunk_size])
+            for start in range(0, len(missing), chunk_size)
+        ]
+    for queryset in changed:
+        for row in snapshot_rows(queryset, chunk_size):
+            rows[row[0]] = row
+            fetched += 1
+
+    snapshot.write(path, tags, rows.values(), {"created": created.isoformat()})
+    return len(rows), fetched
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Tags changes are changes of the problems for the snapshots
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        problems = Problem.objects.filter(pk=instance.pk)
+    elif action == "pre_clear":
+        problems = Problem.objects.filter(tags=instance)
+    else:
+        problems = Problem.objects.filter(pk__in=pk_set)
+    problems.update(modified=timezone.now())
@@ -0,0 +1,155 @@
+"""
+Vonty full-text search index.
+
+On SQLite, problems are indexed in an FTS5 external content table
+that mirrors the source, author and desc columns of the problem table.
+Triggers keep it in sync, so bulk inserts and raw updates are covered too.
+Other backends fall back to icontains lookups.
+"""
+
+from django.db.models import Q
+
+PROBLEM_TABLE = "vonty_problem"
+FTS_TABLE = "vonty_problem_fts"
+FTS_COLUMNS = ("source", "author", "desc")
+
+_columns = ", ".join(f'"{column}"' for column in FTS_COLUMNS)
+_new = ", ".join(f'new."{column}"' for column in FTS_COLUMNS)
+_old = ", ".join(f'old."{column}"' for column in FTS_COLUMNS)
+
+CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    {_columns},
+    content='{PROBLEM_TABLE}',
+    content_rowid='id',
+    tokenize='unicode61',
+    prefix='2 3'
+)
+"""
+
+# Triggers are dropped whenever SQLite has to remake the problem table,
+# so they are (re)installed separately from the table itself.
+CREATE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON {PROBLEM_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns})
+        VALUES (new.id, {_new});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON {PROBLEM_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns})
+        VALUES ('delete', old.id, {_old});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF {_columns} ON {PROBLEM_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns})
+        VALUES ('delete', old.id, {_old});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns})
+        VALUES (new.id, {_new});
+    END
+    """,
+)
+
+DROP = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+
+def is_supported(connection):
+    return connection.vendor == "sqlite"
+
+
+def install(connection):
+    """
+    Create the index and its triggers if they are missing.
+    A freshly created index is filled from the problem table.
+    """
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE],
+        )
+        created = cursor.fetchone() is None
+        cursor.execute(CREATE_TABLE)
+        for statement in CREATE_TRIGGERS:
+            cursor.execute(statement)
+    if created:
+        rebuild(connection)
+
+
+def repair(connection):
+    """Reinstall missing triggers, if the index itself exists."""
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE],
+        )
+        if cursor.fetchone() is None:
+            return
+        for statement in CREATE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def uninstall(connection):
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+def rebuild(connection):
+    """Rebuild the whole index from the problem table."""
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def parse_terms(query):
+    """
+    Split a user query into (term, is_prefix) pairs.
+    A trailing * asks for prefix matching. e.g. Fiend*
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append((word, prefix))
+    return terms
+
+
+def match_expression(terms):
+    """
+    Build an FTS5 MATCH expression that requires every term.
+    Terms are quoted so that punctuation like "2023/6" is never parsed
+    as FTS5 syntax.
+    """
+    return " ".join(
+        '"%s"%s' % (term.replace('"', '""'), "*" if prefix else "")
+        for term, prefix in terms
+    )
+
+
+def fallback_q(terms):
+    """Q object for backends without FTS5: every term in some column."""
+    q = Q()
+    for term, _prefix in terms:
+        any_column = Q()
+        for column in FTS_COLUMNS:
+            any_column |= Q(**{f"{column}__icontains": term})
+        q &= any_column
+    return q
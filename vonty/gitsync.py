@@ -0,0 +1,135 @@
+"""
+Vonty git sync.
+
+Problem repositories are kept as local bare mirrors, one per distinct
+git_url, in the directory given by VONTY_GIT_MIRROR_ROOT.
+A sync fetches every mirror incrementally on a bounded thread pool,
+then records the fetched head commit on each problem.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import versioning
+from .models import Change, Problem
+
+
+class GitSyncError(Exception):
+    """A repository could not be cloned or fetched."""
+
+
+def get_mirror_root():
+    return os.fspath(getattr(
+        settings,
+        "VONTY_GIT_MIRROR_ROOT",
+        os.path.join(settings.BASE_DIR, "git-mirrors"),
+    ))
+
+
+def run_git(*args, cwd=None):
+    try:
+        result = subprocess.run(
+            ["git", *args], cwd=cwd, check=True, capture_output=True, text=True,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+    except subprocess.CalledProcessError as exc:
+        raise GitSyncError(exc.stderr.strip() or str(exc)) from exc
+    except FileNotFoundError as exc:
+        raise GitSyncError(f"Cannot run git: {exc}") from exc
+    return result.stdout.strip()
+
+
+class MirrorPool:
+    """A directory of bare mirrors keyed by repository URL."""
+
+    def __init__(self, root=None):
+        self.root = root or get_mirror_root()
+
+    def mirror_path(self, url):
+        digest = hashlib.sha256(url.encode()).hexdigest()[:20]
+        return os.path.join(self.root, f"{digest}.git")
+
+    def sync(self, url):
+        """
+        Clone the repository on first use, fetch it afterwards.
+        Returns the commit of the mirror's HEAD.
+        """
+        path = self.mirror_path(url)
+        if os.path.isdir(path):
+            run_git("fetch", "--prune", "--quiet", "origin", cwd=path)
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            # Left behind by a clone that failed or was killed
+            shutil.rmtree(path + ".tmp", ignore_errors=True)
+            run_git("clone", "--mirror", "--quiet", url, path + ".tmp")
+            # Only a complete clone takes the mirror's name
+            os.replace(path + ".tmp", path)
+        return run_git("rev-parse", "HEAD", cwd=path)
+
+    def sync_many(self, urls, workers=4):
+        """
+        Sync every distinct URL on at most `workers` threads.
+        Returns a dict mapping each URL to its head commit
+        or to the GitSyncError it raised.
+        """
+        urls = list(dict.fromkeys(urls))
+
+        def sync(url):
+            try:
+                return self.sync(url)
+            except GitSyncError as exc:
+                return exc
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(urls, executor.map(sync, urls)))
+
+
+def sync_problems(queryset=None, pool=None, workers=4):
+    """
+    Sync the repositories of the problems with a git_url
+    and record the new head commits.
+    Problems sharing a repository are fetched once.
+    Returns the problems whose commit changed, which are the only ones
+    that need reprocessing, and a dict of errors keyed by URL.
+    """
+    if queryset is None:
+        queryset = Problem.objects.all()
+    if pool is None:
+        pool = MirrorPool()
+
+    problems = list(
+        queryset.exclude(git_url="").only("git_url", "git_commit")
+    )
+    heads = pool.sync_many((problem.git_url for problem in problems), workers)
+
+    changed = []
+    now = timezone.now()
+    for problem in problems:
+        head = heads[problem.git_url]
+        if isinstance(head, GitSyncError) or head == problem.git_commit:
+            continue
+        problem.git_commit = head
+        # bulk_update skips auto_now
+        problem.modified = now
+        changed.append(problem)
+    if changed:
+        with transaction.atomic():
+            Problem.objects.bulk_update(
+                changed, ["git_commit", "modified"], batch_size=500
+            )
+            # bulk_update sends no signals
+            versioning.bump_on_commit()
+            Change.record(Change.PROBLEM, [problem.pk for problem in changed])
+
+    errors = {
+        url: head for url, head in heads.items()
+        if isinstance(head, GitSyncError)
+    }
+    return changed, errors
@@ -0,0 +1,260 @@
+"""
+Vonty bulk problem importer.
+
+Records are read lazily from JSON lines files or von-style directories,
+cleaned against the problem fields, and written in batches
+with one bulk insert for the problems and one for their tags.
+"""
+
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import duplicates, picker, tagcounts, tagindex, versioning
+from .models import Change, Problem, Tag
+from .sources import set_source_key
+
+SCALAR_FIELDS = (
+    "source",
+    "author",
+    "desc",
+    "aops_url",
+    "problem_number",
+    "hardness",
+    "proposal_date",
+    "git_url",
+)
+# Fields that tell apart the problems without a source
+CONTENT_FIELDS = ("desc", "author", "problem_number", "hardness")
+
+
+class RecordError(ValueError):
+    """A record of the input that cannot be imported."""
+
+
+def read_jsonl(path):
+    """Yield one record per non-blank line of a JSON lines file."""
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except UnicodeDecodeError:
+                yield RecordError("Not UTF-8")
+                continue
+            except json.JSONDecodeError as exc:
+                yield RecordError(f"Invalid JSON: {exc}")
+                continue
+            if not isinstance(record, dict):
+                yield RecordError("Expected a JSON object")
+                continue
+            yield record
+
+
+def parse_von_header(text):
+    """
+    Parse the header of a von-style problem file.
+    The header is a list of "key: value" lines ended by a "---" line,
+    and tags are given as a space separated list.
+    e.g.
+
+        source: USAMO 2004/5
+        desc: Fiendish inequality
+        hardness: 25
+        tags: ineq holder
+        ---
+        Let a, b, c > 0 ...
+    """
+    record = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "---":
+            break
+        if not line or line.startswith("%"):
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            raise RecordError(f"Expected a 'key: value' line, got {line!r}")
+        record[key.strip()] = value.strip()
+    if "tags" in record:
+        record["tags"] = record["tags"].replace(",", " ").split()
+    return record
+
+
+def read_von(path):
+    """Yield one record per .tex file in a von-style directory tree."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".tex"):
+                continue
+            with open(os.path.join(root, name), encoding="utf-8") as file:
+                try:
+                    yield parse_von_header(file.read())
+                except UnicodeDecodeError:
+                    yield RecordError(f"{name}: not UTF-8")
+                except RecordError as exc:
+                    yield RecordError(f"{name}: {exc}")
+
+
+class ProblemImporter:
+    """
+    Turn records into unsaved problems and write them in batches.
+    Tag names and proposer usernames are resolved through in-memory maps
+    that are loaded once, so cleaning a record never hits the database.
+    Unless check_duplicates is False, every write lists the problems
+    of the batch that look like an archived or earlier problem
+    in duplicates, as (problem, [(similarity, other problem)]) pairs,
+    and adds them to the similarity index. Otherwise they are indexed
+    later by duplicates.index_missing, which find_duplicates runs.
+    """
+
+    def __init__(self, dry_run=False, check_duplicates=True):
+        self.dry_run = dry_run
+        self.check_duplicates = check_duplicates
+        self.duplicates = []
+        self.tag_ids = {}
+        self.tag_paths = {}
+        for name, pk, path in Tag.objects.values_list("name", "pk", "path"):
+            self.tag_ids[name] = pk
+            self.tag_paths[pk] = path
+        self.user_ids = None
+
+    def get_user_id(self, username):
+        if self.user_ids is None:
+            User = get_user_model()
+            self.user_ids = dict(
+                User.objects.values_list(User.USERNAME_FIELD, "pk")
+            )
+        try:
+            return self.user_ids[username]
+        except KeyError:
+            raise RecordError(f"Unknown proposer {username!r}")
+
+    def clean(self, record):
+        """
+        Clean a record into an unsaved problem and a list of tag ids.
+        Raises RecordError for invalid records.
+        """
+        if isinstance(record, RecordError):
+            raise record
+
+        problem = Problem()
+        for name in SCALAR_FIELDS:
+            field = Problem._meta.get_field(name)
+            value = record.get(name)
+            if value in (None, ""):
+                value = None if field.null else ""
+            try:
+                setattr(problem, field.attname, field.clean(value, problem))
+            except ValidationError as exc:
+                raise RecordError(f"{name}: {' '.join(exc.messages)}")
+
+        if record.get("proposer"):
+            problem.proposer_id = self.get_user_id(record["proposer"])
+
+        names = record.get("tags") or []
+        if not isinstance(names, list) or not all(
+            isinstance(name, str) for name in names
+        ):
+            raise RecordError("tags: expected a list of tag names")
+        missing = [name for name in names if name not in self.tag_ids]
+        if missing:
+            raise RecordError(f"Unknown tags: {', '.join(missing)}")
+        return problem, list(dict.fromkeys(self.tag_ids[name] for name in names))
+
+    def existing_sources(self, sources):
+        """The sources of the batch that are already in the database."""
+        sources = [source for source in sources if source]
+        return set(
+            Problem.objects.filter(source__in=sources)
+            .order_by().values_list("source", flat=True)
+        )
+
+    def existing_contents(self, problems):
+        """
+        The contents of the problems of the batch without a source
+        that are already in the database without a source.
+        """
+        descs = [problem.desc for problem in problems if not problem.source]
+        if not descs:
+            return set()
+        return set(
+            Problem.objects.filter(source__isnull=True, desc__in=descs)
+            .order_by().values_list(*CONTENT_FIELDS)
+        )
+
+    def write(self, batch, resumed=False):
+        """
+        Write a batch of (problem, tag ids) pairs in one transaction.
+        Problems whose source already exists are skipped. With resumed,
+        for a batch that may have been committed before an interruption,
+        so are the problems without a source whose content exists.
+        Returns the saved problems and the skipped ones.
+        """
+        existing = self.existing_sources(problem.source for problem, _ in batch)
+        contents = (
+            self.existing_contents(problem for problem, _ in batch)
+            if resumed else set()
+        )
+        rows, skipped = [], []
+        for problem, tag_ids in batch:
+            content = tuple(getattr(problem, field) for field in CONTENT_FIELDS)
+            if (
+                problem.source and problem.source in existing
+                or not problem.source and content in contents
+            ):
+                skipped.append(problem)
+                continue
+            existing.add(problem.source)
+            # bulk_create skips Problem.save, which parses the source
+            set_source_key(problem)
+            rows.append((problem, tag_ids))
+
+        self.duplicates = []
+        hashed = None
+        if self.check_duplicates and rows:
+            problems = [problem for problem, _ in rows]
+            # Hashed once for the duplicate check and the similarity index
+            hashed = duplicates.hash_problems(problems)
+            self.duplicates = [
+                (problem, matches)
+                for problem, matches in zip(
+                    problems, duplicates.find_duplicates(problems, hashed=hashed)
+                )
+                if matches
+            ]
+
+        if self.dry_run or not rows:
+            return [problem for problem, _ in rows], skipped
+
+        through = Problem.tags.through
+        with transaction.atomic():
+            problems = Problem.objects.bulk_create(
+                [problem for problem, _ in rows]
+            )
+            through.objects.bulk_create(
+                through(problem_id=problem.pk, tag_id=tag_id)
+                for problem, (_, tag_ids) in zip(problems, rows)
+                for tag_id in tag_ids
+            )
+            # bulk_create sends no signals, so count and index the tags here
+            # and add the problems to the similarity index, the data version
+            # and the change feed. Without a duplicate check, indexing the
+            # buckets is left to index_missing, it costs more than the rest
+            tagcounts.apply_changes(
+                (set(), {self.tag_paths[tag_id] for tag_id in tag_ids})
+                for _, tag_ids in rows
+            )
+            tagindex.refresh_on_commit(problem.pk for problem in problems)
+            if hashed is not None:
+                # New problems have no buckets to replace
+                duplicates.insert_buckets(problems, keys=hashed[1])
+            versioning.bump_on_commit()
+            Change.record(Change.PROBLEM, [problem.pk for problem in problems])
+        picker.invalidate()
+        return problems, skipped
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty.models import Problem
+from vonty.sources import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the contest, year, part and number parsed from the source "
+        "of every problem, e.g. after sources were changed with update()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        changed = backfill(Problem, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Updated {changed} problems."))
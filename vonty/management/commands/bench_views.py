@@ -0,0 +1,92 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from vonty.models import Problem
+
+
+def uncached(params, number):
+    """
+    The params with a parameter the views ignore, unique to the request,
+    so that no request is served from the response cache of
+    vonty.versioning, whose keys include the query string.
+    """
+    return {**params, "bench": number}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the request throughput of the synchronous views, served "
+        "through the WSGI handler on a thread pool, with the asynchronous "
+        "views served through the ASGI handler on one event loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def handle(self, *args, **options):
+        problem = Problem.objects.order_by("pk").first()
+        if problem is None:
+            raise CommandError("Add some problems before benchmarking.")
+
+        endpoints = {
+            "search": (reverse("problems"), reverse("aproblems"), {"limit": 50}),
+            "detail": (
+                reverse("problem_detail", args=[problem.pk]),
+                reverse("aproblem_detail", args=[problem.pk]),
+                {},
+            ),
+            "tags": (reverse("tags"), reverse("atags"), {}),
+        }
+        count = options["requests"]
+        concurrency = options["concurrency"]
+        # The test clients send requests to the "testserver" host
+        hosts = [*settings.ALLOWED_HOSTS, "testserver"]
+        with override_settings(ALLOWED_HOSTS=hosts):
+            self.compare(endpoints, count, concurrency)
+
+    def compare(self, endpoints, count, concurrency):
+        for name, (sync_url, async_url, params) in endpoints.items():
+            wsgi = self.bench_wsgi(sync_url, params, count, concurrency)
+            asgi = asyncio.run(
+                self.bench_asgi(async_url, params, count, concurrency)
+            )
+            self.stdout.write(
+                f"{name}: WSGI {count / wsgi:.0f} req/s, "
+                f"ASGI {count / asgi:.0f} req/s"
+            )
+
+    def bench_wsgi(self, url, params, count, concurrency):
+        def get(number):
+            response = Client().get(url, uncached(params, number))
+            assert response.status_code == 200, response.status_code
+
+        def close(_):
+            connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            list(executor.map(get, range(count)))
+            elapsed = time.perf_counter() - started
+            list(executor.map(close, range(concurrency)))
+        return elapsed
+
+    async def bench_asgi(self, url, params, count, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get(number):
+            async with semaphore:
+                response = await client.get(url, uncached(params, number))
+                assert response.status_code == 200, response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(get(number) for number in range(count)))
+        return time.perf_counter() - started
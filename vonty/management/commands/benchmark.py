@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the main vonty operations and count their queries, "
+        "then compare them against the stored baseline. "
+        "Writes are rolled back. "
+        "Run generate_problems first for a realistic archive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names", nargs="*",
+            help=(
+                "Benchmarks to run, all of them by default. "
+                f"One of {', '.join(benchmarks.BENCHMARKS)}."
+            ),
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--baseline", default=settings.VONTY_BENCHMARK_BASELINE,
+            help="JSON file of the baseline results.",
+        )
+        parser.add_argument(
+            "--save", action="store_true",
+            help="Save the results as the new baseline.",
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=2.0,
+            help="Slowdown factor over the baseline time that fails.",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be positive")
+        unknown = set(options["names"]) - set(benchmarks.BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        results = benchmarks.run(options["names"], options["repeat"])
+
+        try:
+            baseline = benchmarks.load_baseline(options["baseline"])
+        except FileNotFoundError:
+            baseline = {}
+        for name, result in results.items():
+            if name.startswith("_"):
+                continue
+            line = (
+                f"{name:<20} {result['time'] * 1000:9.1f}ms "
+                f"{result['queries']:5} queries"
+            )
+            if name in baseline:
+                expected = baseline[name]
+                line += (
+                    f"   baseline {expected['time'] * 1000:9.1f}ms "
+                    f"{expected['queries']:5} queries"
+                )
+            self.stdout.write(line)
+
+        if options["save"]:
+            benchmarks.save_baseline(
+                {**baseline, **results}, options["baseline"]
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Saved the baseline to {options['baseline']}"
+            ))
+            return
+
+        if baseline.get("_dataset") not in (None, results["_dataset"]):
+            self.stderr.write(
+                f"The baseline was measured on {baseline['_dataset']}, "
+                f"not {results['_dataset']}."
+            )
+        regressions = benchmarks.compare(
+            results, baseline, options["tolerance"]
+        )
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError(f"{len(regressions)} regressions.")
+        self.stdout.write(self.style.SUCCESS("No regressions."))
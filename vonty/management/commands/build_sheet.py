@@ -0,0 +1,104 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty.models import Tag
+from vonty.picker import PickError, pick_problems
+from vonty.sheets import (
+    FORMATS, CompileError, SheetBuilder, get_compile_backend, sheet_queryset,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a LaTeX or Typst problem sheet. "
+        "Fragments of unchanged problems are reused from VONTY_SHEET_FRAGMENTS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the sheet source to write.")
+        parser.add_argument("--format", choices=FORMATS, default="tex")
+        parser.add_argument("--title", default="Problems")
+        parser.add_argument(
+            "--tag", action="append", default=[], dest="tags",
+            help="Tag name, descendants included. Can be repeated.",
+        )
+        parser.add_argument("--hardness-min", type=int)
+        parser.add_argument("--hardness-max", type=int)
+        parser.add_argument(
+            "--source", action="append", default=[], dest="sources",
+            help="Exact problem source. Can be repeated.",
+        )
+        parser.add_argument(
+            "--pick", metavar="HARDNESS",
+            help=(
+                "Pick a random problem set instead, one problem per "
+                "comma separated MOHS hardness, e.g. 10,20,30. "
+                "--tag and --exclude-tag constrain the pick."
+            ),
+        )
+        parser.add_argument(
+            "--exclude-tag", action="append", default=[], dest="excluded",
+            help="Tag name excluded from the pick. Can be repeated.",
+        )
+        parser.add_argument("--seed", type=int, help="Seed of the pick.")
+        parser.add_argument(
+            "--pdf", help="Also compile the sheet into this PDF path.",
+        )
+
+    def handle(self, *args, **options):
+        tags = self.get_tags(options["tags"])
+        if options["pick"]:
+            problems = self.pick(tags, options)
+        else:
+            problems = sheet_queryset(
+                tags=tags,
+                hardness_min=options["hardness_min"],
+                hardness_max=options["hardness_max"],
+                sources=options["sources"],
+            )
+        builder = SheetBuilder(options["format"])
+        source = builder.build(problems, title=options["title"])
+        with open(options["output"], "w", encoding="utf-8") as file:
+            file.write(source)
+        self.stdout.write(
+            f"Wrote {builder.rendered + builder.reused} problems "
+            f"({builder.rendered} rendered, {builder.reused} cached)"
+        )
+
+        if options["pdf"]:
+            try:
+                get_compile_backend().compile(
+                    source, options["format"], options["pdf"]
+                )
+            except CompileError as exc:
+                raise CommandError(f"Cannot compile the sheet: {exc}")
+            self.stdout.write(f"Compiled {options['pdf']}")
+
+    @staticmethod
+    def get_tags(names):
+        tags = list(Tag.objects.filter(name__in=names))
+        missing = set(names) - {tag.name for tag in tags}
+        if missing:
+            raise CommandError(f"Unknown tags: {', '.join(sorted(missing))}")
+        return tags
+
+    def pick(self, tags, options):
+        try:
+            curve = [int(value) for value in options["pick"].split(",")]
+        except ValueError:
+            raise CommandError("--pick expects comma separated numbers")
+        seed = options["seed"]
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        try:
+            problems = pick_problems(
+                curve,
+                required=tags,
+                excluded=self.get_tags(options["excluded"]),
+                seed=seed,
+            )
+        except PickError as exc:
+            raise CommandError(exc)
+        self.stdout.write(f"Picked {len(problems)} problems with seed {seed}")
+        return problems
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from vonty.changes import compact
+from vonty.models import Change
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the change feed, keeping only the last change "
+        "of every problem and tag."
+    )
+
+    def handle(self, *args, **options):
+        deleted = compact()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} changes, {Change.objects.count()} left."
+        ))
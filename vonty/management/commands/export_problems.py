@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty.db import read_database
+from vonty.exporter import FORMATS, encode, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream every problem with its tags and proposer to NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output", nargs="?", default="-",
+            help="Output file, or - for standard output.",
+        )
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument(
+            "--gzip", action="store_true", help="Compress the output with gzip.",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Number of problems fetched per query.",
+        )
+
+    def handle(self, *args, **options):
+        chunks = encode(
+            export_lines(options["format"], options["chunk_size"]),
+            compress=options["gzip"],
+        )
+        with read_database():
+            if options["output"] != "-":
+                with open(options["output"], "wb") as file:
+                    for chunk in chunks:
+                        file.write(chunk)
+            elif options["gzip"]:
+                # Compressed bytes need the binary buffer of the stream
+                out = getattr(self.stdout, "buffer", None)
+                if out is None:
+                    raise CommandError(
+                        "Standard output takes no bytes, give an output file."
+                    )
+                for chunk in chunks:
+                    out.write(chunk)
+                out.flush()
+            else:
+                for chunk in chunks:
+                    # Chunks end with a line, so they decode on their own
+                    self.stdout.write(chunk.decode("utf-8"), ending="")
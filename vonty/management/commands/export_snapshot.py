@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vonty.exporter import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the snapshot of the problems and tags queried offline "
+        "by python -m vonty, updating the previous one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output", nargs="?",
+            help="Snapshot file, defaults to VONTY_SNAPSHOT_PATH.",
+        )
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Fetch every problem again instead of the modified ones.",
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"] or settings.VONTY_SNAPSHOT_PATH
+        started = time.monotonic()
+        count, fetched = build_snapshot(output, full=options["full"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} problems to {output} in "
+            f"{time.monotonic() - started:.1f}s, {fetched} fetched."
+        ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vonty import duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        "List the likely duplicate problems of the whole archive, "
+        "comparing only the problems sharing a similarity bucket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threshold", type=float,
+            help="Minimum trigram similarity, defaults to VONTY_DUPLICATE_THRESHOLD.",
+        )
+        parser.add_argument(
+            "--max-bucket-size", type=int, default=duplicates.MAX_BUCKET_SIZE,
+            help="Skip the buckets shared by more problems than this.",
+        )
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Rebuild the similarity buckets of every problem first.",
+        )
+
+    def handle(self, *args, **options):
+        threshold = options["threshold"]
+        if threshold is not None and not 0 < threshold <= 1:
+            raise CommandError("--threshold must be between 0 and 1")
+        with transaction.atomic():
+            if options["rebuild"]:
+                count = duplicates.rebuild()
+            else:
+                # The problems imported without a duplicate check
+                count = duplicates.index_missing()
+        if count:
+            self.stdout.write(f"Indexed {count} problems")
+
+        pairs, skipped = duplicates.find_all_duplicates(
+            threshold, options["max_bucket_size"]
+        )
+        for score, problem, other in pairs:
+            self.stdout.write(
+                f"{score:.2f}  #{problem.pk} {problem.source or problem.desc!r}"
+                f"  #{other.pk} {other.source or other.desc!r}"
+            )
+        if skipped:
+            self.stderr.write(
+                f"Skipped {skipped} buckets of over "
+                f"{options['max_bucket_size']} problems."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Found {len(pairs)} likely duplicate pairs."
+        ))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vonty.models import Tag
+from vonty.synthetic import create_tags, deepen, generate_problems, parse_taxonomy
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic archive for benchmarks: "
+        "the tag taxonomy of vonty/fixtures/x.py deepened with extra levels, "
+        "and random problems with skewed tags. "
+        "Existing tags are reused instead of creating the taxonomy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--problems", type=int, default=100_000)
+        parser.add_argument(
+            "--depth", type=int, default=2,
+            help="Levels of synthetic tags added under every taxonomy leaf.",
+        )
+        parser.add_argument(
+            "--fanout", type=int, default=3,
+            help="Children of every synthetic tag level.",
+        )
+        parser.add_argument(
+            "--skew", type=float, default=1.1,
+            help="Exponent of the Zipf-like tag distribution.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options["problems"] < 0 or options["batch_size"] < 1:
+            raise CommandError("--problems and --batch-size must be positive")
+        started = time.monotonic()
+
+        if not Tag.objects.exists():
+            trees = deepen(parse_taxonomy(), options["depth"], options["fanout"])
+            with transaction.atomic():
+                tags = create_tags(trees)
+            self.stdout.write(f"Created {len(tags)} tags")
+
+        written = generate_problems(
+            options["problems"],
+            seed=options["seed"],
+            skew=options["skew"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {written} problems in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty.importer import ProblemImporter, RecordError, read_jsonl, read_von
+
+
+class Command(BaseCommand):
+    help = (
+        "Import problems in bulk from a JSON lines file "
+        "or a von-style directory of .tex files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="A .jsonl file or a directory of von-style .tex files.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of problems written per transaction.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help=(
+                "File recording how many records were committed. "
+                "An interrupted import run with the same checkpoint "
+                "resumes where it stopped."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Validate the input without writing anything.",
+        )
+        parser.add_argument(
+            "--no-check-duplicates", action="store_false",
+            dest="check_duplicates",
+            help=(
+                "Skip the duplicate check, for a faster import. The new "
+                "problems are indexed by the next find_duplicates run."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        batch_size = options["batch_size"]
+        checkpoint = options["checkpoint"]
+        dry_run = options["dry_run"]
+        self.verbosity = options["verbosity"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
+
+        if os.path.isdir(path):
+            records = read_von(path)
+        elif os.path.isfile(path):
+            records = read_jsonl(path)
+        else:
+            raise CommandError(f"{path} does not exist")
+
+        done, self.committing = (
+            self.read_checkpoint(checkpoint) if checkpoint else (0, 0)
+        )
+        self.done = done
+        if done:
+            self.stdout.write(f"Resuming after {done} records")
+
+        importer = ProblemImporter(
+            dry_run=dry_run, check_duplicates=options["check_duplicates"],
+        )
+        self.created = self.skipped = self.errors = 0
+        self.started = time.monotonic()
+        position = 0
+        batch = []
+
+        for position, record in enumerate(records, start=1):
+            if position <= done:
+                continue
+            try:
+                batch.append(importer.clean(record))
+            except RecordError as exc:
+                self.errors += 1
+                self.stderr.write(f"Record {position}: {exc}")
+            if len(batch) >= batch_size:
+                self.flush(importer, batch, position, checkpoint, dry_run)
+                batch = []
+        self.flush(importer, batch, position, checkpoint, dry_run)
+
+        elapsed = time.monotonic() - self.started
+        verb = "Validated" if dry_run else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.created} problems in {elapsed:.1f}s "
+            f"({self.rate(self.created, elapsed)} rows/s), "
+            f"skipped {self.skipped} existing sources, "
+            f"{self.errors} invalid records."
+        ))
+
+    def flush(self, importer, batch, position, checkpoint, dry_run):
+        # The checkpoint file cannot be part of the transaction, so it
+        # records the batch being committed first. If the import stops
+        # before the second write, the next run cannot tell whether
+        # the batch was committed and dedupes it by content.
+        resumed = self.done < self.committing
+        if checkpoint and not dry_run:
+            self.write_checkpoint(checkpoint, self.done, committing=position)
+        created, skipped = importer.write(batch, resumed=resumed)
+        self.created += len(created)
+        self.skipped += len(skipped)
+        for problem in skipped:
+            if problem.source:
+                self.stderr.write(f"Skipped existing source {problem.source!r}")
+            else:
+                self.stderr.write(f"Skipped imported problem {problem.desc!r}")
+        for problem, matches in importer.duplicates:
+            for score, other in matches:
+                self.stderr.write(
+                    f"Possible duplicate: {problem.source or problem.desc!r} "
+                    f"of {other.source or other.desc!r} ({score:.2f})"
+                )
+        if checkpoint and not dry_run:
+            self.write_checkpoint(checkpoint, position)
+        self.done = position
+        if self.verbosity > 1:
+            elapsed = time.monotonic() - self.started
+            self.stdout.write(
+                f"{position} records read, {self.created} problems, "
+                f"{self.rate(self.created, elapsed)} rows/s"
+            )
+
+    @staticmethod
+    def rate(count, elapsed):
+        return f"{count / elapsed:.0f}" if elapsed else "-"
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        """The records committed, and the records maybe committed."""
+        try:
+            with open(checkpoint, encoding="utf-8") as file:
+                data = json.load(file)
+            return data["records"], data.get("committing", data["records"])
+        except FileNotFoundError:
+            return 0, 0
+        except (ValueError, KeyError, TypeError) as exc:
+            raise CommandError(f"Invalid checkpoint file {checkpoint}: {exc}")
+
+    @staticmethod
+    def write_checkpoint(checkpoint, position, committing=None):
+        data = {"records": position}
+        if committing is not None:
+            data["committing"] = committing
+        # Write then rename, so a crash never leaves a truncated checkpoint
+        with open(checkpoint + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(checkpoint + ".tmp", checkpoint)
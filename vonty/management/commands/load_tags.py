@@ -0,0 +1,62 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vonty.tagtree import TagTreeLoader, TreeError, read_tree
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "fixtures", "tags.json"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a nested tag tree file in one transaction, adding the new tags "
+        "and applying the renames and use_filter changes to the existing ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default=os.path.normpath(DEFAULT_PATH),
+            help="A nested tags.json file, defaults to the one of vonty.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only list the changes the file would make.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.isfile(path):
+            raise CommandError(f"{path} does not exist")
+        try:
+            loader = TagTreeLoader(read_tree(path))
+            loader.load(dry_run=options["dry_run"])
+        except TreeError as exc:
+            for error in exc.errors:
+                self.stderr.write(error)
+            raise CommandError(f"{len(exc.errors)} errors, nothing was loaded.")
+
+        if options["verbosity"] > 1:
+            for tag in loader.added:
+                self.stdout.write(f"Add {tag.name}")
+            for tag, old_name in loader.renamed:
+                self.stdout.write(f"Rename {old_name} to {tag.name}")
+            for tag in loader.use_filter_changed:
+                self.stdout.write(f"Set use_filter of {tag.name} to {tag.use_filter}")
+        for tag, parent in loader.moved:
+            self.stderr.write(
+                f"Not moving {tag.name} under {parent or 'the roots'}"
+            )
+        for name in loader.missing:
+            self.stderr.write(f"Keeping {name}, which is not in the file")
+
+        counts = (
+            f"{len(loader.added)} tags, %s {len(loader.renamed)} "
+            f"and %s use_filter of {len(loader.use_filter_changed)}."
+        )
+        if options["dry_run"]:
+            message = "Would add " + counts % ("rename", "change")
+        else:
+            message = "Added " + counts % ("renamed", "changed")
+        self.stdout.write(self.style.SUCCESS(message))
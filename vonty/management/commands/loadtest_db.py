@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.utils import timezone
+
+from vonty.db import read_database
+from vonty.models import Problem
+
+DESC = "loadtest_db problem"
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer the database with concurrent readers and writers "
+        "and report throughput and lock errors. "
+        "Run it with and without VONTY_SQLITE_PRAGMAS to compare profiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options["seconds"]
+        results = {"read": [0, 0], "write": [0, 0]}
+        lock = threading.Lock()
+
+        def work(kind, operation):
+            done = errors = 0
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        operation()
+                        done += 1
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connections.close_all()
+            with lock:
+                results[kind][0] += done
+                results[kind][1] += errors
+
+        def read():
+            with read_database():
+                hardness = random.randrange(0, 65, 5)
+                list(Problem.objects.filter(hardness=hardness).order_by("pk")[:50])
+
+        def write():
+            with transaction.atomic():
+                problem = Problem.objects.create(desc=DESC, hardness=5)
+                Problem.objects.filter(pk=problem.pk).update(
+                    hardness=10, modified=timezone.now()
+                )
+
+        threads = [
+            threading.Thread(target=work, args=("read", read))
+            for _ in range(options["readers"])
+        ] + [
+            threading.Thread(target=work, args=("write", write))
+            for _ in range(options["writers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        Problem.objects.filter(desc=DESC).delete()
+
+        seconds = options["seconds"]
+        for kind, (done, errors) in results.items():
+            self.stdout.write(
+                f"{kind}s: {done / seconds:.0f}/s, {errors} lock errors"
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from vonty import fulltext
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of problems from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Database to rebuild the index in.",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if not fulltext.is_supported(connection):
+            self.stdout.write("This database has no full-text index to rebuild.")
+            return
+        fulltext.install(connection)
+        fulltext.rebuild(connection)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the search index."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vonty import tagcounts, versioning
+
+
+class Command(BaseCommand):
+    help = "Rebuild the problem counts of every tag from scratch, or verify them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report the tags whose counts are wrong.",
+        )
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            mismatches = list(tagcounts.find_mismatches())
+            for tag in mismatches:
+                self.stderr.write(
+                    f"{tag.name}: {tag.problem_count}/{tag.subtree_problem_count} "
+                    f"stored, {tag.real_problem_count}/"
+                    f"{tag.real_subtree_problem_count} real"
+                )
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} tags have wrong counts.")
+            self.stdout.write(self.style.SUCCESS("All tag counts are correct."))
+            return
+
+        with transaction.atomic():
+            tagcounts.refresh()
+            versioning.bump_on_commit()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the tag counts."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from vonty.gitsync import MirrorPool, sync_problems
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the git repositories of all problems into local mirrors "
+        "and record their latest commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of repositories fetched in parallel.",
+        )
+        parser.add_argument(
+            "--mirror-root",
+            help="Directory of the mirrors. Defaults to VONTY_GIT_MIRROR_ROOT.",
+        )
+
+    def handle(self, *args, **options):
+        changed, errors = sync_problems(
+            pool=MirrorPool(options["mirror_root"]),
+            workers=max(options["workers"], 1),
+        )
+        for url, error in errors.items():
+            self.stderr.write(f"{url}: {error}")
+        for problem in changed:
+            self.stdout.write(f"Changed: {problem.pk} {problem.git_commit}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed)} problems changed, {len(errors)} repositories failed."
+        ))
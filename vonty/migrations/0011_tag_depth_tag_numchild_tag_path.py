@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def build_root_paths(apps, schema_editor):
+    """
+    The tree columns were dropped in 0010, so every existing tag is
+    re-added as a root node, in the order in which it was created.
+    """
+    from treebeard.numconv import NumConv
+
+    Tag = apps.get_model("vonty", "Tag")
+    numconv = NumConv("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    tags = list(Tag.objects.order_by("pk"))
+    for position, tag in enumerate(tags, start=1):
+        tag.path = numconv.int2str(position).rjust(4, "0")
+        tag.depth = 1
+        tag.numchild = 0
+    Tag.objects.bulk_update(tags, ["path", "depth", "numchild"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0010_remove_tag_depth_remove_tag_numchild_remove_tag_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='depth',
+            field=models.PositiveIntegerField(default=1),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='numchild',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(build_root_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='path',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:04
+
+from django.db import migrations
+
+# A frozen copy of the index of vonty.fulltext as it was created
+CREATE_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS vonty_problem_fts USING fts5(
+    "source", "author", "desc",
+    content='vonty_problem',
+    content_rowid='id',
+    tokenize='unicode61',
+    prefix='2 3'
+)
+"""
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS vonty_problem_fts_insert
+    AFTER INSERT ON vonty_problem BEGIN
+        INSERT INTO vonty_problem_fts(rowid, "source", "author", "desc")
+        VALUES (new.id, new."source", new."author", new."desc");
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS vonty_problem_fts_delete
+    AFTER DELETE ON vonty_problem BEGIN
+        INSERT INTO vonty_problem_fts(
+            vonty_problem_fts, rowid, "source", "author", "desc"
+        )
+        VALUES ('delete', old.id, old."source", old."author", old."desc");
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS vonty_problem_fts_update
+    AFTER UPDATE OF "source", "author", "desc" ON vonty_problem BEGIN
+        INSERT INTO vonty_problem_fts(
+            vonty_problem_fts, rowid, "source", "author", "desc"
+        )
+        VALUES ('delete', old.id, old."source", old."author", old."desc");
+        INSERT INTO vonty_problem_fts(rowid, "source", "author", "desc")
+        VALUES (new.id, new."source", new."author", new."desc");
+    END
+    """,
+)
+DROP = (
+    "DROP TRIGGER IF EXISTS vonty_problem_fts_insert",
+    "DROP TRIGGER IF EXISTS vonty_problem_fts_delete",
+    "DROP TRIGGER IF EXISTS vonty_problem_fts_update",
+    "DROP TABLE IF EXISTS vonty_problem_fts",
+)
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for statement in CREATE_TRIGGERS:
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO vonty_problem_fts(vonty_problem_fts) VALUES ('rebuild')"
+        )
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0011_tag_depth_tag_numchild_tag_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
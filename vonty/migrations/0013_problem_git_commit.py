@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0012_problem_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='git_commit',
+            field=models.CharField(blank=True, editable=False, help_text='Commit of the problem repository at the last git sync.', max_length=64),
+        ),
+    ]
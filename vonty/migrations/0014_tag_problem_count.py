@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+
+
+def count_problems(apps, schema_editor):
+    # A frozen copy of vonty.tagcounts.real_counts, on the historical models
+    Problem = apps.get_model("vonty", "Problem")
+    Tag = apps.get_model("vonty", "Tag")
+    alias = schema_editor.connection.alias
+    through = Problem.tags.through.objects.using(alias).order_by()
+    direct = (
+        through.filter(tag=OuterRef("pk"))
+        .values("tag").annotate(count=Count("*")).values("count")
+    )
+    subtree = (
+        through.filter(
+            tag__path__gte=OuterRef("path"),
+            tag__path__lt=Concat(OuterRef("path"), Value("~")),
+        )
+        .annotate(group=Value(1)).values("group")
+        .annotate(count=Count("problem", distinct=True)).values("count")
+    )
+    Tag.objects.using(alias).update(
+        problem_count=Coalesce(Subquery(direct), 0),
+        subtree_problem_count=Coalesce(Subquery(subtree), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0013_problem_git_commit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='problem_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of problems with this tag. Maintained automatically.'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='subtree_problem_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of problems with this tag or one of its descendants. Maintained automatically.'),
+        ),
+        migrations.RunPython(count_problems, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:42
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+# A frozen copy of the parsing of vonty.sources, without the parts
+YEAR_RE = re.compile(r"\b(?:1[89]|20)\d\d\b")
+NUMBER_RE = re.compile(r"\d+")
+MAX_NUMBER = 2147483647
+KEY_FIELDS = ("source_contest", "source_year", "source_number")
+
+
+def parse_source(source):
+    if not source:
+        return "", None, None
+    match = YEAR_RE.search(source)
+    if match:
+        contest = source[:match.start()]
+        year = int(match.group())
+        rest = source[match.end():]
+        if not contest.strip():
+            contest = rest.partition("/")[0]
+    else:
+        contest, _sep, rest = source.partition("/")
+        year = None
+    numbers = NUMBER_RE.findall(rest)
+    number = int(numbers[-1]) if numbers else None
+    if number is not None and number > MAX_NUMBER:
+        number = None
+    return contest.strip(" /"), year, number
+
+
+def parse_sources(apps, schema_editor):
+    Problem = apps.get_model("vonty", "Problem")
+    connection = schema_editor.connection
+    queryset = (
+        Problem.objects.using(connection.alias).order_by("pk")
+        .values_list("pk", "source", *KEY_FIELDS)
+    )
+    quote = connection.ops.quote_name
+    update = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote(Problem._meta.db_table),
+        ", ".join(
+            f"{quote(Problem._meta.get_field(field).column)} = %s"
+            for field in KEY_FIELDS
+        ),
+        quote(Problem._meta.pk.column),
+    )
+    last = 0
+    while True:
+        # Pages by primary key, so no read cursor is open during the writes
+        problems = list(queryset.filter(pk__gt=last)[:2000])
+        if not problems:
+            return
+        last = problems[-1][0]
+        batch = []
+        for pk, source, *key in problems:
+            new_key = parse_source(source)
+            if tuple(key) != new_key:
+                batch.append((*new_key, pk))
+        with connection.cursor() as cursor:
+            cursor.executemany(update, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0014_tag_problem_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='source_contest',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Contest parsed from the source. e.g. IMO', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='source_number',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Problem number parsed from the source. e.g. 6', null=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='source_year',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='Year parsed from the source. e.g. 2023', null=True),
+        ),
+        migrations.RunPython(parse_sources, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['source_contest', 'source_year', 'source_number'], name='problem_contest_order'),
+        ),
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['hardness', 'source'], name='problem_hardness_order'),
+        ),
+    ]
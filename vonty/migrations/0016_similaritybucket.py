@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:53
+
+import random
+import re
+import struct
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A frozen copy of the hashing of vonty.duplicates
+TEXT_FIELDS = ("source", "author", "desc")
+SHINGLE_SIZE = 3
+NUM_BANDS = 20
+BAND_ROWS = 3
+NUM_BINS = NUM_BANDS * BAND_ROWS
+_random = random.Random(0)
+PROBES = [_random.sample(range(NUM_BINS), NUM_BINS) for _bin in range(NUM_BINS)]
+BAND_FORMAT = struct.Struct(f"<{BAND_ROWS}I")
+WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text):
+    text = " ".join(WORD_RE.findall(text.lower()))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {
+        text[start:start + SHINGLE_SIZE]
+        for start in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+def bucket_keys(shingle_set):
+    if not shingle_set:
+        return []
+    bins = [None] * NUM_BINS
+    for shingle in shingle_set:
+        value, bin_index = divmod(zlib.crc32(shingle.encode()), NUM_BINS)
+        if bins[bin_index] is None or value < bins[bin_index]:
+            bins[bin_index] = value
+    values = [
+        value if value is not None else next(
+            bins[probe] for probe in PROBES[index] if bins[probe] is not None
+        )
+        for index, value in enumerate(bins)
+    ]
+    return [
+        band << 32 | zlib.crc32(BAND_FORMAT.pack(
+            *values[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+        ))
+        for band in range(NUM_BANDS)
+    ]
+
+
+def index_problems(apps, schema_editor):
+    Problem = apps.get_model("vonty", "Problem")
+    SimilarityBucket = apps.get_model("vonty", "SimilarityBucket")
+    connection = schema_editor.connection
+    queryset = (
+        Problem.objects.using(connection.alias).order_by("pk")
+        .values_list("pk", *TEXT_FIELDS)
+    )
+    quote = connection.ops.quote_name
+    insert = "INSERT INTO {} ({}, {}) VALUES (%s, %s)".format(
+        quote(SimilarityBucket._meta.db_table),
+        quote(SimilarityBucket._meta.get_field("key").column),
+        quote(SimilarityBucket._meta.get_field("problem").column),
+    )
+    last = 0
+    while True:
+        problems = list(queryset.filter(pk__gt=last)[:2000])
+        if not problems:
+            return
+        last = problems[-1][0]
+        with connection.cursor() as cursor:
+            cursor.executemany(insert, [
+                (key, pk)
+                for pk, *text in problems
+                for key in set(bucket_keys(shingles(
+                    " ".join(value or "" for value in text)
+                )))
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0015_problem_source_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='vonty.problem')),
+            ],
+        ),
+        migrations.RunPython(index_problems, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0016_similaritybucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Time of the last change to the problem or its tags.'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_everything(apps, schema_editor):
+    # A change for every tag, in path order, then every problem,
+    # so that the changes after 0 are the whole archive
+    Change = apps.get_model("vonty", "Change")
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    columns = ", ".join(
+        quote(Change._meta.get_field(field).column)
+        for field in ("kind", "object_id", "deleted", "created")
+    )
+    created = connection.ops.adapt_datetimefield_value(
+        django.utils.timezone.now()
+    )
+    with connection.cursor() as cursor:
+        for kind, model_name, order in (
+            ("tag", "Tag", "path"), ("problem", "Problem", "id"),
+        ):
+            model = apps.get_model("vonty", model_name)
+            cursor.execute(
+                "INSERT INTO {} ({}) SELECT %s, {}, %s, %s FROM {} "
+                "ORDER BY {}".format(
+                    quote(Change._meta.db_table), columns,
+                    quote(model._meta.pk.column), quote(model._meta.db_table),
+                    quote(model._meta.get_field(order).column),
+                ),
+                [kind, False, created],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0017_problem_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('problem', 'Problem'), ('tag', 'Tag')], max_length=7)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='vonty_chang_kind_e1d0e7_idx')],
+            },
+        ),
+        migrations.RunPython(record_everything, migrations.RunPython.noop),
+    ]
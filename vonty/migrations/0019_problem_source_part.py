@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:25
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# A frozen copy of the parsing of vonty.sources
+YEAR_RE = re.compile(r"\b(?:1[89]|20)\d\d\b")
+NUMBER_RE = re.compile(r"\b([A-Z]?)(\d+)")
+MAX_NUMBER = 2147483647
+KEY_FIELDS = ("source_contest", "source_year", "source_part", "source_number")
+
+
+def parse_source(source):
+    if not source:
+        return "", None, "", None
+    match = YEAR_RE.search(source)
+    if match:
+        contest = source[:match.start()]
+        year = int(match.group())
+        rest = source[match.end():]
+        if not contest.strip():
+            contest = rest.partition("/")[0]
+    else:
+        contest, _sep, rest = source.partition("/")
+        year = None
+    numbers = NUMBER_RE.findall(rest)
+    part, number = numbers[-1] if numbers else ("", None)
+    if number is not None:
+        number = int(number)
+        if number > MAX_NUMBER:
+            part, number = "", None
+    return contest.strip(" /"), year, part, number
+
+
+def parse_sources(apps, schema_editor):
+    Problem = apps.get_model("vonty", "Problem")
+    connection = schema_editor.connection
+    queryset = (
+        Problem.objects.using(connection.alias).order_by("pk")
+        .values_list("pk", "source", *KEY_FIELDS)
+    )
+    quote = connection.ops.quote_name
+    # Stamped for the incremental snapshots, as the update skips auto_now
+    update = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote(Problem._meta.db_table),
+        ", ".join(
+            f"{quote(Problem._meta.get_field(field).column)} = %s"
+            for field in (*KEY_FIELDS, "modified")
+        ),
+        quote(Problem._meta.pk.column),
+    )
+    modified = connection.ops.adapt_datetimefield_value(timezone.now())
+    last = 0
+    while True:
+        # Pages by primary key, so no read cursor is open during the writes
+        problems = list(queryset.filter(pk__gt=last)[:2000])
+        if not problems:
+            return
+        last = problems[-1][0]
+        batch = []
+        for pk, source, *key in problems:
+            new_key = parse_source(source)
+            if tuple(key) != new_key:
+                batch.append((*new_key, modified, pk))
+        with connection.cursor() as cursor:
+            cursor.executemany(update, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vonty', '0018_change'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='problem',
+            name='problem_contest_order',
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='source_part',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Part of the contest parsed from the source. e.g. G for G1', max_length=1),
+        ),
+        migrations.RunPython(parse_sources, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['source_contest', 'source_year', 'source_part', 'source_number'], name='problem_source_order'),
+        ),
+    ]
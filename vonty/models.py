@@ -2,13 +2,73 @@
 Vonty models:
 1. Problem
 2. Tag
+3. SimilarityBucket
+4. Change
 """
 
 from django.core.validators import MaxValueValidator, StepValueValidator
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from treebeard.exceptions import PathOverflow
+from treebeard.mp_tree import MP_Node, MP_NodeManager
+
+from . import fulltext, sources
+from .signals import tag_moved
+
+
+class ProblemQuerySet(models.QuerySet):
+    def with_tags(self, *tags):
+        """
+        Filter problems tagged with any of the given tags
+        or any of their descendants.
+        This is a single query driven by the indexed tag path.
+        """
+        subtrees = Q()
+        for tag in tags:
+            subtrees |= tag.subtree_q("tag__path")
+
+        through = self.model.tags.through
+        return self.filter(Exists(
+            through.objects.filter(subtrees, problem=OuterRef("pk"))
+        ))
+
+    def search(self, query):
+        """
+        Filter problems matching every word of the query
+        in their source, author or description.
+        A trailing * matches prefixes. e.g. Fiend*
+        The problems are annotated with search_rank, lower is better.
+        """
+        terms = fulltext.parse_terms(query)
+        if not terms:
+            return self.none()
+
+        if not fulltext.is_supported(connections[self.db]):
+            return self.filter(fulltext.fallback_q(terms)).annotate(
+                search_rank=Value(0.0, output_field=models.FloatField())
+            )
+
+        # The ranks are looked up in one uncorrelated subquery, which
+        # SQLite runs once and indexes, LIMIT -1 keeping it from being
+        # flattened. A correlated MATCH would run again for every problem.
+        match = fulltext.match_expression(terms)
+        table = self.model._meta.db_table
+        fts = fulltext.FTS_TABLE
+        return self.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (match,),
+        )).annotate(search_rank=RawSQL(
+            f"SELECT ranks.rank FROM (SELECT rowid, rank FROM {fts} "
+            f"WHERE {fts} MATCH %s LIMIT -1) AS ranks "
+            f"WHERE ranks.rowid = {table}.id",
+            (match,),
+            output_field=models.FloatField(),
+        ))
+
 
 class Problem(models.Model):
     source = models.CharField(
@@ -77,18 +137,91 @@ class Problem(models.Model):
             "See LINK TO GIT PULL DOCUMENTATION."
         ),
     )
+    git_commit = models.CharField(
+        max_length=64, blank=True, editable=False, help_text=_(
+            "Commit of the problem repository at the last git sync."
+        ),
+    )
     tags = models.ManyToManyField(
         "Tag",
         blank=True,
         related_name="problem_set",
         help_text=_("The list of tags associated with the problem."),
     )
+    source_contest = models.CharField(
+        max_length=50, blank=True, default="", editable=False, help_text=_(
+            "Contest parsed from the source. e.g. IMO"
+        ),
+    )
+    source_year = models.PositiveSmallIntegerField(
+        null=True, blank=True, editable=False, help_text=_(
+            "Year parsed from the source. e.g. 2023"
+        ),
+    )
+    source_part = models.CharField(
+        max_length=1, blank=True, default="", editable=False, help_text=_(
+            "Part of the contest parsed from the source. e.g. G for G1"
+        ),
+    )
+    source_number = models.PositiveIntegerField(
+        null=True, blank=True, editable=False, help_text=_(
+            "Problem number parsed from the source. e.g. 6"
+        ),
+    )
+    modified = models.DateTimeField(
+        auto_now=True, db_index=True, help_text=_(
+            "Time of the last change to the problem or its tags."
+        ),
+    )
+
+    objects = ProblemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Listings by contest, then year, then part, then number
+            models.Index(
+                fields=[
+                    "source_contest", "source_year", "source_part",
+                    "source_number",
+                ],
+                name="problem_source_order",
+            ),
+            # The default keyset order, see vonty.search
+            models.Index(
+                fields=["hardness", "source"], name="problem_hardness_order",
+            ),
+        ]
 
     def __str__(self):
         return self.desc
 
+    def save(self, *args, **kwargs):
+        # Keep the parsed source columns in sync with the source
+        sources.set_source_key(self)
+        update_fields = kwargs.get("update_fields")
+        if update_fields:
+            update_fields = {*update_fields, "modified"}
+            if "source" in update_fields:
+                update_fields.update(sources.KEY_FIELDS)
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
+
+class TagManager(MP_NodeManager):
+    def move(self, node, target, pos=None):
+        """Move a tag, then send tag_moved."""
+        old_ancestors = list(self.get_ancestors(node).values_list("pk", flat=True))
+        super().move(node, target, pos)
+        new_ancestors = list(self.get_ancestors(node).values_list("pk", flat=True))
+        tag_moved.send(
+            sender=self.model,
+            tag=node,
+            old_ancestors=old_ancestors,
+            new_ancestors=new_ancestors,
+        )
+
 
-class Tag(models.Model):
+class Tag(MP_Node):
     name = models.SlugField(
         unique=True,
         help_text=_("Unique dentifier slug. e.g. angle-chase"),
@@ -105,15 +238,137 @@ class Tag(models.Model):
             "used as umbrella parent tags and not as filters."
         ),
     )
+    problem_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text=_(
+            "Number of problems with this tag. Maintained automatically."
+        ),
+    )
+    subtree_problem_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text=_(
+            "Number of problems with this tag or one of its descendants. "
+            "Maintained automatically."
+        ),
+    )
+
+    objects = TagManager()
 
     def __str__(self):
         return self.name.replace("-", " ").replace("_", " ").title()
 
+    def subtree_q(self, field="path"):
+        """
+        A Q object matching the paths of this tag and all of its descendants.
+        Written as a range rather than a LIKE so that it hits the path index.
+        """
+        return Q(**{
+            f"{field}__gte": self.path,
+            # Every character of the path alphabet sorts before "~"
+            f"{field}__lt": self.path + "~",
+        })
+
+    def get_subtree(self):
+        """Get a queryset of this tag and all of its descendants."""
+        return Tag.objects.filter(self.subtree_q())
+
+    @transaction.atomic
     def add_children(self, children, use_filter=True):
         """
         Add a list of children to the tag in bulk.
         Each child is made with a blank description
         and use_filter is set to the value of the use_filter flag.
+        The children are appended after the existing ones
+        with a single insert and a single parent update.
         """
-        for name in children:
-            self.add_child(name=name, use_filter=use_filter)
+        if not children:
+            return []
+
+        # The paths are built with private helpers of treebeard's MP_Node
+        # (_get_path, _int2str, _get_lastpos_in_path) as of treebeard 7.0,
+        # pinned below 8 in requirements.txt for them: check them before
+        # upgrading.
+        # Lock the parent row, as treebeard does in add_child
+        parent = Tag.objects.select_for_update().get(pk=self.pk)
+        start = 1
+        if not parent.is_leaf():
+            start += Tag.objects.get_last_child(parent)._get_lastpos_in_path()
+
+        depth = parent.depth + 1
+        last = start + len(children) - 1
+        if (
+            len(self._int2str(last)) > self.steplen
+            or depth * self.steplen > self._meta.get_field("path").max_length
+        ):
+            raise PathOverflow(_("Too many children for tag %s") % self.name)
+
+        tags = Tag.objects.bulk_create(
+            Tag(
+                name=name,
+                use_filter=use_filter,
+                depth=depth,
+                path=self._get_path(parent.path, depth, position),
+            )
+            for position, name in enumerate(children, start=start)
+        )
+        Tag.objects.filter(pk=self.pk).update(
+            numchild=F("numchild") + len(tags)
+        )
+        self.numchild = parent.numchild + len(tags)
+        # bulk_create sends no signals
+        Change.record(Change.TAG, [tag.pk for tag in tags])
+        # Imported here, as autocomplete imports the models
+        from . import autocomplete
+        autocomplete.tags_changed(tag.pk for tag in tags)
+        return tags
+
+
+class SimilarityBucket(models.Model):
+    """
+    An LSH bucket a problem falls in, see vonty.duplicates.
+    Problems sharing a bucket are candidate duplicates.
+    """
+    key = models.BigIntegerField(db_index=True)
+    problem = models.ForeignKey(
+        Problem, on_delete=models.CASCADE, related_name="+",
+    )
+
+
+class Change(models.Model):
+    """
+    An entry of the change feed, see vonty.changes:
+    a problem or tag was saved or deleted. The id is the sequence number.
+    """
+    PROBLEM = "problem"
+    TAG = "tag"
+
+    kind = models.CharField(
+        max_length=7, choices=[(PROBLEM, _("Problem")), (TAG, _("Tag"))],
+    )
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["kind", "object_id"])]
+
+    @classmethod
+    def record(cls, kind, pks, deleted=False):
+        """Append a change for each primary key, in the current transaction."""
+        pks = list(pks)
+        if not pks:
+            return
+        # Every write appends changes, bulk_create would spend
+        # longer building the instances than SQLite inserting them
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        insert = "INSERT INTO {} ({}) VALUES (%s, %s, %s, %s)".format(
+            quote(cls._meta.db_table),
+            ", ".join(
+                quote(cls._meta.get_field(field).column)
+                for field in ("kind", "object_id", "deleted", "created")
+            ),
+        )
+        created = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                insert, [(kind, pk, deleted, created) for pk in pks]
+            )
@@ -0,0 +1,296 @@
+"""
+Vonty problem-set picker.
+
+Picks a random set of problems following a MOHS hardness curve,
+e.g. 10,20,30,15,25,40 for a 6-problem mock contest, with required
+and excluded tags (descendants included) and at most one problem
+per source paper, e.g. one of USAMO 2004/1 and USAMO 2004/5.
+When a slot cannot be filled, the picks of the slots before it are
+changed, within a budget of MAX_STEPS picks.
+
+Problem ids are kept in an in-memory ProblemPool bucketed by hardness
+and by tag, so a pick never scans the problem table. The pool is
+reloaded when problems or tags change in this process, and at least
+every VONTY_PICKER_POOL_TTL seconds for changes made by other ones.
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from .models import Problem, Tag
+from .sheets import sheet_queryset
+from .signals import tag_moved
+
+MAX_PROBLEMS = 50
+# Candidates drawn at random before scanning the whole bucket
+SAMPLE_TRIES = 32
+# Problems tried per slot, and in all, before giving up on a pick
+MAX_ALTERNATIVES = 8
+MAX_STEPS = 1000
+
+_pool = None
+_lock = threading.Lock()
+
+
+class PickError(Exception):
+    """The constraints of a pick cannot be satisfied."""
+
+
+class ProblemPool:
+    """The ids of the rated problems, bucketed by hardness and by tag."""
+
+    def __init__(self, rows, tag_rows):
+        self.loaded_at = time.monotonic()
+        self.by_hardness = defaultdict(list)
+        self.papers = {}
+        for pk, hardness, source, contest, year in rows:
+            self.by_hardness[hardness].append(pk)
+            # The paper of the source, e.g. USAMO 2004 for USAMO 2004/5,
+            # from the columns parsed by vonty.sources
+            self.papers[pk] = (contest, year) if source else None
+        self.by_tag = defaultdict(list)
+        for problem_id, tag_id in tag_rows:
+            if problem_id in self.papers:
+                self.by_tag[tag_id].append(problem_id)
+        self.subtrees = {}
+
+    @classmethod
+    def load(cls):
+        rows = (
+            Problem.objects.filter(hardness__isnull=False)
+            .order_by("pk").values_list(
+                "pk", "hardness", "source", "source_contest", "source_year",
+            )
+        )
+        tag_rows = (
+            Problem.tags.through.objects
+            .order_by("problem_id").values_list("problem_id", "tag_id")
+        )
+        return cls(rows, tag_rows)
+
+    def subtree_problems(self, tag):
+        """The ids of the problems tagged with the tag or a descendant."""
+        if tag.path not in self.subtrees:
+            tag_ids = (
+                Tag.objects.filter(tag.subtree_q()).values_list("pk", flat=True)
+            )
+            self.subtrees[tag.path] = frozenset(
+                pk for tag_id in tag_ids for pk in self.by_tag.get(tag_id, ())
+            )
+        return self.subtrees[tag.path]
+
+    def pick(self, curve, required=(), excluded=(), spread=5, rand=random):
+        """
+        Pick one problem id per hardness of the curve.
+        A slot falls back to hardness within spread of its target,
+        nearest first, when its own bucket has no suitable problem.
+        Raises PickError when no set is found.
+        """
+        allowed = None
+        for tag in required:
+            problems = self.subtree_problems(tag)
+            allowed = problems if allowed is None else allowed & problems
+        forbidden = frozenset().union(
+            *(self.subtree_problems(tag) for tag in excluded)
+        )
+        chosen, papers = set(), set()
+
+        def suitable(pk):
+            paper = self.papers[pk]
+            return (
+                pk not in chosen
+                and (paper is None or paper not in papers)
+                and (allowed is None or pk in allowed)
+                and pk not in forbidden
+            )
+
+        def candidates(target):
+            """Yield the suitable problems for a slot, in random order."""
+            for offset in sorted(range(-spread, spread + 1, 5), key=abs):
+                bucket = self.by_hardness.get(target + offset, ())
+                if not bucket:
+                    continue
+                tried = set()
+                for _try in range(SAMPLE_TRIES):
+                    pk = rand.choice(bucket)
+                    if pk not in tried:
+                        tried.add(pk)
+                        if suitable(pk):
+                            yield pk
+                for pk in rand.sample(bucket, len(bucket)):
+                    if pk not in tried and suitable(pk):
+                        yield pk
+
+        picks = {}
+        # Fill the slots with the fewest candidates first
+        slots = sorted(
+            range(len(curve)),
+            key=lambda i: len(self.by_hardness.get(curve[i], ())),
+        )
+        steps = 0
+        # Index in slots of the furthest slot that could not be filled
+        failed = 0
+
+        def fill(index):
+            """Fill the slots from index on, changing their picks if need be."""
+            nonlocal steps, failed
+            if index == len(slots):
+                return True
+            slot = slots[index]
+            for pk in islice(candidates(curve[slot]), MAX_ALTERNATIVES):
+                if steps == MAX_STEPS:
+                    break
+                steps += 1
+                picks[slot] = pk
+                paper = self.papers[pk]
+                chosen.add(pk)
+                papers.add(paper)
+                if fill(index + 1):
+                    return True
+                chosen.discard(pk)
+                papers.discard(paper)
+            failed = max(failed, index)
+            return False
+
+        if not fill(0):
+            raise PickError(
+                _("No problem left for hardness %(hardness)s")
+                % {"hardness": curve[slots[failed]]}
+            )
+        return [picks[slot] for slot in range(len(curve))]
+
+
+def get_pool():
+    global _pool
+    ttl = getattr(settings, "VONTY_PICKER_POOL_TTL", 300)
+    with _lock:
+        if _pool is None or time.monotonic() - _pool.loaded_at > ttl:
+            _pool = ProblemPool.load()
+        return _pool
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Problem.tags.through)
+@receiver(tag_moved)
+def invalidate(**kwargs):
+    """Drop the pool, it is reloaded by the next pick."""
+    global _pool
+    with _lock:
+        _pool = None
+
+
+def pick_problems(curve, required=(), excluded=(), spread=5, seed=None):
+    """
+    Pick problems following the hardness curve, see ProblemPool.pick.
+    Returns the problems, with their tags prefetched, in curve order.
+    The same seed picks the same problems from the same archive.
+    """
+    for _attempt in range(2):
+        ids = get_pool().pick(
+            curve, required, excluded, spread, random.Random(seed)
+        )
+        problems = sheet_queryset().select_related("proposer").in_bulk(ids)
+        if len(problems) == len(ids):
+            return [problems[pk] for pk in ids]
+        # Problems were deleted by another process since the pool loaded
+        invalidate()
+    raise PickError(_("The archive changed during the pick, try again"))
+
+
+class ProblemPickForm(forms.Form):
+    hardness = forms.CharField(
+        help_text=_(
+            "Comma separated MOHS hardness of each problem. e.g. 10,20,30"
+        ),
+    )
+    tags = forms.CharField(
+        required=False, help_text=_(
+            "Space/comma separated tag names. "
+            "Every problem must match every tag, or one of its descendants."
+        ),
+    )
+    exclude = forms.CharField(
+        required=False, help_text=_(
+            "Space/comma separated tag names. "
+            "No problem may match a tag, or one of its descendants."
+        ),
+    )
+    spread = forms.IntegerField(
+        required=False, min_value=0, max_value=60, step_size=5,
+        help_text=_(
+            "How far from its target the hardness of a problem may be, "
+            "if no problem matches exactly. Defaults to 5."
+        ),
+    )
+    seed = forms.IntegerField(
+        required=False, min_value=0, help_text=_(
+            "Seed of the pick. The same seed picks the same problems."
+        ),
+    )
+
+    def clean_hardness(self):
+        try:
+            curve = [
+                int(value) for value in
+                self.cleaned_data["hardness"].replace(",", " ").split()
+            ]
+        except ValueError:
+            raise ValidationError(_("Enter whole numbers"))
+        if not 1 <= len(curve) <= MAX_PROBLEMS:
+            raise ValidationError(
+                _("Pick between 1 and %(max)s problems"),
+                params={"max": MAX_PROBLEMS},
+            )
+        if any(value % 5 or not 0 <= value <= 60 for value in curve):
+            raise ValidationError(
+                _("MOHS ratings are multiples of 5 from 0 to 60")
+            )
+        return curve
+
+    def clean_tag_names(self, field):
+        names = self.cleaned_data[field].replace(",", " ").split()
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+        missing = [name for name in names if name not in tags]
+        if missing:
+            raise ValidationError(
+                _("Unknown tags: %(names)s"),
+                params = {"names": ", ".join(missing)},
+            )
+        return [tags[name] for name in names]
+
+    def clean_tags(self):
+        return self.clean_tag_names("tags")
+
+    def clean_exclude(self):
+        return self.clean_tag_names("exclude")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get("seed") is None:
+            cleaned_data["seed"] = random.randrange(2 ** 31)
+        if cleaned_data.get("spread") is None:
+            cleaned_data["spread"] = 5
+        return cleaned_data
+
+    def pick(self):
+        """Pick the problems, raises PickError."""
+        data = self.cleaned_data
+        return pick_problems(
+            data["hardness"],
+            required=data["tags"],
+            excluded=data["exclude"],
+            spread=data["spread"],
+            seed=data["seed"],
+        )
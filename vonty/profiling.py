@@ -0,0 +1,224 @@
+"""
+Vonty request profiling.
+
+ProfilingMiddleware records a sample of the requests, see
+VONTY_PROFILE_SAMPLE_RATE: their duration, their number of queries,
+the total SQL time, the slowest statements and the query shapes that
+repeat, which is how N+1 patterns show up (the same SELECT once per row).
+Sampled responses get a Server-Timing header, and the last records are
+kept in an in-memory ring buffer served to staff by views.profiling.
+The buffer is per process.
+
+The middleware runs sync or async. Every connection carries a wrapper
+recording into the recorder of the current context, which sync_to_async
+carries over, so the queries of async views made on the threads of the
+async ORM are recorded too.
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SLOWEST = 5
+
+_records = deque(maxlen=getattr(settings, "VONTY_PROFILE_BUFFER_SIZE", 200))
+_lock = threading.Lock()
+_recorder = ContextVar("vonty_query_recorder", default=None)
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+
+
+def get_sample_rate():
+    return getattr(settings, "VONTY_PROFILE_SAMPLE_RATE", 0.01)
+
+
+def query_shape(sql):
+    """
+    Normalize a statement so that queries differing only by their
+    parameters have the same shape.
+    e.g. ... WHERE id = 3 and ... WHERE id IN (%s, %s) become
+    ... WHERE id = %s and ... WHERE id IN (...)
+    """
+    sql = STRING_RE.sub("%s", sql)
+    sql = NUMBER_RE.sub("%s", sql)
+    return IN_LIST_RE.sub("(...)", sql)
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper recording
+    the duration of every statement.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((
+                time.perf_counter() - start,
+                context["connection"].alias,
+                sql,
+            ))
+
+    @property
+    def sql_time(self):
+        return sum(duration for duration, _alias, _sql in self.queries)
+
+    def slowest(self, count=SLOWEST):
+        return [
+            {"ms": round(duration * 1000, 3), "db": alias, "sql": sql}
+            for duration, alias, sql in sorted(
+                self.queries, key=lambda query: query[0], reverse=True
+            )[:count]
+        ]
+
+    def repeated(self, threshold):
+        """The query shapes run at least threshold times, most run first."""
+        counts = Counter()
+        durations = defaultdict(float)
+        for duration, _alias, sql in self.queries:
+            shape = query_shape(sql)
+            counts[shape] += 1
+            durations[shape] += duration
+        return [
+            {
+                "count": count,
+                "ms": round(durations[shape] * 1000, 3),
+                "sql": shape,
+            }
+            for shape, count in counts.most_common()
+            if count >= threshold
+        ]
+
+
+def record_execute(execute, sql, params, many, context):
+    """The execute wrapper of every connection."""
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recorder(sender, connection, **kwargs):
+    """Wrap the executions of a new connection with record_execute."""
+    if record_execute not in connection.execute_wrappers:
+        # First, as execute_wrapper() blocks pop the last wrapper
+        connection.execute_wrappers.insert(0, record_execute)
+
+
+@contextmanager
+def record_queries():
+    """
+    Record the queries of every database made within the block,
+    including the ones of the async ORM, on other threads.
+    """
+    for alias in connections:
+        # Connections opened before the app was ready
+        install_recorder(None, connections[alias])
+    recorder = QueryRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def get_records():
+    """The recorded requests, most recent first."""
+    with _lock:
+        return list(reversed(_records))
+
+
+def clear_records():
+    with _lock:
+        _records.clear()
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of the requests.
+    Only the queries made until the view returns are recorded,
+    so the content of streaming responses is not covered.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @property
+    def sample_rate(self):
+        return get_sample_rate()
+
+    @property
+    def repeat_threshold(self):
+        return getattr(settings, "VONTY_PROFILE_REPEAT_THRESHOLD", 5)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.record(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        return self.record(request, response, recorder, start)
+
+    def record(self, request, response, recorder, start):
+        """Record the request and add the Server-Timing header."""
+        duration = time.perf_counter() - start
+        record = {
+            "time": time.time(),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "ms": round(duration * 1000, 3),
+            "queries": len(recorder.queries),
+            "sql_ms": round(recorder.sql_time * 1000, 3),
+            "slowest": recorder.slowest(),
+            "repeated": recorder.repeated(self.repeat_threshold),
+        }
+        with _lock:
+            _records.append(record)
+        if record["repeated"]:
+            logger.warning(
+                "Possible N+1 queries in %s %s: %s run %d times",
+                request.method, record["path"],
+                record["repeated"][0]["sql"], record["repeated"][0]["count"],
+            )
+
+        response["Server-Timing"] = (
+            f'sql;desc="{len(recorder.queries)} queries";'
+            f"dur={record['sql_ms']}, app;dur={record['ms']}"
+        )
+        return response
@@ -0,0 +1,296 @@
+"""
+Vonty query language.
+
+Queries use the von filter syntax, e.g.
+
+    geometry inversion -projective hardness>=25 source:ISL*
+
+Terms next to each other are ANDed, OR and parentheses group them
+and a leading - (or NOT) negates a term. A term is one of
+    a tag name, which matches its descendants too,
+    hardness>=25, with any of = >= <= > <,
+    source:ISL* (prefix) or source:"USAMO 2004/5" (exact),
+    author:chen (contains), proposer:evan (username).
+
+A query compiles into a single Q over the problem table:
+tags become EXISTS subqueries on the tag path ranges, with the tags
+ORed or negated together sharing one subquery, hardness terms ANDed
+together fold into one range, and source prefixes become ranges on the
+unique source index. Compiled plans are cached per query string,
+until tags change in this process or VONTY_QUERY_PLAN_TTL seconds pass.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Problem, Tag
+from .signals import tag_moved
+
+# Sorts after every character, bounds the source prefix ranges
+MAX_CHAR = "\U0010ffff"
+FIELDS = {"source", "author", "proposer"}
+COMPARISONS = {
+    "=": "exact",
+    ":": "exact",
+    ">=": "gte",
+    "<=": "lte",
+    ">": "gt",
+    "<": "lt",
+}
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<negate>-)(?=\S)
+      | hardness(?P<op>>=|<=|=|:|>|<)(?P<number>\S*?)(?=[\s()]|$)
+      | (?P<field>\w+):(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s()]+))
+      | (?P<word>[\w-]+)
+    )
+""", re.VERBOSE)
+
+_plans = OrderedDict()
+_lock = threading.Lock()
+
+
+class QueryError(ValueError):
+    """A query that cannot be parsed."""
+
+
+def tokenize(query):
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN_RE.match(query, position)
+        if not match:
+            raise QueryError(f"Unexpected {query[position:].strip()[:10]!r}")
+        position = match.end()
+        if match["paren"]:
+            tokens.append(match["paren"])
+        elif match["negate"]:
+            tokens.append("NOT")
+        elif match["op"]:
+            try:
+                number = int(match["number"])
+            except ValueError:
+                raise QueryError(f"Invalid hardness {match['number']!r}")
+            tokens.append(("hardness", COMPARISONS[match["op"]], number))
+        elif match["field"]:
+            field = match["field"]
+            if field not in FIELDS:
+                raise QueryError(f"Unknown field {field!r}")
+            if match["quoted"] is not None:
+                tokens.append((field, "exact", match["quoted"]))
+            elif field == "source" and match["value"].endswith("*"):
+                tokens.append((field, "prefix", match["value"][:-1]))
+            else:
+                tokens.append((field, "value", match["value"]))
+        elif match["word"].upper() in ("AND", "OR", "NOT"):
+            tokens.append(match["word"].upper())
+        else:
+            tokens.append(("tag", match["word"]))
+    return tokens
+
+
+def parse_query(query):
+    """
+    Parse a query into a tree of tuples: ("and", [nodes]), ("or", [nodes]),
+    ("not", node) and ("tag", name), ("hardness", lookup, number)
+    or (field, kind, value) terms.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        raise QueryError("Empty query")
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "OR":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                take()
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not():
+        token = peek()
+        if token == "NOT":
+            take()
+            return ("not", parse_not())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise QueryError("Missing closing parenthesis")
+            take()
+            return node
+        if isinstance(token, tuple):
+            return take()
+        raise QueryError(f"Expected a term, got {token or 'the end'}")
+
+    node = parse_or()
+    if peek() is not None:
+        raise QueryError(f"Unexpected {peek()}")
+    return node
+
+
+def tag_names(node):
+    """The tag names used in a parsed query."""
+    if node[0] in ("and", "or"):
+        return set().union(*(tag_names(child) for child in node[1]))
+    if node[0] == "not":
+        return tag_names(node[1])
+    return {node[1]} if node[0] == "tag" else set()
+
+
+class QueryCompiler:
+    """Compile a parsed query into a Q, given the tags by name."""
+
+    def __init__(self, tags):
+        self.tags = tags
+
+    def tags_exist(self, names):
+        """One EXISTS matching any of the tags, or their descendants."""
+        subtrees = Q()
+        for name in names:
+            subtrees |= self.tags[name].subtree_q("tag__path")
+        through = Problem.tags.through
+        return Q(Exists(
+            through.objects.filter(subtrees, problem=OuterRef("pk"))
+        ))
+
+    def term(self, node):
+        kind, lookup, value = node
+        if kind == "hardness":
+            return Q(**{f"hardness__{lookup}": value})
+        if kind == "source":
+            if lookup == "prefix":
+                return Q(source__gte=value, source__lt=value + MAX_CHAR)
+            return Q(source=value)
+        if kind == "author":
+            if lookup == "exact":
+                return Q(author=value)
+            return Q(author__icontains=value)
+        return Q(proposer__username=value)
+
+    def compile(self, node):
+        kind = node[0]
+        if kind == "tag":
+            return self.tags_exist([node[1]])
+        if kind == "not":
+            return ~self.compile(node[1])
+        if kind == "and":
+            return self.compile_and(node[1])
+        if kind == "or":
+            return self.compile_or(node[1])
+        return self.term(node)
+
+    def compile_and(self, nodes):
+        q = Q()
+        excluded = []
+        low, high = None, None
+        for node in nodes:
+            if node[0] == "not" and node[1][0] == "tag":
+                excluded.append(node[1][1])
+            elif node[0] == "hardness" and node[1] != "exact":
+                # Fold the bounds into one range
+                lookup, value = node[1], node[2]
+                if lookup in ("gt", "gte"):
+                    value += lookup == "gt"
+                    low = value if low is None else max(low, value)
+                else:
+                    value -= lookup == "lt"
+                    high = value if high is None else min(high, value)
+            else:
+                q &= self.compile(node)
+        if low is not None and high is not None and low > high:
+            return Q(pk__in=[])
+        if low is not None:
+            q &= Q(hardness__gte=low)
+        if high is not None:
+            q &= Q(hardness__lte=high)
+        if excluded:
+            q &= ~self.tags_exist(excluded)
+        return q
+
+    def compile_or(self, nodes):
+        q = Q()
+        tags = [node[1] for node in nodes if node[0] == "tag"]
+        if tags:
+            q |= self.tags_exist(tags)
+        for node in nodes:
+            if node[0] != "tag":
+                q |= self.compile(node)
+        return q
+
+
+def compile_query(query):
+    """
+    Compile a query into a Q filtering problems.
+    Raises QueryError for invalid queries and unknown tags.
+    """
+    tree = parse_query(query)
+    names = tag_names(tree)
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    missing = names - set(tags)
+    if missing:
+        raise QueryError(f"Unknown tags: {', '.join(sorted(missing))}")
+    return QueryCompiler(tags).compile(tree)
+
+
+def get_plan(query):
+    """The compiled plan of a query, from the cache if possible."""
+    # Keyed by the tokens, which ignore the whitespace between
+    # them but keep the one within quoted values
+    key = tuple(tokenize(query))
+    ttl = getattr(settings, "VONTY_QUERY_PLAN_TTL", 300)
+    with _lock:
+        entry = _plans.get(key)
+        if entry and time.monotonic() - entry[1] <= ttl:
+            _plans.move_to_end(key)
+            return entry[0]
+    plan = compile_query(query)
+    with _lock:
+        _plans[key] = (plan, time.monotonic())
+        while len(_plans) > getattr(settings, "VONTY_QUERY_CACHE_SIZE", 256):
+            _plans.popitem(last=False)
+    return plan
+
+
+def clear_plans(**kwargs):
+    with _lock:
+        _plans.clear()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(tag_moved)
+def tags_changed(**kwargs):
+    # Plans embed the tag paths
+    transaction.on_commit(clear_plans)
+
+
+def filter_problems(queryset, query):
+    """Filter a problem queryset with a query, see the module docstring."""
+    return queryset.filter(get_plan(query))
@@ -0,0 +1,275 @@
+"""
+Vonty problem search.
+
+The search form validates the query string of the search endpoints
+and builds the matching problem queryset.
+Pages are cut with a keyset cursor on (hardness, source, id),
+(source_contest, source_year, source_part, source_number, id)
+when ordered by contest,
+or on (search_rank, id) for full-text queries,
+so a deep page costs the same as the first one.
+"""
+
+import base64
+import binascii
+import json
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch, Q
+from django.utils.translation import gettext_lazy as _
+
+from . import tagindex
+from .models import Problem, Tag
+from .query import QueryError, get_plan
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Keyset orderings, with the JSON types allowed in a cursor for each field.
+# NULLs sort first, which is SQLite's natural order.
+ORDERING = (("hardness", int), ("source", str), ("id", int))
+CONTEST_ORDERING = (
+    ("source_contest", str),
+    ("source_year", int),
+    ("source_part", str),
+    ("source_number", int),
+    ("id", int),
+)
+RANKED_ORDERING = (("search_rank", float), ("id", int))
+
+
+def encode_cursor(problem, ordering=ORDERING):
+    """Encode the position right after the given problem."""
+    key = [getattr(problem, field) for field, _type in ordering]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor, ordering=ORDERING):
+    """
+    Decode a cursor made by encode_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError(cursor) from exc
+    if not isinstance(key, list) or len(key) != len(ordering):
+        raise ValueError(cursor)
+    for value, (field, type_) in zip(key, ordering):
+        if type_ is float and isinstance(value, int):
+            continue
+        # Only the primary key may not be NULL
+        if value is None and field != "id":
+            continue
+        if not isinstance(value, type_) or isinstance(value, bool):
+            raise ValueError(cursor)
+    return key
+
+
+def after_q(key, ordering=ORDERING):
+    """A Q object matching the rows strictly after the given keyset key."""
+    after = Q(pk__in=[])
+    equal = Q()
+    for (field, _type), value in zip(ordering, key):
+        if value is None:
+            greater = Q(**{f"{field}__isnull": False})
+            same = Q(**{f"{field}__isnull": True})
+        else:
+            greater = Q(**{f"{field}__gt": value})
+            same = Q(**{field: value})
+        after |= equal & greater
+        equal &= same
+    return after
+
+
+def serialize_problem(problem):
+    """Serialize a problem fetched by ProblemSearchForm.get_queryset."""
+    return {
+        "id": problem.pk,
+        "source": problem.source,
+        "problem_number": problem.problem_number,
+        "author": problem.author,
+        "desc": problem.desc,
+        "hardness": problem.hardness,
+        "aops_url": problem.aops_url,
+        "git_url": problem.git_url,
+        "proposer": problem.proposer.get_username() if problem.proposer else None,
+        "proposal_date": (
+            problem.proposal_date.isoformat() if problem.proposal_date else None
+        ),
+        "tags": [tag.name for tag in problem.tags.all()],
+    }
+
+
+class ProblemSearchForm(forms.Form):
+    q = forms.CharField(
+        required=False, help_text=_(
+            "Words to look for in the source, author and description. "
+            "A trailing * matches prefixes, e.g. Fiend*. "
+            "Results are then ranked by relevance."
+        ),
+    )
+    hardness_min = forms.IntegerField(required=False, min_value=0, max_value=60)
+    hardness_max = forms.IntegerField(required=False, min_value=0, max_value=60)
+    tags = forms.CharField(
+        required=False, help_text=_(
+            "Space/comma separated tag names. "
+            "A problem must match every tag, or one of its descendants."
+        ),
+    )
+    query = forms.CharField(
+        required=False, help_text=_(
+            "Von-style filter. "
+            "e.g. geometry inversion -projective hardness>=25 source:ISL*"
+        ),
+    )
+    tag_query = forms.CharField(
+        required=False, help_text=_(
+            "Boolean tag query with AND, OR, NOT and parentheses. "
+            "Tags match their descendants too. "
+            "e.g. combo AND (invariant OR extreme) AND NOT grid"
+        ),
+    )
+    source = forms.CharField(
+        required=False, help_text=_("Source prefix. e.g. IMO 2023"),
+    )
+    author = forms.CharField(required=False)
+    proposer = forms.CharField(
+        required=False, help_text=_("Username of the proposer."),
+    )
+    order = forms.ChoiceField(
+        required=False,
+        choices=[("hardness", _("Hardness")), ("contest", _("Contest"))],
+        help_text=_(
+            "Order by hardness (the default) or by contest, year and number. "
+            "Full-text queries are ordered by relevance."
+        ),
+    )
+    cursor = forms.CharField(required=False)
+    limit = forms.IntegerField(
+        required=False, min_value=1, max_value=MAX_LIMIT,
+    )
+
+    def clean_tags(self):
+        names = self.cleaned_data["tags"].replace(",", " ").split()
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+        missing = [name for name in names if name not in tags]
+        if missing:
+            raise ValidationError(
+                _("Unknown tags: %(names)s"),
+                params = {"names": ", ".join(missing)},
+            )
+        return [tags[name] for name in names]
+
+    def clean_query(self):
+        query = self.cleaned_data["query"]
+        if not query.strip():
+            return None
+        try:
+            get_plan(query)
+        except QueryError as exc:
+            raise ValidationError(str(exc))
+        return query
+
+    def clean_tag_query(self):
+        query = self.cleaned_data["tag_query"]
+        if not query.strip():
+            return None
+        try:
+            names = tagindex.query_names(tagindex.parse_tag_query(query))
+        except tagindex.TagQueryError as exc:
+            raise ValidationError(str(exc))
+        missing = names - set(
+            Tag.objects.filter(name__in=names).values_list("name", flat=True)
+        )
+        if missing:
+            raise ValidationError(
+                _("Unknown tags: %(names)s"),
+                params = {"names": ", ".join(sorted(missing))},
+            )
+        return query
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cursor = cleaned_data.get("cursor")
+        if cursor:
+            try:
+                cleaned_data["cursor"] = decode_cursor(cursor, self.ordering)
+            except ValueError:
+                self.add_error("cursor", _("Invalid cursor"))
+        else:
+            cleaned_data["cursor"] = None
+        return cleaned_data
+
+    @property
+    def ordering(self):
+        if self.cleaned_data.get("q"):
+            return RANKED_ORDERING
+        if self.cleaned_data.get("order") == "contest":
+            return CONTEST_ORDERING
+        return ORDERING
+
+    def get_queryset(self):
+        """
+        The filtered problems, in keyset order,
+        with the proposer joined and the tags prefetched.
+        """
+        data = self.cleaned_data
+        queryset = Problem.objects.select_related("proposer").prefetch_related(
+            Prefetch("tags", queryset=Tag.objects.only("name"))
+        )
+
+        if data["hardness_min"] is not None:
+            queryset = queryset.filter(hardness__gte=data["hardness_min"])
+        if data["hardness_max"] is not None:
+            queryset = queryset.filter(hardness__lte=data["hardness_max"])
+        for tag in data["tags"]:
+            queryset = queryset.with_tags(tag)
+        if data["query"]:
+            queryset = queryset.filter(get_plan(data["query"]))
+        if data["tag_query"]:
+            queryset = tagindex.filter_problems(queryset, data["tag_query"])
+        if data["source"]:
+            queryset = queryset.filter(source__startswith=data["source"])
+        if data["author"]:
+            queryset = queryset.filter(author__icontains=data["author"])
+        if data["proposer"]:
+            queryset = queryset.filter(proposer__username=data["proposer"])
+        if data["q"]:
+            queryset = queryset.search(data["q"])
+
+        return queryset.order_by(*(field for field, _type in self.ordering))
+
+    def get_page_queryset(self):
+        """The problems after the cursor, one more than the page size."""
+        queryset = self.get_queryset()
+        if self.cleaned_data["cursor"] is not None:
+            queryset = queryset.filter(
+                after_q(self.cleaned_data["cursor"], self.ordering)
+            )
+        return queryset[:self.page_size + 1]
+
+    @property
+    def page_size(self):
+        return self.cleaned_data["limit"] or DEFAULT_LIMIT
+
+    def paginate(self, problems):
+        if len(problems) > self.page_size:
+            problems = problems[:self.page_size]
+            return problems, encode_cursor(problems[-1], self.ordering)
+        return problems, None
+
+    def get_page(self):
+        """
+        Get the page of problems after the cursor.
+        Returns the problems and the cursor of the next page,
+        which is None on the last page.
+        """
+        return self.paginate(list(self.get_page_queryset()))
+
+    async def aget_page(self):
+        """Asynchronous version of get_page."""
+        return self.paginate(
+            [problem async for problem in self.get_page_queryset()]
+        )
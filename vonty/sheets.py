@@ -0,0 +1,258 @@
+"""
+Vonty problem sheets.
+
+A sheet is a LaTeX or Typst document listing a set of problems.
+Each problem is rendered to a fragment that is stored on disk under a
+hash of the fields it is made from, see VONTY_SHEET_FRAGMENTS, so
+rebuilding a sheet after an edit, in any process, only re-renders the
+problems that changed.
+Compilation is delegated to a backend, see VONTY_SHEET_BACKEND.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+
+from .models import Problem, Tag
+
+FORMATS = ("tex", "typ")
+
+LATEX_SPECIAL = {
+    "\\": r"\textbackslash{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
+TYPST_SPECIAL = set("\\*_`$#@<>[]~/\"'=-+")
+
+DOCUMENTS = {
+    "tex": (
+        "\\documentclass[11pt]{article}\n"
+        "\\begin{document}\n"
+        "\\section*{%(title)s}\n"
+        "\\begin{enumerate}\n",
+        "\\end{enumerate}\n"
+        "\\end{document}\n",
+    ),
+    "typ": (
+        "= %(title)s\n\n",
+        "",
+    ),
+}
+
+
+def escape_latex(text):
+    return "".join(LATEX_SPECIAL.get(char, char) for char in text)
+
+
+def escape_typst(text):
+    return "".join("\\" + char if char in TYPST_SPECIAL else char for char in text)
+
+
+def sheet_queryset(tags=(), hardness_min=None, hardness_max=None, sources=()):
+    """
+    The problems of a sheet, in hardness then source order.
+    Problems must match every tag, or one of its descendants.
+    """
+    queryset = Problem.objects.prefetch_related(
+        Prefetch("tags", queryset=Tag.objects.only("name"))
+    )
+    for tag in tags:
+        queryset = queryset.with_tags(tag)
+    if hardness_min is not None:
+        queryset = queryset.filter(hardness__gte=hardness_min)
+    if hardness_max is not None:
+        queryset = queryset.filter(hardness__lte=hardness_max)
+    if sources:
+        queryset = queryset.filter(source__in=sources)
+    return queryset.order_by("hardness", "source", "pk")
+
+
+def fragment_fields(problem):
+    """The fields a fragment is rendered from."""
+    return (
+        problem.source or "",
+        problem.author,
+        problem.desc,
+        "" if problem.hardness is None else str(problem.hardness),
+        problem.aops_url,
+        " ".join(tag.name for tag in problem.tags.all()),
+    )
+
+
+def fragment_key(problem, fmt):
+    digest = hashlib.sha256(
+        "\0".join((fmt, *fragment_fields(problem))).encode()
+    ).hexdigest()
+    return f"{digest}.{fmt}"
+
+
+def render_fragment(problem, fmt):
+    source, author, desc, hardness, aops_url, tags = fragment_fields(problem)
+    if fmt == "tex":
+        escape = escape_latex
+        parts = [r"\item{}"]
+        if source:
+            parts.append(r"\textbf{%s}" % escape(source))
+        if author:
+            parts.append("(%s)" % escape(author))
+        parts.append(escape(desc))
+        if hardness:
+            parts.append(r"\hfill [%sM]" % hardness)
+        if aops_url:
+            parts.append(r"\\ \texttt{%s}" % escape(aops_url))
+        if tags:
+            parts.append(r"\\ \emph{%s}" % escape(tags))
+    else:
+        escape = escape_typst
+        parts = ["+"]
+        if source:
+            parts.append("*%s*" % escape(source))
+        if author:
+            parts.append("(%s)" % escape(author))
+        parts.append(escape(desc))
+        if hardness:
+            parts.append("#h(1fr) \\[%sM\\]" % hardness)
+        if aops_url:
+            parts.append('\\ #link("%s")' % aops_url.replace('"', '\\"'))
+        if tags:
+            parts.append("\\ _%s_" % escape(tags))
+    return " ".join(parts) + "\n"
+
+
+class FragmentStore:
+    """
+    Rendered fragments, one file per fragment key under root.
+    Keys are content hashes, so files never go stale and the
+    directory can be deleted at any time to reclaim the space.
+    """
+
+    def __init__(self, root=None):
+        self.root = str(root or settings.VONTY_SHEET_FRAGMENTS)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get_many(self, keys):
+        fragments = {}
+        for key in keys:
+            try:
+                with open(self.path(key), encoding="utf-8") as file:
+                    fragments[key] = file.read()
+            except FileNotFoundError:
+                pass
+        return fragments
+
+    def set_many(self, fragments):
+        for key, fragment in fragments.items():
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so that a concurrent
+            # build never reads a partial fragment
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(fragment)
+            os.replace(tmp, path)
+
+
+class SheetBuilder:
+    """
+    Render problems into a sheet, reusing stored fragments.
+    After build, rendered and reused count the fragments
+    that were rendered and taken from the store.
+    """
+
+    def __init__(self, fmt="tex", store=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown sheet format {fmt!r}")
+        self.fmt = fmt
+        self.store = store or FragmentStore()
+        self.rendered = self.reused = 0
+
+    def build(self, problems, title="Problems"):
+        problems = list(problems)
+        keys = [fragment_key(problem, self.fmt) for problem in problems]
+        cached = self.store.get_many(keys)
+
+        fragments, missing = [], {}
+        for key, problem in zip(keys, problems):
+            if key not in cached:
+                cached[key] = missing[key] = render_fragment(problem, self.fmt)
+            fragments.append(cached[key])
+        if missing:
+            self.store.set_many(missing)
+        self.rendered = len(missing)
+        self.reused = len(problems) - self.rendered
+
+        header, footer = DOCUMENTS[self.fmt]
+        escape = escape_latex if self.fmt == "tex" else escape_typst
+        return (
+            header % {"title": escape(title)} + "".join(fragments) + footer
+        )
+
+
+class CompileError(Exception):
+    """A sheet could not be compiled."""
+
+
+class BaseCompileBackend:
+    """Turn a sheet source into a PDF."""
+
+    def compile(self, source, fmt, output):
+        """
+        Compile the source of the given format into the output path.
+        Raises CompileError when it cannot.
+        """
+        raise NotImplementedError
+
+
+class SubprocessCompileBackend(BaseCompileBackend):
+    """Compile with latexmk or typst, which must be on the PATH."""
+
+    commands = {
+        "tex": ["latexmk", "-pdf", "-interaction=nonstopmode", "-quiet"],
+        "typ": ["typst", "compile"],
+    }
+
+    def compile(self, source, fmt, output):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"sheet.{fmt}")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(source)
+            command = [*self.commands[fmt], path]
+            if fmt == "typ":
+                command.append(os.path.join(tmp, "sheet.pdf"))
+            try:
+                subprocess.run(
+                    command, cwd=tmp, check=True, capture_output=True,
+                    text=True, errors="replace",
+                )
+            except subprocess.CalledProcessError as exc:
+                # latexmk logs its errors to the standard output
+                log = exc.stderr.strip() or exc.stdout.strip()
+                raise CompileError(log or str(exc)) from exc
+            except FileNotFoundError as exc:
+                raise CompileError(f"Cannot run {command[0]}: {exc}") from exc
+            shutil.copyfile(os.path.join(tmp, "sheet.pdf"), output)
+        return output
+
+
+def get_compile_backend():
+    backend = getattr(
+        settings,
+        "VONTY_SHEET_BACKEND",
+        "vonty.sheets.SubprocessCompileBackend",
+    )
+    return import_string(backend)()
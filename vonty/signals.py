@@ -0,0 +1,7 @@
+"""Vonty signals."""
+
+from django.dispatch import Signal
+
+# Sent after a tag and its descendants are moved in the tree,
+# with the moved tag and the primary keys of its old and new ancestors.
+tag_moved = Signal()
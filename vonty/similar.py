@@ -0,0 +1,163 @@
+"""
+Vonty similar problems.
+
+The problems most similar to a problem are those sharing its most
+specific tags, at a close hardness. Every problem is a sparse vector over
+the tags: its own tags weigh their inverse document frequency,
+log(problems / problems in the tag subtree), and their ancestors
+ANCESTOR_WEIGHT times theirs. Two problems score the weighted Jaccard
+similarity of their vectors, lowered by up to HARDNESS_WEIGHT as their
+hardness differs.
+
+The vectors are read from the tag index of vonty.tagindex, which keeps
+them up to date. The candidates are the problems sharing the rarest tags
+of the problem, taken from the tag bitmaps until MAX_CANDIDATES, or the
+MAX_CANDIDATES problems sharing the most weight of tags with it when
+even its rarest tag is more common. Their scores are sums over set
+intersections rather than queries.
+"""
+
+import heapq
+import math
+import threading
+
+from django import forms
+from django.utils.translation import gettext_lazy as _
+
+from . import tagindex
+
+ANCESTOR_WEIGHT = 0.5
+HARDNESS_WEIGHT = 0.3
+# Hardness difference at which the full HARDNESS_WEIGHT is lost
+HARDNESS_SPAN = 30
+MAX_CANDIDATES = 1000
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_weights = None
+_lock = threading.Lock()
+
+
+def get_weights(index):
+    """
+    The inverse document frequency of every tag of the index,
+    and a dict caching the norms of the problem vectors.
+    """
+    global _weights
+    with _lock:
+        if _weights is None or _weights[:2] != (index, index.version):
+            total = index.universe.bit_count()
+            idf = {
+                tag_id: math.log((1 + total) / (1 + count))
+                for tag_id, count in index.counts().items()
+            }
+            _weights = (index, index.version, idf, {})
+        return _weights[2:]
+
+
+def candidates(index, pk, weights, limit=MAX_CANDIDATES):
+    """
+    The ids of the problems sharing a tag with the problem,
+    adding its tags from the rarest on while they total at most limit.
+    """
+    rarest = sorted(
+        index.problem_tags.get(pk, ()),
+        key=lambda tag_id: weights.get(tag_id, 0), reverse=True,
+    )
+    bitmap = 0
+    for tag_id in rarest:
+        merged = bitmap | index.bitmap(tag_id)
+        # The problem itself is in the bitmaps too
+        if merged.bit_count() > limit + 1:
+            break
+        bitmap = merged
+    if not bitmap and rarest:
+        # Even the rarest tag is common
+        return ranked_candidates(index, pk, weights, rarest, limit)
+    return [other for other in index.ids(bitmap) if other != pk]
+
+
+def ranked_candidates(index, pk, weights, tag_ids, limit):
+    """
+    The ids of the limit problems sharing the most weight of the given
+    tags with the problem. The problems are split by the tags they share
+    with bitmap operations, so only the best groups are ever listed.
+    """
+    bitmaps = [(weights.get(tag_id, 0), index.bitmap(tag_id)) for tag_id in tag_ids]
+    shared = 0
+    for _weight, bitmap in bitmaps:
+        shared |= bitmap
+    # (shared weight, bitmap) groups, the problem itself left out
+    groups = [(0.0, shared & ~(1 << pk))]
+    for weight, bitmap in bitmaps:
+        split = []
+        for total, members in groups:
+            inside, outside = members & bitmap, members & ~bitmap
+            if inside:
+                split.append((total + weight, inside))
+            if outside:
+                split.append((total, outside))
+        groups = split
+    groups.sort(key=lambda group: group[0], reverse=True)
+    ids = []
+    for _total, members in groups:
+        if len(ids) >= limit:
+            break
+        ids += index.ids(members)
+    return ids[:limit]
+
+
+def similar_problems(pk, limit=DEFAULT_LIMIT):
+    """
+    The (score, problem id) pairs of the problems most similar
+    to the problem with the given id, best first.
+    Returns None if the problem is not in the tag index.
+    """
+    index = tagindex.get_index()
+    if pk not in index.problem_tags:
+        return None
+    weights, norms = get_weights(index)
+    idf = weights.__getitem__
+    tags, direct, hardness = index.problem_tags, index.direct_tags, index.hardness
+
+    def norm(pk):
+        if pk not in norms:
+            norms[pk] = (
+                ANCESTOR_WEIGHT * sum(map(idf, tags.get(pk, ())))
+                + (1 - ANCESTOR_WEIGHT) * sum(map(idf, direct.get(pk, ())))
+            )
+        return norms[pk]
+
+    query_tags = tags[pk]
+    query_direct = frozenset(direct.get(pk, ()))
+    query_norm = norm(pk)
+    query_hardness = hardness.get(pk)
+
+    def score(other):
+        # .get, the index may be refreshed by another thread meanwhile
+        other_tags = tags.get(other, frozenset())
+        # Shared own tags weigh fully, other shared ones as ancestors
+        shared = (
+            ANCESTOR_WEIGHT * sum(map(idf, query_tags & other_tags))
+            + (1 - ANCESTOR_WEIGHT)
+            * sum(map(idf, query_direct.intersection(direct.get(other, ()))))
+        )
+        union = query_norm + norm(other) - shared
+        similarity = shared / union if union else 0.0
+        other_hardness = hardness.get(other)
+        if query_hardness is None or other_hardness is None:
+            penalty = HARDNESS_WEIGHT / 2
+        else:
+            distance = min(abs(query_hardness - other_hardness), HARDNESS_SPAN)
+            penalty = HARDNESS_WEIGHT * distance / HARDNESS_SPAN
+        return similarity * (1 - penalty), -other
+
+    best = heapq.nlargest(limit, map(score, candidates(index, pk, weights)))
+    return [(value, -negated_pk) for value, negated_pk in best if value > 0]
+
+
+class SimilarProblemsForm(forms.Form):
+    limit = forms.IntegerField(
+        required=False, min_value=1, max_value=MAX_LIMIT,
+        help_text=_("Number of similar problems. Defaults to 10."),
+    )
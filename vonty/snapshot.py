@@ -0,0 +1,365 @@
+"""
+Vonty offline snapshot.
+
+A snapshot is a single read-only file holding the problems and tags, for
+the vonty command line tool (vonty.cli) to query without Django or the
+server database. It is written by the export_snapshot command and read
+through mmap, so opening it only parses a small JSON directory; the rest
+is looked at when a query needs it.
+
+The problems are stored in columns, sorted by contest, year, number and
+source, so that every contest is a contiguous range of rows. Integer
+columns are arrays, text columns a blob of UTF-8 with an array of
+offsets. For every tag, the rows of the problems with the tag or one of
+its descendants are stored as a bitmap when it is dense, as a sorted
+array of rows otherwise, and likewise for every hardness, so a query is
+a few AND of Python ints. An array of the rows sorted by source finds
+a problem by its source with a binary search.
+
+This module only uses the standard library: importing Django would cost
+more than the whole query.
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+MAGIC = b"VONTYSNP"
+FORMAT = 1
+HEADER = struct.Struct("<8sII")
+# Problem columns, in the order of the rows given to write()
+COLUMNS = (
+    "pk", "source", "desc", "author", "hardness", "aops_url",
+    "contest", "year", "number", "tags",
+)
+# Signed for NULL, and as wide as the model fields but for the years
+INT_COLUMNS = {"pk": "q", "hardness": "i", "year": "h", "number": "i"}
+TEXT_COLUMNS = ("source", "desc", "author", "aops_url", "contest")
+# Stand-in for the missing integers, none of the values is negative
+NULL = -1
+
+
+class SnapshotError(Exception):
+    """A snapshot file that cannot be read."""
+
+
+def _align(data, fill=b"\0"):
+    data += fill * (-len(data) % 8)
+    return data
+
+
+def _source_key(row):
+    pk, source, _desc, _author, _hardness, _url, contest, year, number, _tags = row
+    return contest, year or 0, number or 0, source or "", pk
+
+
+def write(path, tags, rows, meta):
+    """
+    Write a snapshot, replacing the file at path atomically.
+    tags are (pk, name, parent pk, use_filter, desc) tuples, parents first,
+    rows are tuples of the COLUMNS with a tuple of tag pks for tags,
+    and meta is a JSON serializable dict kept in the snapshot.
+    """
+    rows = sorted(rows, key=_source_key)
+    tag_indexes = {tag[0]: index for index, tag in enumerate(tags)}
+    ancestors = []
+    for pk, _name, parent, _use_filter, _desc in tags:
+        parent_index = tag_indexes.get(parent)
+        ancestors.append(
+            (tag_indexes[pk],)
+            + (ancestors[parent_index] if parent_index is not None else ())
+        )
+
+    sections = []
+    size = 0
+
+    def add(data):
+        nonlocal size
+        offset = size
+        data = _align(bytes(data))
+        sections.append(data)
+        size += len(data)
+        return offset
+
+    directory = {
+        "meta": meta,
+        "count": len(rows),
+        "tags": [
+            # The number of problems in the subtree is appended below
+            [pk, name, tag_indexes.get(parent, NULL), use_filter, desc]
+            for pk, name, parent, use_filter, desc in tags
+        ],
+        "columns": {},
+    }
+    columns = list(zip(*rows)) or [()] * len(COLUMNS)
+    values = dict(zip(COLUMNS, columns))
+    for name, typecode in INT_COLUMNS.items():
+        column = array.array(
+            typecode, (NULL if value is None else value for value in values[name])
+        )
+        directory["columns"][name] = [add(column), typecode]
+    for name in TEXT_COLUMNS:
+        encoded = [(value or "").encode() for value in values[name]]
+        offsets = array.array("I", accumulate(map(len, encoded), initial=0))
+        blob = b"".join(encoded)
+        directory["columns"][name] = [add(offsets), add(blob), len(blob)]
+
+    # Tags of every row, as tag indexes, and the subtree rows of every tag
+    offsets = array.array("I", [0])
+    row_tags = array.array("I")
+    subtrees = [array.array("I") for _tag in tags]
+    for row_index, tag_pks in enumerate(values["tags"]):
+        indexes = [tag_indexes[pk] for pk in tag_pks if pk in tag_indexes]
+        row_tags.extend(indexes)
+        offsets.append(len(row_tags))
+        for tag_index in {tag for index in indexes for tag in ancestors[index]}:
+            subtrees[tag_index].append(row_index)
+    directory["columns"]["tags"] = [add(offsets), add(row_tags)]
+    directory["tag_sets"] = [
+        add_set(add, subtree, len(rows)) for subtree in subtrees
+    ]
+    for tag, subtree in zip(directory["tags"], subtrees):
+        tag.append(len(subtree))
+
+    hardness = {}
+    for row_index, value in enumerate(values["hardness"]):
+        hardness.setdefault(
+            "null" if value is None else str(value), array.array("I")
+        ).append(row_index)
+    directory["hardness_sets"] = {
+        value: add_set(add, rows_, len(rows)) for value, rows_ in hardness.items()
+    }
+
+    contests = {}
+    for row_index, contest in enumerate(values["contest"]):
+        bounds = contests.setdefault(contest or "", [row_index, row_index])
+        bounds[1] = row_index + 1
+    directory["contests"] = contests
+    by_source = array.array("I", sorted(
+        (index for index, source in enumerate(values["source"]) if source),
+        key=values["source"].__getitem__,
+    ))
+    directory["source_order"] = [add(by_source), len(by_source)]
+
+    head = _align(json.dumps(directory, separators=(",", ":")).encode(), b" ")
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT, len(head)))
+        file.write(head)
+        for data in sections:
+            file.write(data)
+    os.replace(tmp, path)
+
+
+def add_set(add, rows, count):
+    """Store a sorted array of rows, as a bitmap when that is smaller."""
+    if len(rows) * 32 > count:
+        bits = bytearray((count + 7) // 8)
+        for row in rows:
+            bits[row >> 3] |= 1 << (row & 7)
+        return ["bitmap", add(bits), len(bits)]
+    return ["rows", add(rows), len(rows)]
+
+
+class Snapshot:
+    """A snapshot file, opened read-only through mmap."""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path} is empty")
+        try:
+            magic, format, length = HEADER.unpack_from(self._mmap)
+        except struct.error:
+            raise SnapshotError(f"{path} is not a snapshot")
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot")
+        if format != FORMAT:
+            raise SnapshotError(f"{path} is a snapshot of format {format}")
+        self._base = HEADER.size + length
+        try:
+            directory = json.loads(self._mmap[HEADER.size:self._base])
+        except ValueError:
+            raise SnapshotError(f"{path} is a damaged snapshot")
+        self._view = memoryview(self._mmap)[self._base:]
+        self.meta = directory["meta"]
+        self.count = directory["count"]
+        # [pk, name, parent index or NULL, use_filter, desc, problem count]
+        self.tags = directory["tags"]
+        self.tag_indexes = {tag[1]: index for index, tag in enumerate(self.tags)}
+        self.contests = directory["contests"]
+        self._directory = directory
+        self._columns = {}
+
+    def close(self):
+        self._columns.clear()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _array(self, offset, typecode, count):
+        size = array.array(typecode).itemsize
+        return self._view[offset:offset + count * size].cast(typecode)
+
+    def column(self, name):
+        """An integer column, or the (offsets, blob) of a text column."""
+        if name not in self._columns:
+            spec = self._directory["columns"][name]
+            if name in INT_COLUMNS:
+                offset, typecode = spec
+                value = self._array(offset, typecode, self.count)
+            elif name == "tags":
+                offsets = self._array(spec[0], "I", self.count + 1)
+                value = offsets, self._array(spec[1], "I", offsets[-1])
+            else:
+                offset, blob, length = spec
+                value = (
+                    self._array(offset, "I", self.count + 1),
+                    self._view[blob:blob + length],
+                )
+            self._columns[name] = value
+        return self._columns[name]
+
+    def text(self, name, row):
+        offsets, blob = self.column(name)
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode()
+
+    def get(self, row):
+        """The problem at a row, as a dict."""
+        offsets, tags = self.column("tags")
+        problem = {"id": self.column("pk")[row]}
+        for name in ("source", "desc", "author", "aops_url"):
+            problem[name] = self.text(name, row)
+        for name in ("hardness", "year", "number"):
+            value = self.column(name)[row]
+            problem[name] = None if value == NULL else value
+        problem["tags"] = [
+            self.tags[tag][1] for tag in tags[offsets[row]:offsets[row + 1]]
+        ]
+        return problem
+
+    def rows(self):
+        """Every row, as a tuple of the COLUMNS, for rebuilding the snapshot."""
+        columns = []
+        for name in COLUMNS:
+            if name in INT_COLUMNS:
+                columns.append([
+                    None if value == NULL else value
+                    for value in self.column(name).tolist()
+                ])
+                continue
+            offsets, values = self.column(name)
+            offsets = offsets.tolist()
+            ends = offsets[1:]
+            if name == "tags":
+                pks = [tag[0] for tag in self.tags]
+                values = [pks[tag] for tag in values.tolist()]
+                columns.append([
+                    tuple(values[start:end]) for start, end in zip(offsets, ends)
+                ])
+                continue
+            data = bytes(values)
+            column = [
+                data[start:end].decode() for start, end in zip(offsets, ends)
+            ]
+            if name == "source":
+                column = [source or None for source in column]
+            columns.append(column)
+        return zip(*columns)
+
+    def _bitmap(self, spec):
+        kind, offset, length = spec
+        if kind == "bitmap":
+            return int.from_bytes(self._view[offset:offset + length], "little")
+        bits = bytearray((self.count + 7) // 8)
+        for row in self._array(offset, "I", length):
+            bits[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(bits, "little")
+
+    def everything(self):
+        return (1 << self.count) - 1
+
+    def tag_bitmap(self, name):
+        """The rows of the problems with the tag or a descendant."""
+        return self._bitmap(self._directory["tag_sets"][self.tag_indexes[name]])
+
+    def hardness_bitmap(self, low=None, high=None):
+        """The rows of the problems with a hardness between low and high."""
+        bitmap = 0
+        for value, spec in self._directory["hardness_sets"].items():
+            if value == "null":
+                continue
+            value = int(value)
+            if (low is None or value >= low) and (high is None or value <= high):
+                bitmap |= self._bitmap(spec)
+        return bitmap
+
+    def contest_bitmap(self, contest, low=None, high=None):
+        """The rows of a contest, from year low to high."""
+        if contest not in self.contests:
+            return 0
+        start, end = self.contests[contest]
+        if low is not None or high is not None:
+            years = self.column("year")
+            # Rows without a year come first in a contest
+            if low is not None:
+                start = bisect_left(years, low, start, end)
+            if high is not None:
+                end = bisect_right(years, high, start, end)
+        return ((1 << end) - 1) ^ ((1 << start) - 1) if end > start else 0
+
+    def year_bitmap(self, low=None, high=None):
+        """The rows of every contest from year low to high."""
+        bitmap = 0
+        for contest in self.contests:
+            bitmap |= self.contest_bitmap(contest, low, high)
+        return bitmap
+
+    def find(self, source):
+        """The row of the problem with a source, or None."""
+        offset, length = self._directory["source_order"]
+        order = self._array(offset, "I", length)
+        key = source.encode()
+        offsets, blob = self.column("source")
+        low, high = 0, length
+        while low < high:
+            middle = (low + high) // 2
+            row = order[middle]
+            if bytes(blob[offsets[row]:offsets[row + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < length and self.text("source", order[low]) == source:
+            return order[low]
+        return None
+
+    def find_pk(self, pk):
+        """The row of the problem with a primary key, or None."""
+        try:
+            return array.array("q", self.column("pk")).index(pk)
+        except ValueError:
+            return None
+
+
+def iter_rows(bitmap, limit=None):
+    """The rows set in a bitmap, lowest first."""
+    count = 0
+    while bitmap and (limit is None or count < limit):
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+        count += 1
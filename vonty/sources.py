@@ -0,0 +1,97 @@
+"""
+Vonty problem sources.
+
+A source such as "IMO 2023/6" or "ISL 2005/G1" is parsed into
+a contest, a year, a part and a problem number, stored in indexed columns
+so listings sort by contest, then year, then part, then number
+("2" before "10", "A7" before "C1") without parsing sources in Python.
+"""
+
+import re
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+YEAR_RE = re.compile(r"\b(?:1[89]|20)\d\d\b")
+# The part is the letter before a number, e.g. the G of G1
+NUMBER_RE = re.compile(r"\b([A-Z]?)(\d+)")
+# Numbers above the range of source_number are left out
+MAX_NUMBER = 2147483647
+KEY_FIELDS = ("source_contest", "source_year", "source_part", "source_number")
+
+
+def parse_source(source):
+    """
+    Split a source into a (contest, year, part, number) tuple,
+    with "" or None for the parts it lacks. e.g.
+
+        IMO 2023/6      -> ("IMO", 2023, "", 6)
+        ISL 2005/G1     -> ("ISL", 2005, "G", 1)
+        Putnam 2010 B6  -> ("Putnam", 2010, "B", 6)
+        Fiendish        -> ("Fiendish", None, "", None)
+    """
+    if not source:
+        return "", None, "", None
+    match = YEAR_RE.search(source)
+    if match:
+        contest = source[:match.start()]
+        year = int(match.group())
+        rest = source[match.end():]
+        if not contest.strip():
+            contest = rest.partition("/")[0]
+    else:
+        contest, _sep, rest = source.partition("/")
+        year = None
+    numbers = NUMBER_RE.findall(rest)
+    part, number = numbers[-1] if numbers else ("", None)
+    if number is not None:
+        number = int(number)
+        if number > MAX_NUMBER:
+            part, number = "", None
+    return contest.strip(" /"), year, part, number
+
+
+def set_source_key(problem):
+    """Set the parsed source columns of a problem from its source."""
+    for field, value in zip(KEY_FIELDS, parse_source(problem.source)):
+        setattr(problem, field, value)
+
+
+def backfill(model, using=None, batch_size=2000):
+    """
+    Recompute the parsed source columns of every problem of the model.
+    Returns the number of problems that changed.
+    """
+    alias = using or router.db_for_write(model)
+    queryset = model.objects.using(alias).order_by("pk")
+    queryset = queryset.values_list("pk", "source", *KEY_FIELDS)
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    # bulk_update builds a CASE per column, far slower than executemany.
+    # Raw updates skip auto_now, stamp the changed problems for the snapshots
+    update = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote(model._meta.db_table),
+        ", ".join(
+            f"{quote(model._meta.get_field(field).column)} = %s"
+            for field in (*KEY_FIELDS, "modified")
+        ),
+        quote(model._meta.pk.column),
+    )
+    changed = 0
+    last = None
+    while True:
+        # Pages by primary key, so no read cursor is open during the writes
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        problems = list(page[:batch_size])
+        if not problems:
+            return changed
+        last = problems[-1][0]
+        batch = []
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        for pk, source, *key in problems:
+            new_key = parse_source(source)
+            if tuple(key) != new_key:
+                batch.append((*new_key, now, pk))
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.executemany(update, batch)
+        changed += len(batch)
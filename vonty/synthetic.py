@@ -0,0 +1,199 @@
+"""
+Vonty synthetic data.
+
+Generates a realistic archive for benchmarks: a tag tree shaped like
+the taxonomy of vonty/fixtures/x.py, deepened with extra levels,
+and problems whose tags follow a skewed (Zipf-like) distribution
+and whose MOHS hardness is a multiple of 5.
+Problems are written through ProblemImporter, so tag counts stay right.
+"""
+
+import random
+import re
+from itertools import accumulate
+
+from django.utils.text import slugify
+
+from . import duplicates
+from .fixtures import x
+from .importer import ProblemImporter
+from .models import Problem, Tag
+
+CONTESTS = (
+    "IMO", "ISL", "USAMO", "USAJMO", "USA TST", "USA TSTST", "ELMO",
+    "USEMO", "APMO", "EGMO", "RMM", "Balkan MO", "Canada MO", "China MO",
+    "China TST", "Iran TST", "Japan MO", "Korea MO", "Russia MO",
+    "Taiwan TST", "Vietnam MO", "HMMT", "Putnam", "Sharygin", "Iberoamerican",
+)
+YEARS = range(1960, 2027)
+NUMBERS = range(1, 150)
+HARDNESS_WEIGHTS = (2, 6, 10, 12, 12, 10, 9, 7, 5, 3, 2, 1, 1)
+ADJECTIVES = (
+    "Fiendish", "Cute", "Classic", "Tricky", "Weird", "Easy", "Ugly",
+    "Symmetric", "Cyclic", "Functional", "Bounded", "Hidden", "Infinite",
+)
+NOUNS = (
+    "inequality", "equation", "polynomial", "quadrilateral", "triangle",
+    "graph", "grid", "game", "sequence", "divisibility", "tangency",
+    "coloring", "recursion", "configuration", "invariant", "circle",
+)
+AUTHORS = ("", "", "", "Evan Chen", "Ankan Bhattacharya", "Titu Andreescu")
+
+
+def parse_taxonomy(text=None):
+    """
+    Parse a taxonomy such as the docstring of vonty/fixtures/x.py
+    into a list of (name, children) trees.
+    Every "Heading: names" line, possibly continued on indented lines,
+    makes a tag with the names as children.
+    A heading naming an earlier tag fills in that tag instead,
+    e.g. "FE: cauchy ..." nests under the fe child of "Alg: FE ...".
+    Names are slugified and made unique with a numeric suffix.
+    """
+    if text is None:
+        text = x.__doc__
+    roots, nodes = [], {}
+
+    def make(name):
+        slug = base = slugify(name)
+        suffix = 1
+        while slug in nodes:
+            suffix += 1
+            slug = f"{base}-{suffix}"
+        nodes[slug] = node = (slug, [])
+        return node
+
+    current = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[0].isspace() and current is not None:
+            words = line
+        else:
+            heading, sep, words = line.lstrip("* ").partition(":")
+            if not sep:
+                current = None
+                continue
+            current = nodes.get(slugify(heading))
+            if current is None:
+                current = make(heading)
+                roots.append(current)
+        for word in re.split(r"[\s,>]+", words):
+            if slugify(word):
+                current[1].append(make(word))
+    return roots
+
+
+def deepen(trees, depth, fanout):
+    """Add depth levels of fanout synthetic children under every leaf."""
+    def grow(name, level):
+        if level == depth:
+            return []
+        return [
+            (f"{name}-x{i}", grow(f"{name}-x{i}", level + 1))
+            for i in range(1, fanout + 1)
+        ]
+
+    return [
+        (name, deepen(children, depth, fanout) if children else grow(name, 0))
+        for name, children in trees
+    ]
+
+
+def create_tags(trees):
+    """
+    Create the tag trees, one bulk insert per parent.
+    Returns the created tags.
+    """
+    created = []
+    level = []
+    for name, children in trees:
+        tag = Tag.objects.add_root({"name": name})
+        created.append(tag)
+        level.append((tag, children))
+    while level:
+        next_level = []
+        for parent, children in level:
+            tags = parent.add_children([name for name, _ in children])
+            created.extend(tags)
+            next_level.extend(
+                (tag, grandchildren)
+                for tag, (_, grandchildren) in zip(tags, children)
+                if grandchildren
+            )
+        level = next_level
+    return created
+
+
+class ProblemGenerator:
+    """
+    Make random problems over the existing tags.
+    Tags are ranked in a random order and the k-th one
+    is picked with a weight of 1 / k ** skew.
+    """
+
+    def __init__(self, seed=0, skew=1.1):
+        self.random = random.Random(seed)
+        self.tag_ids = list(
+            Tag.objects.order_by("path").values_list("pk", flat=True)
+        )
+        self.random.shuffle(self.tag_ids)
+        self.cum_weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, len(self.tag_ids) + 1)
+        ))
+
+    def sources(self, count):
+        """count distinct random sources, e.g. USAMO 2004/5."""
+        space = len(CONTESTS) * len(YEARS) * len(NUMBERS)
+        for index in self.random.sample(range(space), min(count, space)):
+            index, number = divmod(index, len(NUMBERS))
+            contest, year = divmod(index, len(YEARS))
+            yield CONTESTS[contest], YEARS[year], NUMBERS[number]
+
+    def tags(self):
+        if not self.tag_ids:
+            return []
+        count = self.random.choices((1, 2, 3, 4), weights=(4, 3, 2, 1))[0]
+        return list(dict.fromkeys(self.random.choices(
+            self.tag_ids, cum_weights=self.cum_weights, k=count,
+        )))
+
+    def problem(self, contest, year, number):
+        rand = self.random
+        hardness = None
+        if rand.random() > 0.05:
+            hardness = 5 * rand.choices(
+                range(len(HARDNESS_WEIGHTS)), weights=HARDNESS_WEIGHTS
+            )[0]
+        return Problem(
+            source=f"{contest} {year}/{number}",
+            author=rand.choice(AUTHORS),
+            desc=f"{rand.choice(ADJECTIVES)} {rand.choice(NOUNS)}",
+            problem_number=number,
+            hardness=hardness,
+        )
+
+    def generate(self, count):
+        """Yield count (unsaved problem, tag ids) pairs."""
+        for contest, year, number in self.sources(count):
+            yield self.problem(contest, year, number), self.tags()
+
+
+def generate_problems(count, seed=0, skew=1.1, batch_size=2000):
+    """
+    Write count random problems in batches.
+    Returns the number of problems written.
+    """
+    # Random descriptions repeat a lot, they are not duplicates to report
+    importer = ProblemImporter(check_duplicates=False)
+    written = 0
+    batch = []
+    for pair in ProblemGenerator(seed, skew).generate(count):
+        batch.append(pair)
+        if len(batch) == batch_size:
+            written += len(importer.write(batch)[0])
+            batch = []
+    if batch:
+        written += len(importer.write(batch)[0])
+    duplicates.index_missing(batch_size)
+    return written
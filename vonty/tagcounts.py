@@ -0,0 +1,182 @@
+"""
+Vonty tag counts.
+
+Every tag stores the number of problems tagged with it (problem_count)
+and the number of distinct problems tagged with it or a descendant
+(subtree_problem_count), so a faceted tag list is a single query.
+
+The counts are kept up to date from the Problem.tags signals,
+problem and tag deletes, and tag moves.
+A problem is in the subtree of every tag whose path prefixes
+the path of one of its tags, so a change to a problem's tags
+only touches the tags whose prefix set it changes.
+"""
+
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Problem, Tag
+from .signals import tag_moved
+
+
+def ancestor_paths(path):
+    """The paths of a tag and all of its ancestors."""
+    return [path[:end] for end in range(Tag.steplen, len(path) + 1, Tag.steplen)]
+
+
+def count_deltas(changes):
+    """
+    Compute the count changes for a list of (before, after) pairs,
+    each being the sets of tag paths of one problem.
+    Returns a dict mapping tag paths to (direct, subtree) deltas.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for before, after in changes:
+        for path in after - before:
+            deltas[path][0] += 1
+        for path in before - after:
+            deltas[path][0] -= 1
+
+        before_prefixes = {p for path in before for p in ancestor_paths(path)}
+        after_prefixes = {p for path in after for p in ancestor_paths(path)}
+        for path in after_prefixes - before_prefixes:
+            deltas[path][1] += 1
+        for path in before_prefixes - after_prefixes:
+            deltas[path][1] -= 1
+    return {path: tuple(delta) for path, delta in deltas.items() if any(delta)}
+
+
+def apply_changes(changes):
+    """Apply the count changes of (before, after) tag path sets."""
+    deltas = count_deltas(changes)
+    if not deltas:
+        return
+    # One statement run per tag, rather than one UPDATE per distinct
+    # delta, which is a hundred queries for an imported batch
+    connection = connections[router.db_for_write(Tag)]
+    quote = connection.ops.quote_name
+    direct = quote(Tag._meta.get_field("problem_count").column)
+    subtree = quote(Tag._meta.get_field("subtree_problem_count").column)
+    update = "UPDATE {} SET {} = {} + %s, {} = {} + %s WHERE {} = %s".format(
+        quote(Tag._meta.db_table), direct, direct, subtree, subtree,
+        quote(Tag._meta.get_field("path").column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(update, [
+            (direct_delta, subtree_delta, path)
+            for path, (direct_delta, subtree_delta) in deltas.items()
+        ])
+
+
+def problem_tag_paths(problem_ids):
+    """A dict mapping each problem id to the set of its tag paths."""
+    paths = defaultdict(set)
+    rows = (
+        Problem.tags.through.objects.filter(problem_id__in=problem_ids)
+        .values_list("problem_id", "tag__path")
+    )
+    for problem_id, path in rows:
+        paths[problem_id].add(path)
+    return paths
+
+
+def real_counts():
+    """Subqueries computing the counts of the outer tag from scratch."""
+    through = Problem.tags.through.objects.order_by()
+    direct = (
+        through.filter(tag=OuterRef("pk"))
+        .values("tag").annotate(count=Count("*")).values("count")
+    )
+    subtree = (
+        through.filter(
+            tag__path__gte=OuterRef("path"),
+            tag__path__lt=Concat(OuterRef("path"), Value("~")),
+        )
+        .annotate(group=Value(1)).values("group")
+        .annotate(count=Count("problem", distinct=True)).values("count")
+    )
+    return {
+        "problem_count": Coalesce(Subquery(direct), 0),
+        "subtree_problem_count": Coalesce(Subquery(subtree), 0),
+    }
+
+
+def refresh(queryset=None):
+    """Recompute the counts of the given tags, or of every tag."""
+    if queryset is None:
+        queryset = Tag.objects.all()
+    queryset.update(**real_counts())
+
+
+def find_mismatches():
+    """The tags whose stored counts are wrong, annotated with real ones."""
+    counts = real_counts()
+    return Tag.objects.annotate(
+        real_problem_count=counts["problem_count"],
+        real_subtree_problem_count=counts["subtree_problem_count"],
+    ).filter(
+        ~Q(problem_count=F("real_problem_count"))
+        | ~Q(subtree_problem_count=F("real_subtree_problem_count"))
+    )
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Removals are counted before they happen, as pk_set holds every id
+    # passed to remove(), including the ones that were not attached
+    if action not in ("post_add", "pre_remove", "pre_clear"):
+        return
+    if action != "pre_clear" and not pk_set:
+        return
+
+    if reverse:
+        # instance is a tag, pk_set holds problem ids
+        changed = {instance.path}
+        if action == "pre_clear":
+            problem_ids = list(
+                instance.problem_set.order_by().values_list("pk", flat=True)
+            )
+        else:
+            problem_ids = list(pk_set)
+    else:
+        # instance is a problem, pk_set holds tag ids
+        problem_ids = [instance.pk]
+        changed = None
+        if action != "pre_clear":
+            changed = set(
+                Tag.objects.filter(pk__in=pk_set)
+                .order_by().values_list("path", flat=True)
+            )
+
+    current = problem_tag_paths(problem_ids)
+    changes = []
+    for problem_id in problem_ids:
+        now = current[problem_id]
+        if action == "post_add":
+            changes.append((now - changed, now))
+        else:
+            changes.append((now, set() if changed is None else now - changed))
+    apply_changes(changes)
+
+
+@receiver(pre_delete, sender=Problem)
+def problem_deleted(sender, instance, **kwargs):
+    paths = problem_tag_paths([instance.pk])[instance.pk]
+    if paths:
+        apply_changes([(paths, set())])
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    # The problems of the deleted subtree leave the surviving ancestors
+    refresh(Tag.objects.filter(path__in=ancestor_paths(instance.path)[:-1]))
+
+
+@receiver(tag_moved)
+def tag_moved_counts(sender, tag, old_ancestors, new_ancestors, **kwargs):
+    refresh(Tag.objects.filter(pk__in={*old_ancestors, *new_ancestors}))
@@ -0,0 +1,421 @@
+"""
+Vonty tag index.
+
+Boolean tag queries such as
+
+    combo AND (invariant OR extreme) AND NOT grid
+
+are evaluated in memory instead of as nested EXISTS subqueries.
+For every tag, TagIndex keeps a bitmap of the problems tagged with it
+or one of its descendants: a Python int whose bit n is set for the
+problem with id n. AND, OR and NOT are then single bitwise operations
+running in C over the whole archive. Rare tags, for which a sorted array
+of ids is smaller, are kept as such and turned into bitmaps when queried.
+
+The index also keeps the direct tags and the hardness of every problem,
+from which vonty.similar scores similar problems.
+
+The index is loaded on first use and kept up to date from the
+Problem.tags signals once the changes are committed. It is rebuilt
+when tags move or are deleted, and at least every
+VONTY_TAG_INDEX_TTL seconds for changes made by other processes.
+One thread rebuilds it while the others keep querying the previous one.
+"""
+
+import bisect
+import json
+import re
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Problem, Tag
+from .signals import tag_moved
+
+_index = None
+# Bumped by invalidate(), the index of an older generation is rebuilt
+_generation = 0
+# The problems refreshed while the index is being rebuilt, or None
+_pending = None
+_lock = threading.Lock()
+# Held by the thread rebuilding the index
+_rebuild_lock = threading.Lock()
+
+TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|([\w-]+))")
+OPERATORS = {"AND", "OR", "NOT"}
+# Bit positions of every byte value, to list the ids of a bitmap
+BYTE_BITS = [
+    tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)
+]
+
+
+class TagQueryError(ValueError):
+    """A tag query that cannot be parsed."""
+
+
+def tokenize(query):
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN_RE.match(query, position)
+        if not match:
+            raise TagQueryError(f"Unexpected {query[position:].strip()[:10]!r}")
+        position = match.end()
+        word = match.group(3)
+        if word and word.upper() in OPERATORS:
+            tokens.append(word.upper())
+        else:
+            tokens.append(match.group(1) or match.group(2) or ("tag", word))
+    return tokens
+
+
+def parse_tag_query(query):
+    """
+    Parse a boolean tag query into a tree of tuples:
+    ("tag", name), ("not", node), ("and", left, right), ("or", left, right).
+    NOT binds tighter than AND, which binds tighter than OR,
+    and terms next to each other are ANDed, e.g. "fe NOT cauchy".
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        raise TagQueryError("Empty tag query")
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == "OR":
+            take()
+            node = ("or", node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                take()
+            node = ("and", node, parse_not())
+        return node
+
+    def parse_not():
+        token = peek()
+        if token == "NOT":
+            take()
+            return ("not", parse_not())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise TagQueryError("Missing closing parenthesis")
+            take()
+            return node
+        if isinstance(token, tuple):
+            return take()
+        raise TagQueryError(f"Expected a tag, got {token or 'the end'}")
+
+    node = parse_or()
+    if peek() is not None:
+        raise TagQueryError(f"Unexpected {peek()}")
+    return node
+
+
+def query_names(node):
+    """The tag names used in a parsed query."""
+    if node[0] == "tag":
+        return {node[1]}
+    return set().union(*(query_names(child) for child in node[1:]))
+
+
+class TagIndex:
+    """
+    The bitmaps of the problems in every tag subtree.
+    The memory used per tag is about the highest problem id / 8 bytes,
+    or 8 bytes per problem for the rare tags kept as sorted id arrays.
+    """
+
+    def __init__(self, tags, problems, tag_rows, generation=0):
+        self.loaded_at = time.monotonic()
+        self.generation = generation
+        # Bumped by every change, for caches derived from the index
+        self.version = 0
+        path_ids = {path: pk for pk, _name, path in tags}
+        self.names = {name: pk for pk, name, _path in tags}
+        # Every tag id with the ids of its ancestors, itself included
+        self.ancestors = {
+            pk: tuple(
+                path_ids[path[:end]]
+                for end in range(Tag.steplen, len(path) + 1, Tag.steplen)
+            )
+            for pk, _name, path in tags
+        }
+
+        self.hardness = dict(problems)
+        self.problem_tags = {pk: frozenset() for pk in self.hardness}
+        self.direct_tags = {}
+        direct = defaultdict(list)
+        folded = defaultdict(set)
+        for problem_id, tag_id in tag_rows:
+            direct[problem_id].append(tag_id)
+            folded[problem_id].update(self.ancestors[tag_id])
+        for problem_id, tag_ids in direct.items():
+            self.direct_tags[problem_id] = tuple(tag_ids)
+        members = defaultdict(list)
+        for problem_id, tag_ids in folded.items():
+            self.problem_tags[problem_id] = frozenset(tag_ids)
+            for tag_id in tag_ids:
+                members[tag_id].append(problem_id)
+
+        self.universe = self.build_bitmap(self.problem_tags)
+        # A bitmap takes a byte per 8 ids, an array 8 bytes per member
+        size = self.universe.bit_length()
+        self.bitmaps = {}
+        self.rows = {}
+        for tag_id, ids in members.items():
+            if len(ids) * 64 < size:
+                self.rows[tag_id] = array("q", sorted(ids))
+            else:
+                self.bitmaps[tag_id] = self.build_bitmap(ids)
+
+    @staticmethod
+    def build_bitmap(ids):
+        ids = list(ids)
+        if not ids:
+            return 0
+        buffer = bytearray(max(ids) // 8 + 1)
+        for pk in ids:
+            buffer[pk >> 3] |= 1 << (pk & 7)
+        return int.from_bytes(buffer, "little")
+
+    def bitmap(self, tag_id):
+        """The bitmap of the problems in the subtree of a tag."""
+        if tag_id in self.rows:
+            return self.build_bitmap(self.rows[tag_id])
+        return self.bitmaps.get(tag_id, 0)
+
+    def members(self, tag_id):
+        """The ids of the problems in the subtree of a tag, in order."""
+        if tag_id in self.rows:
+            return list(self.rows[tag_id])
+        return self.ids(self.bitmaps.get(tag_id, 0))
+
+    def counts(self):
+        """The number of problems in the subtree of every tag, by tag id."""
+        counts = {tag_id: len(row) for tag_id, row in self.rows.items()}
+        for tag_id, bitmap in self.bitmaps.items():
+            counts[tag_id] = bitmap.bit_count()
+        return counts
+
+    @classmethod
+    def load(cls, generation=0):
+        tags = Tag.objects.values_list("pk", "name", "path")
+        problems = Problem.objects.values_list("pk", "hardness")
+        tag_rows = Problem.tags.through.objects.values_list(
+            "problem_id", "tag_id"
+        )
+        return cls(list(tags), problems, tag_rows, generation)
+
+    def set_problem(self, pk, tag_ids, exists=True, hardness=None):
+        """Update the bitmaps for the current tags of a problem."""
+        self.version += 1
+        old = self.problem_tags.pop(pk, frozenset())
+        self.direct_tags.pop(pk, None)
+        self.hardness.pop(pk, None)
+        new = frozenset(
+            ancestor for tag_id in tag_ids for ancestor in self.ancestors[tag_id]
+        )
+        bit = 1 << pk
+        for tag_id in old - new:
+            if tag_id in self.rows:
+                row = self.rows[tag_id]
+                del row[bisect.bisect_left(row, pk)]
+            else:
+                self.bitmaps[tag_id] &= ~bit
+        for tag_id in new - old:
+            if tag_id in self.bitmaps:
+                self.bitmaps[tag_id] |= bit
+            else:
+                bisect.insort(self.rows.setdefault(tag_id, array("q")), pk)
+        if exists:
+            self.problem_tags[pk] = new
+            if tag_ids:
+                self.direct_tags[pk] = tuple(tag_ids)
+            self.hardness[pk] = hardness
+            self.universe |= bit
+        else:
+            self.universe &= ~bit
+
+    def evaluate(self, node):
+        """The bitmap of the problems matching a parsed query."""
+        kind = node[0]
+        if kind == "tag":
+            return self.bitmap(self.names.get(node[1]))
+        if kind == "not":
+            return self.universe & ~self.evaluate(node[1])
+        left, right = self.evaluate(node[1]), self.evaluate(node[2])
+        return left & right if kind == "and" else left | right
+
+    @staticmethod
+    def ids(bitmap):
+        """The problem ids of a bitmap, in increasing order."""
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        return [
+            position * 8 + bit
+            for position, byte in enumerate(data) if byte
+            for bit in BYTE_BITS[byte]
+        ]
+
+
+def is_expired(index):
+    ttl = getattr(settings, "VONTY_TAG_INDEX_TTL", 300)
+    return (
+        index.generation != _generation
+        or time.monotonic() - index.loaded_at > ttl
+    )
+
+
+def get_index():
+    """
+    The tag index, loaded on first use. An expired index is rebuilt by
+    the calling thread, while concurrent callers keep getting it.
+    """
+    index = _index
+    if index is not None and not is_expired(index):
+        return index
+    if index is None:
+        # Nothing to serve meanwhile, wait for a concurrent first load
+        _rebuild_lock.acquire()
+    elif not _rebuild_lock.acquire(blocking=False):
+        return index
+    try:
+        index = _index
+        if index is None or is_expired(index):
+            index = rebuild()
+        return index
+    finally:
+        _rebuild_lock.release()
+
+
+def rebuild():
+    """
+    Load a new index without holding _lock and swap it in, then refresh
+    the problems that changed while it was loading, which it may miss.
+    """
+    global _index, _pending
+    with _lock:
+        generation = _generation
+        _pending = set()
+    try:
+        index = TagIndex.load(generation)
+    except BaseException:
+        with _lock:
+            _pending = None
+        raise
+    with _lock:
+        pending, _pending = _pending, None
+        _index = index
+    if pending:
+        refresh(pending)
+    return index
+
+
+def invalidate(**kwargs):
+    """Expire the index, it is rebuilt by the next query."""
+    global _generation
+    with _lock:
+        _generation += 1
+
+
+def refresh(problem_ids):
+    """Reload the tags of the given problems into the index, if loaded."""
+    global _generation
+    if _index is None and _pending is None:
+        return
+    problem_ids = list(problem_ids)
+    existing = dict(
+        Problem.objects.filter(pk__in=problem_ids).values_list("pk", "hardness")
+    )
+    tags = defaultdict(list)
+    rows = Problem.tags.through.objects.filter(
+        problem_id__in=problem_ids
+    ).values_list("problem_id", "tag_id")
+    for problem_id, tag_id in rows:
+        tags[problem_id].append(tag_id)
+    with _lock:
+        if _pending is not None:
+            _pending.update(problem_ids)
+        # The index swapped in meanwhile, if it was being rebuilt
+        index = _index
+        if index is None:
+            return
+        if any(
+            tag_id not in index.ancestors
+            for tag_ids in tags.values() for tag_id in tag_ids
+        ):
+            # A tag created since the index was loaded, rebuild
+            _generation += 1
+            return
+        for pk in problem_ids:
+            index.set_problem(
+                pk, tags[pk], exists=pk in existing, hardness=existing.get(pk),
+            )
+
+
+def refresh_on_commit(problem_ids):
+    """Refresh the problems once the current transaction commits."""
+    problem_ids = list(problem_ids)
+    transaction.on_commit(lambda: refresh(problem_ids))
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        refresh_on_commit([instance.pk])
+    elif action == "pre_clear":
+        refresh_on_commit(instance.problem_set.values_list("pk", flat=True))
+    else:
+        refresh_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def problem_changed(sender, instance, **kwargs):
+    refresh_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(tag_moved)
+def tags_changed(**kwargs):
+    transaction.on_commit(invalidate)
+
+
+def filter_problems(queryset, query):
+    """
+    Filter a problem queryset with a boolean tag query,
+    see parse_tag_query. Tags match their descendants too.
+    """
+    index = get_index()
+    ids = index.ids(index.evaluate(parse_tag_query(query)))
+    if connections[queryset.db].vendor == "sqlite":
+        # One JSON parameter instead of one parameter per id
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT value FROM json_each(%s)", (json.dumps(ids),)
+        ))
+    return queryset.filter(pk__in=ids)
@@ -0,0 +1,260 @@
+"""
+Vonty tag tree loader.
+
+Tag trees are stored nested, as in vonty/fixtures/tags.json and the
+dump_bulk output of treebeard: a list of nodes like
+
+    {"id": 3, "data": {"name": "geometry", "use_filter": true},
+     "children": [...]}
+
+where "id" and "children" are optional. The whole tree is validated in
+memory first, then diffed against the Tag table and merged in a single
+transaction. A node is the existing tag with its id, or else with its
+name. New tags get their paths in one walk of the tree and are written
+with one bulk insert, while existing tags only take the renames and
+use_filter changes of the file. Tags are never moved or deleted, and
+descriptions are only set on new tags, so that edits made in the admin
+survive a reload of the file.
+"""
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import autocomplete, query, tagindex, versioning
+from .models import Change, Tag
+
+# Fields of the node data that are set on the tags
+DATA_FIELDS = ("name", "desc", "use_filter")
+# Fields that may be in a dump but are maintained by the tree or the counts
+IGNORED_FIELDS = (
+    "path", "depth", "numchild", "problem_count", "subtree_problem_count",
+)
+
+
+class TreeError(ValueError):
+    """A tag tree that cannot be loaded, with every problem found."""
+
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def read_tree(path):
+    """Read the nodes of a nested tag tree JSON file."""
+    with open(path, encoding="utf-8") as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError as exc:
+            raise TreeError([f"Invalid JSON: {exc}"])
+
+
+class TagTreeLoader:
+    """
+    Validate nested tag tree nodes and merge them into the Tag table.
+    After load(), the changes made, or that would be made with dry_run,
+    are listed in added (new tags), renamed ((tag, old name) pairs),
+    use_filter_changed (tags), moved ((tag, name of the parent in the
+    file) pairs, left in place) and missing (names of the tags that are
+    not in the file, left in place too).
+    """
+
+    def __init__(self, nodes):
+        # Flat list of nodes in depth-first order, their parent
+        # being the index of an earlier node or None for roots
+        self.nodes = []
+        errors = []
+        if not isinstance(nodes, list):
+            raise TreeError(["Expected a list of nodes"])
+
+        names, ids = {}, {}
+        stack = [(node, None, f"node {i + 1}") for i, node in enumerate(nodes)]
+        stack.reverse()
+        while stack:
+            node, parent, where = stack.pop()
+            try:
+                cleaned = self.clean(node)
+            except TreeError as exc:
+                errors.extend(f"{where}: {error}" for error in exc.errors)
+                continue
+            name = cleaned["name"]
+            if parent is not None:
+                where = f"{self.nodes[parent]['where']} > {name}"
+            else:
+                where = name
+            cleaned.update(parent=parent, where=where)
+            if name in names:
+                errors.append(f"{where}: duplicate name, also at {names[name]}")
+            names.setdefault(name, where)
+            if cleaned["id"] is not None:
+                if cleaned["id"] in ids:
+                    errors.append(
+                        f"{where}: duplicate id {cleaned['id']}, "
+                        f"also at {ids[cleaned['id']]}"
+                    )
+                ids.setdefault(cleaned["id"], where)
+            index = len(self.nodes)
+            self.nodes.append(cleaned)
+            children = list(enumerate(node.get("children") or [], start=1))
+            stack.extend(
+                (child, index, f"{where} > child {i}")
+                for i, child in reversed(children)
+            )
+        if errors:
+            raise TreeError(errors)
+
+    @staticmethod
+    def clean(node):
+        """Clean the id and data of a node. Raises TreeError."""
+        if not isinstance(node, dict) or not isinstance(node.get("data"), dict):
+            raise TreeError(["expected an object with a data object"])
+        if not isinstance(node.get("children", []), list):
+            raise TreeError(["children must be a list"])
+        pk = node.get("id")
+        if pk is not None and (not isinstance(pk, int) or isinstance(pk, bool)):
+            raise TreeError([f"invalid id {pk!r}"])
+
+        data = node["data"]
+        errors = [
+            f"unknown field {key!r}" for key in data
+            if key not in DATA_FIELDS and key not in IGNORED_FIELDS
+        ]
+        cleaned = {"id": pk}
+        for name in DATA_FIELDS:
+            field = Tag._meta.get_field(name)
+            value = data.get(name, field.get_default())
+            try:
+                cleaned[name] = field.clean(value, None)
+            except ValidationError as exc:
+                errors.append(f"{name}: {' '.join(exc.messages)}")
+        if errors:
+            raise TreeError(errors)
+        return cleaned
+
+    def diff(self):
+        """
+        Match the nodes with the existing tags and plan the changes.
+        Raises TreeError if the result would break the tree or the names.
+        """
+        existing = {
+            row[0]: row for row in
+            Tag.objects.select_for_update().order_by()
+            .values_list("pk", "name", "path", "depth", "numchild", "use_filter")
+        }
+        pks_by_name = {row[1]: pk for pk, row in existing.items()}
+        # Last child position of every existing parent path, "" for roots
+        last_positions = {}
+        for _pk, _name, path, *_rest in existing.values():
+            parent_path = path[:-Tag.steplen]
+            position = Tag._str2int(path[-Tag.steplen:])
+            last_positions[parent_path] = max(
+                last_positions.get(parent_path, 0), position
+            )
+
+        errors = []
+        max_length = Tag._meta.get_field("path").max_length
+        self.added, self.renamed, self.moved = [], [], []
+        self.use_filter_changed = []
+        changed = {}
+        matched = {}
+        tags = []
+        for node in self.nodes:
+            parent = None if node["parent"] is None else tags[node["parent"]]
+            pk = node["id"] if node["id"] in existing else pks_by_name.get(node["name"])
+            if pk is not None and pk in matched:
+                errors.append(
+                    f"{node['where']}: tag {existing[pk][1]} is already "
+                    f"at {matched[pk]}"
+                )
+                pk = None
+
+            if pk is None:
+                # A new tag, appended after the children of its parent
+                parent_path = parent.path if parent else ""
+                depth = parent.depth + 1 if parent else 1
+                position = last_positions.get(parent_path, 0) + 1
+                last_positions[parent_path] = position
+                if (
+                    len(Tag._int2str(position)) > Tag.steplen
+                    or depth * Tag.steplen > max_length
+                ):
+                    errors.append(f"{node['where']}: no room in the tree")
+                    tags.append(Tag(path=parent_path, depth=depth))
+                    continue
+                tag = Tag(
+                    name=node["name"], desc=node["desc"],
+                    use_filter=node["use_filter"], depth=depth,
+                    path=Tag._get_path(parent_path, depth, position),
+                )
+                self.added.append(tag)
+                if parent:
+                    parent.numchild += 1
+                    if parent.pk is not None:
+                        changed[parent.pk] = parent
+                tags.append(tag)
+                continue
+
+            matched[pk] = node["where"]
+            _pk, name, path, depth, numchild, use_filter = existing[pk]
+            tag = Tag(
+                pk=pk, name=name, path=path, depth=depth, numchild=numchild,
+                use_filter=use_filter,
+            )
+            tags.append(tag)
+            parent_path = path[:-Tag.steplen]
+            if (parent.path if parent else "") != parent_path:
+                # Moves would need the subtrees and counts rewritten
+                self.moved.append((tag, parent.name if parent else None))
+            if node["name"] != name:
+                self.renamed.append((tag, name))
+                tag.name = node["name"]
+                changed[pk] = tag
+            if node["use_filter"] != use_filter:
+                self.use_filter_changed.append(tag)
+                tag.use_filter = node["use_filter"]
+                changed[pk] = tag
+
+        # The kept names of the tags that are not renamed must stay unique
+        renamed = {tag.pk for tag, _old_name in self.renamed}
+        for tag in [*self.added, *(tag for tag, _old_name in self.renamed)]:
+            holder = pks_by_name.get(tag.name)
+            if holder is not None and holder != tag.pk and holder not in renamed:
+                errors.append(
+                    f"{tag.name}: the name of tag {holder} "
+                    f"at {existing[holder][2]}, which is not renamed"
+                )
+        self.missing = [
+            existing[pk][1] for pk in sorted(existing, key=lambda pk: existing[pk][2])
+            if pk not in matched
+        ]
+        if errors:
+            raise TreeError(errors)
+        self.changed = list(changed.values())
+
+    def load(self, dry_run=False):
+        """Diff the tree, then merge it in one transaction."""
+        with transaction.atomic():
+            self.diff()
+            if dry_run or not (self.added or self.changed):
+                return
+            if self.renamed:
+                # Names may be swapped, so free them all first
+                Tag.objects.bulk_update(
+                    [Tag(pk=tag.pk, name=f"~{tag.pk}") for tag, _ in self.renamed],
+                    ["name"],
+                )
+            Tag.objects.bulk_update(
+                self.changed, ["name", "use_filter", "numchild"], batch_size=500,
+            )
+            Tag.objects.bulk_create(self.added, batch_size=500)
+            # Neither bulk operation sends signals
+            autocomplete.tags_changed()
+            tagindex.tags_changed()
+            query.tags_changed()
+            versioning.bump_on_commit()
+            Change.record(Change.TAG, {
+                *(tag.pk for tag, _old_name in self.renamed),
+                *(tag.pk for tag in self.use_filter_changed),
+                *(tag.pk for tag in self.added),
+            })
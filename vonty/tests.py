@@ -1,3 +1,2198 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    autocomplete, benchmarks, changes, cli, duplicates, exporter, picker,
+    query, similar, snapshot, sources, tagcounts, tagindex, tagtree,
+    versioning,
+)
+from .admin import EstimatedCountPaginator, TagForm
+from .db import ReadDatabaseRouter, read_database
+from .gitsync import GitSyncError, MirrorPool, run_git, sync_problems
+from .importer import ProblemImporter
+from .management.commands.import_problems import Command as ImportCommand
+from .models import Change, Problem, SimilarityBucket, Tag
+from .profiling import ProfilingMiddleware, clear_records, get_records, query_shape
+from .sheets import (
+    BaseCompileBackend, CompileError, SheetBuilder, SubprocessCompileBackend,
+    sheet_queryset,
+)
+from .synthetic import create_tags, deepen, generate_problems, parse_taxonomy
+
+
+def setUpModule():
+    # The data version is shared through files, keep the ones of the
+    # tests out of the cache directory of the site
+    versions = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(versions.cleanup)
+    caches = override_settings(CACHES={
+        **settings.CACHES,
+        "versions": {**settings.CACHES["versions"], "LOCATION": versions.name},
+    })
+    caches.enable()
+    unittest.addModuleCleanup(caches.disable)
+
+
+class TagSubtreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.polar = Tag.objects.add_child(cls.inversion, {"name": "polar"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+
+        cls.p_geo = Problem.objects.create(desc="Cyclic quad", source="A")
+        cls.p_geo.tags.add(cls.geometry)
+        cls.p_polar = Problem.objects.create(desc="Polar mess", source="B")
+        cls.p_polar.tags.add(cls.polar, cls.algebra)
+        cls.p_alg = Problem.objects.create(desc="Fiendish ineq", source="C")
+        cls.p_alg.tags.add(cls.algebra)
+
+    def test_subtree(self):
+        self.assertQuerySetEqual(
+            self.geometry.get_subtree().order_by("path"),
+            [self.geometry, self.inversion, self.polar],
+        )
+
+    def test_with_tags_expands_descendants(self):
+        with self.assertNumQueries(1):
+            problems = set(Problem.objects.with_tags(self.geometry))
+        self.assertEqual(problems, {self.p_geo, self.p_polar})
+
+    def test_with_tags_no_duplicates(self):
+        problems = list(Problem.objects.with_tags(self.polar, self.algebra))
+        self.assertCountEqual(problems, [self.p_polar, self.p_alg])
+
+    def test_with_tags_after_move(self):
+        Tag.objects.move(self.polar, self.algebra, "last-child")
+        self.geometry.refresh_from_db()
+        problems = set(Problem.objects.with_tags(self.geometry))
+        self.assertEqual(problems, {self.p_geo})
+
+
+class AddChildrenTests(TestCase):
+    def test_add_children_appends_in_bulk(self):
+        geometry = Tag.objects.add_root({"name": "geometry"})
+        Tag.objects.add_child(geometry, {"name": "anglechase"})
+        names = [f"tag-{i}" for i in range(100)]
+
+        # Savepoints, parent lock, last child, one insert, parent update
+        # and the change feed insert
+        with self.assertNumQueries(7):
+            geometry.add_children(names, use_filter=False)
+
+        geometry.refresh_from_db()
+        self.assertEqual(geometry.numchild, 101)
+        children = list(Tag.objects.get_children(geometry))
+        self.assertEqual(
+            [tag.name for tag in children], ["anglechase", *names]
+        )
+        self.assertFalse(children[-1].use_filter)
+        self.assertEqual(Tag.objects.find_problems(), ([], [], [], [], []))
+
+    def test_add_children_syncs_autocomplete(self):
+        geometry = Tag.objects.add_root({"name": "geometry"})
+        autocomplete.invalidate()
+        autocomplete.complete("g")
+        with self.captureOnCommitCallbacks(execute=True):
+            geometry.add_children(["simtri", "spiral"])
+        self.assertEqual(
+            [row[1] for row in autocomplete.complete("s")], ["simtri", "spiral"]
+        )
+
+    def test_form_rejects_existing_names_in_one_query(self):
+        Tag.objects.add_root({"name": "algebra"})
+        form = TagForm(data={
+            "name": "geometry",
+            "treebeard_position": "first-child",
+            "children_names": "simtri, algebra\npop",
+        })
+        # One query for the pasted children, one for the tag's own name
+        with self.assertNumQueries(2):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {
+            "children_names": ["A tag named algebra already exists"],
+        })
+
+
+class ProblemSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="evan")
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.problems = []
+        for i in range(12):
+            problem = Problem.objects.create(
+                desc=f"Problem {i}",
+                source=None if i % 4 == 0 else f"ISL 2020/G{i}",
+                hardness=None if i % 5 == 0 else 5 * (i % 3),
+                proposer=cls.user if i % 2 else None,
+            )
+            problem.tags.add(cls.inversion if i % 3 else cls.geometry)
+            cls.problems.append(problem)
+
+    def fetch_all(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = {**params, "limit": 5}
+            if cursor:
+                query["cursor"] = cursor
+            response = self.client.get(reverse("problems"), query)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [row["id"] for row in data["results"]]
+            cursor = data["next"]
+            if cursor is None:
+                return ids
+
+    def setUp(self):
+        versioning.clear_responses()
+
+    def test_keyset_pages_cover_everything_in_order(self):
+        expected = list(
+            Problem.objects.order_by("hardness", "source", "id")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(self.fetch_all(), expected)
+
+    def test_filters(self):
+        ids = self.fetch_all(tags="inversion", hardness_min=5, proposer="evan")
+        expected = [
+            p.pk for p in self.problems
+            if self.problems.index(p) % 3
+            and p.hardness and p.hardness >= 5 and p.proposer
+        ]
+        self.assertCountEqual(ids, expected)
+        self.assertEqual(len(self.fetch_all(source="ISL 2020")), 9)
+
+    def test_page_query_count_is_bounded(self):
+        # Tag lookup, page, tag prefetch
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse("problems"), {"tags": "geometry", "limit": 500}
+            )
+        self.assertEqual(len(response.json()["results"]), 12)
+
+    def test_bad_parameters(self):
+        for params in ({"tags": "nope"}, {"cursor": "junk"}, {"limit": 0}):
+            response = self.client.get(reverse("problems"), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class FullTextSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.ineq = Problem.objects.create(
+            desc="Fiendish inequality", source="USAMO 2004/5", hardness=25,
+        )
+        cls.ineq.tags.add(cls.algebra)
+        cls.fe = Problem.objects.create(
+            desc="Fiendish functional equation", source="ISL 2019/A5",
+            author="Abel George Mathew (IND)", hardness=40,
+        )
+        cls.geo = Problem.objects.create(desc="Cyclic quadrilateral")
+
+    def setUp(self):
+        versioning.clear_responses()
+
+    def test_prefix_and_ranking(self):
+        self.assertCountEqual(
+            Problem.objects.search("Fiend*"), [self.ineq, self.fe]
+        )
+        self.assertSequenceEqual(
+            Problem.objects.search("fiendish ineq*").order_by("search_rank"),
+            [self.ineq],
+        )
+        self.assertSequenceEqual(Problem.objects.search("ISL 2019/A5"), [self.fe])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.geo.desc = "Fiendish cyclic quadrilateral"
+        self.geo.save()
+        self.assertIn(self.geo, Problem.objects.search("fiendish"))
+        self.fe.delete()
+        self.assertCountEqual(
+            Problem.objects.search("fiendish"), [self.ineq, self.geo]
+        )
+        Problem.objects.bulk_create([Problem(desc="Fiendish bulk")])
+        self.assertEqual(Problem.objects.search("bulk").count(), 1)
+
+    def test_search_endpoint_combines_filters(self):
+        response = self.client.get(
+            reverse("problems"),
+            {"q": "fiend*", "tags": "algebra", "hardness_max": 30},
+        )
+        self.assertEqual(
+            [row["id"] for row in response.json()["results"]], [self.ineq.pk]
+        )
+
+    def test_ranked_pages(self):
+        ids, cursor = [], ""
+        while True:
+            data = self.client.get(
+                reverse("problems"), {"q": "fiend*", "limit": 1, "cursor": cursor}
+            ).json()
+            ids += [row["id"] for row in data["results"]]
+            cursor = data["next"]
+            if cursor is None:
+                break
+        self.assertCountEqual(ids, [self.ineq.pk, self.fe.pk])
+
+
+class ImportProblemsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.ineq = Tag.objects.add_child(cls.algebra, {"name": "ineq"})
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_jsonl(self, records):
+        path = os.path.join(self.tmp.name, "problems.jsonl")
+        with open(path, "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+        return path
+
+    def test_jsonl_import_with_checkpoint(self):
+        path = self.write_jsonl([
+            {"source": f"ISL 2020/A{i}", "desc": f"Problem {i}",
+             "hardness": 5 * (i % 4), "tags": ["ineq", "algebra"]}
+            for i in range(7)
+        ] + [{"source": "Bad", "desc": "Too hard", "hardness": 65}])
+        checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+
+        stderr = io.StringIO()
+        call_command(
+            "import_problems", path, batch_size=3, checkpoint=checkpoint,
+            stdout=io.StringIO(), stderr=stderr,
+        )
+        self.assertEqual(Problem.objects.count(), 7)
+        self.assertIn("Record 8", stderr.getvalue())
+        self.assertEqual(Problem.objects.with_tags(self.ineq).count(), 7)
+        self.assertEqual(Problem.tags.through.objects.count(), 14)
+        self.ineq.refresh_from_db()
+        self.assertEqual(self.ineq.problem_count, 7)
+
+        # Rerunning resumes after the checkpoint and imports nothing new
+        stdout = io.StringIO()
+        call_command(
+            "import_problems", path, checkpoint=checkpoint, stdout=stdout,
+        )
+        self.assertIn("Resuming after 8 records", stdout.getvalue())
+        self.assertEqual(Problem.objects.count(), 7)
+
+    def test_resume_after_commit_before_checkpoint(self):
+        path = self.write_jsonl([
+            {"desc": f"Sourceless {i}", "tags": ["ineq"]} for i in range(4)
+        ])
+        checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+        # The import stopped after committing the first batch of two,
+        # before recording it as done
+        original = ImportCommand.write_checkpoint
+        writes = []
+
+        def write_checkpoint(checkpoint, position, committing=None):
+            writes.append(position)
+            if len(writes) == 2:
+                raise KeyboardInterrupt
+            original(checkpoint, position, committing)
+
+        with mock.patch.object(
+            ImportCommand, "write_checkpoint", staticmethod(write_checkpoint)
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command(
+                    "import_problems", path, batch_size=2,
+                    checkpoint=checkpoint, stdout=io.StringIO(),
+                    stderr=io.StringIO(),
+                )
+        self.assertEqual(Problem.objects.count(), 2)
+
+        stderr = io.StringIO()
+        call_command(
+            "import_problems", path, batch_size=2, checkpoint=checkpoint,
+            stdout=io.StringIO(), stderr=stderr,
+        )
+        self.assertEqual(
+            sorted(Problem.objects.values_list("desc", flat=True)),
+            [f"Sourceless {i}" for i in range(4)],
+        )
+        self.assertIn("Skipped imported problem 'Sourceless 0'", stderr.getvalue())
+
+    def test_invalid_encoding_and_tags(self):
+        path = self.write_jsonl([
+            {"source": "A", "desc": "String tags", "tags": "ineq"},
+            {"source": "B", "desc": "Fine", "tags": ["ineq"]},
+        ])
+        with open(path, "ab") as file:
+            file.write(b'{"source": "C", "desc": "\xe9t\xe9"}\n')
+        os.makedirs(os.path.join(self.tmp.name, "von"))
+        with open(os.path.join(self.tmp.name, "von", "1.tex"), "wb") as file:
+            file.write(b"source: D\ndesc: Latin-1 \xe9\n---\n")
+        with open(os.path.join(self.tmp.name, "von", "2.tex"), "w") as file:
+            file.write("source: E\ndesc: Fine\n---\n")
+
+        stderr = io.StringIO()
+        call_command("import_problems", path, stdout=io.StringIO(), stderr=stderr)
+        call_command(
+            "import_problems", os.path.join(self.tmp.name, "von"),
+            stdout=io.StringIO(), stderr=stderr,
+        )
+        self.assertEqual(
+            sorted(Problem.objects.values_list("source", flat=True)), ["B", "E"]
+        )
+        self.assertIn("Record 1: tags: expected a list", stderr.getvalue())
+        self.assertIn("Record 3: Not UTF-8", stderr.getvalue())
+        self.assertIn("Record 1: 1.tex: not UTF-8", stderr.getvalue())
+
+    def test_dry_run_and_existing_sources(self):
+        Problem.objects.create(source="USAMO 2004/5", desc="Old")
+        path = self.write_jsonl([
+            {"source": "USAMO 2004/5", "desc": "Duplicate"},
+            {"source": "USAMO 2004/6", "desc": "New", "tags": ["nope"]},
+            {"source": "USAMO 2004/7", "desc": "New"},
+        ])
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(
+            "import_problems", path, dry_run=True, stdout=stdout, stderr=stderr,
+        )
+        self.assertIn("Validated 1 problems", stdout.getvalue())
+        self.assertIn("Unknown tags: nope", stderr.getvalue())
+        self.assertIn("Skipped existing source 'USAMO 2004/5'", stderr.getvalue())
+        self.assertEqual(Problem.objects.count(), 1)
+
+    def test_von_directory(self):
+        os.makedirs(os.path.join(self.tmp.name, "usamo"))
+        with open(os.path.join(self.tmp.name, "usamo", "2004-5.tex"), "w") as file:
+            file.write(
+                "source: USAMO 2004/5\n"
+                "desc: Fiendish inequality\n"
+                "hardness: 25\n"
+                "tags: ineq\n"
+                "---\n"
+                "Let $a, b, c > 0$.\n"
+            )
+        call_command("import_problems", self.tmp.name, stdout=io.StringIO())
+        problem = Problem.objects.get()
+        self.assertEqual(problem.hardness, 25)
+        self.assertSequenceEqual(problem.tags.all(), [self.ineq])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create(username="evan", is_staff=True)
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        for i in range(5):
+            problem = Problem.objects.create(
+                source=f"ISL 2020/G{i}", desc=f"Problem {i}",
+                hardness=5 * i, proposer=cls.staff,
+            )
+            problem.tags.add(cls.geometry, cls.inversion)
+
+    def test_command_streams_in_chunks(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        out = os.path.join(tmp.name, "problems.ndjson.gz")
+        # One streamed query for the problems, one per chunk for their tags
+        with self.assertNumQueries(4):
+            call_command("export_problems", out, gzip=True, chunk_size=2)
+        with gzip.open(out, "rt") as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["proposer"], "evan")
+        self.assertEqual(rows[0]["tags"], ["geometry", "inversion"])
+
+    def test_command_writes_to_stdout_from_the_read_database(self):
+        stdout = io.StringIO()
+        with mock.patch(
+            "vonty.management.commands.export_problems.read_database",
+            wraps=read_database,
+        ) as reading:
+            call_command("export_problems", format="csv", stdout=stdout)
+        reading.assert_called_once_with()
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["id", "source"])
+        self.assertEqual(len(lines), 6)
+        with self.assertRaises(CommandError):
+            call_command("export_problems", gzip=True, stdout=io.StringIO())
+
+    def test_csv_endpoint_is_staff_only(self):
+        url = reverse("export")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {"format": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["id", "source"])
+        self.assertTrue(lines[1].endswith("geometry inversion"))
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(
+            self.client.get(url, {"format": "xml"}).status_code, 400
+        )
+
+
+class StubCompileBackend(BaseCompileBackend):
+    compiled = []
+
+    def compile(self, source, fmt, output):
+        self.compiled.append((fmt, output))
+        with open(output, "w") as file:
+            file.write(source)
+        return output
+
+
+class SheetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.problems = [
+            Problem.objects.create(
+                source=f"USAMO 200{i}/5", desc=f"Fiendish 50% inequality {i}",
+                hardness=5 * i,
+            )
+            for i in range(5)
+        ]
+        for problem in cls.problems:
+            problem.tags.add(cls.algebra)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        fragments = self.settings(
+            VONTY_SHEET_FRAGMENTS=os.path.join(tmp.name, "fragments")
+        )
+        fragments.enable()
+        self.addCleanup(fragments.disable)
+
+    def test_rebuild_only_renders_changed_fragments(self):
+        builder = SheetBuilder("tex")
+        source = builder.build(sheet_queryset(tags=[self.algebra]))
+        self.assertEqual((builder.rendered, builder.reused), (5, 0))
+        self.assertIn(r"Fiendish 50\% inequality 3", source)
+
+        problem = self.problems[2]
+        problem.desc = "Edited"
+        problem.save()
+        # A new builder, as in another process, reuses the stored fragments
+        builder = SheetBuilder("tex")
+        source = builder.build(sheet_queryset(hardness_max=60))
+        self.assertEqual((builder.rendered, builder.reused), (1, 4))
+        self.assertIn("Edited", source)
+
+    def test_compile_errors(self):
+        backend = SubprocessCompileBackend()
+        backend.commands = {
+            "typ": ["sh", "-c", "echo 'error: unclosed' >&2; exit 1"],
+        }
+        with self.assertRaisesMessage(CompileError, "error: unclosed"):
+            backend.compile("#", "typ", "sheet.pdf")
+        backend.commands = {"typ": ["vonty-no-such-compiler"]}
+        with self.assertRaisesMessage(CompileError, "Cannot run vonty-no-such"):
+            backend.compile("#", "typ", "sheet.pdf")
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        output = os.path.join(tmp.name, "sheet.typ")
+        with mock.patch.dict(os.environ, {"PATH": tmp.name}):
+            with self.assertRaisesMessage(CommandError, "Cannot compile"):
+                call_command(
+                    "build_sheet", output, format="typ", pdf=output + ".pdf",
+                    stdout=io.StringIO(),
+                )
+
+    def test_command_with_stub_backend(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        output = os.path.join(tmp.name, "sheet.typ")
+        with self.settings(VONTY_SHEET_BACKEND="vonty.tests.StubCompileBackend"):
+            call_command(
+                "build_sheet", output, format="typ", pdf=output + ".pdf",
+                sources=["USAMO 2001/5", "USAMO 2003/5"], stdout=io.StringIO(),
+            )
+        with open(output) as file:
+            source = file.read()
+        self.assertEqual(source.count("\n+ "), 2)
+        self.assertIn(("typ", output + ".pdf"), StubCompileBackend.compiled)
+
+
+class GitSyncTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pool = MirrorPool(os.path.join(self.tmp.name, "mirrors"))
+
+    def make_repo(self, name):
+        path = os.path.join(self.tmp.name, name)
+        run_git("init", "--quiet", path)
+        self.commit(path)
+        return path
+
+    def commit(self, path):
+        run_git(
+            "-c", "user.name=vonty", "-c", "user.email=vonty@example.com",
+            "commit", "--allow-empty", "--quiet", "-m", "Edit", cwd=path,
+        )
+        return run_git("rev-parse", "HEAD", cwd=path)
+
+    def test_sync_dedupes_and_only_reports_changes(self):
+        shared = self.make_repo("shared")
+        alone = self.make_repo("alone")
+        p1 = Problem.objects.create(desc="1", git_url=f"file://{shared}")
+        p2 = Problem.objects.create(desc="2", git_url=f"file://{shared}")
+        p3 = Problem.objects.create(desc="3", git_url=f"file://{alone}")
+        broken = Problem.objects.create(desc="4", git_url="file:///nonexistent")
+        Problem.objects.create(desc="No repository")
+
+        changed, errors = sync_problems(pool=self.pool, workers=2)
+        self.assertCountEqual(changed, [p1, p2, p3])
+        self.assertEqual(list(errors), [broken.git_url])
+        self.assertEqual(len(os.listdir(self.pool.root)), 2)
+
+        head = self.commit(alone)
+        Problem.objects.update(modified=timezone.now() - timedelta(days=1))
+        last = Change.objects.order_by("pk").last().pk
+        version, _modified = versioning.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            changed, errors = sync_problems(pool=self.pool)
+        self.assertEqual(changed, [p3])
+        p3.refresh_from_db()
+        self.assertEqual(p3.git_commit, head)
+        # Seen by the snapshots, the change feed and the cached responses
+        self.assertGreater(p3.modified, timezone.now() - timedelta(hours=1))
+        self.assertEqual(
+            list(
+                Change.objects.filter(pk__gt=last)
+                .values_list("object_id", flat=True)
+            ),
+            [p3.pk],
+        )
+        self.assertGreater(versioning.get_version()[0], version)
+
+    def test_stale_clone_and_missing_git(self):
+        url = f"file://{self.make_repo('repo')}"
+        path = self.pool.mirror_path(url)
+        os.makedirs(os.path.join(path + ".tmp", "objects"))
+        self.assertEqual(self.pool.sync(url), run_git("rev-parse", "HEAD", cwd=path))
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+        with mock.patch.dict(os.environ, {"PATH": self.tmp.name}):
+            with self.assertRaisesMessage(GitSyncError, "Cannot run git"):
+                self.pool.sync(url)
+
+
+class TagCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.polar = Tag.objects.add_child(cls.inversion, {"name": "polar"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.p1 = Problem.objects.create(desc="1")
+        cls.p2 = Problem.objects.create(desc="2")
+
+    def assertCounts(self, expected):
+        counts = {
+            tag.name: (tag.problem_count, tag.subtree_problem_count)
+            for tag in Tag.objects.all()
+        }
+        self.assertEqual(counts, expected)
+        self.assertFalse(tagcounts.find_mismatches().exists())
+
+    def setUp(self):
+        versioning.clear_responses()
+
+    def test_incremental_updates(self):
+        self.p1.tags.add(self.geometry, self.polar)
+        self.p2.tags.add(self.inversion)
+        self.algebra.problem_set.add(self.p1, self.p2)
+        self.assertCounts({
+            "geometry": (1, 2), "inversion": (1, 2),
+            "polar": (1, 1), "algebra": (2, 2),
+        })
+
+        self.p1.tags.remove(self.geometry)
+        # Not attached
+        self.p2.tags.remove(self.polar)
+        self.polar.problem_set.remove(self.p2)
+        self.inversion.problem_set.clear()
+        self.assertCounts({
+            "geometry": (0, 1), "inversion": (0, 1),
+            "polar": (1, 1), "algebra": (2, 2),
+        })
+
+        Tag.objects.move(self.polar, self.algebra, "last-child")
+        self.assertCounts({
+            "geometry": (0, 0), "inversion": (0, 0),
+            "polar": (1, 1), "algebra": (2, 2),
+        })
+
+        self.p1.tags.set([self.inversion])
+        self.p2.delete()
+        self.assertCounts({
+            "geometry": (0, 1), "inversion": (1, 1),
+            "polar": (0, 0), "algebra": (0, 0),
+        })
+
+        self.inversion.delete()
+        self.assertCounts({
+            "geometry": (0, 0), "polar": (0, 0), "algebra": (0, 0),
+        })
+
+    def test_rebuild_and_verify_command(self):
+        self.p1.tags.add(self.polar)
+        Tag.objects.update(problem_count=7)
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebuild_tag_counts", verify=True, stderr=io.StringIO()
+            )
+        call_command("rebuild_tag_counts", stdout=io.StringIO())
+        call_command("rebuild_tag_counts", verify=True, stdout=io.StringIO())
+
+    def test_tag_tree_endpoint_is_one_query(self):
+        self.p1.tags.add(self.polar)
+        with self.assertNumQueries(1):
+            rows = self.client.get(reverse("tags")).json()["results"]
+        self.assertEqual(rows[1]["name"], "inversion")
+        self.assertEqual(rows[1]["parent"], "geometry")
+        self.assertEqual(rows[1]["subtree_problem_count"], 1)
+
+
+class ProblemAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser("admin")
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_problems(self, count):
+        start = Problem.objects.count()
+        for i in range(start, start + count):
+            problem = Problem.objects.create(
+                desc=f"Problem {i}", source=f"Source {i}", proposer=self.admin,
+            )
+            problem.tags.add(self.inversion if i % 2 else self.algebra)
+
+    def changelist(self, params=None):
+        return self.client.get(
+            reverse("admin:vonty_problem_changelist"), params or {}
+        )
+
+    def test_changelist_queries_do_not_grow(self):
+        self.add_problems(3)
+        with CaptureQueriesContext(connection) as small:
+            self.changelist()
+        self.add_problems(30)
+        with CaptureQueriesContext(connection) as large:
+            response = self.changelist()
+        self.assertEqual(len(small), len(large))
+        self.assertContains(response, "inversion")
+
+    def test_tag_filter_uses_subtree(self):
+        self.add_problems(4)
+        response = self.changelist({"tag": self.geometry.pk})
+        self.assertEqual(response.context["cl"].result_count, 2)
+        self.assertContains(response, "— inversion (2)")
+
+    def test_search_uses_fulltext_index(self):
+        self.add_problems(3)
+        response = self.changelist({"q": "Problem 1"})
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+    def test_estimated_count_for_large_unfiltered_tables(self):
+        self.add_problems(5)
+        Problem.objects.filter(desc="Problem 0").delete()
+        with mock.patch.object(EstimatedCountPaginator, "threshold", 3):
+            unfiltered = self.changelist()
+            filtered = self.changelist({"tag": self.algebra.pk})
+        # The largest id is an overestimate after deletes
+        self.assertEqual(unfiltered.context["cl"].result_count, 5)
+        self.assertEqual(filtered.context["cl"].result_count, 2)
+
+    def test_change_form_uses_autocomplete(self):
+        self.add_problems(1)
+        problem = Problem.objects.get()
+        response = self.client.get(
+            reverse("admin:vonty_problem_change", args=[problem.pk])
+        )
+        self.assertContains(response, 'data-field-name="tags"')
+        self.assertContains(response, 'data-field-name="proposer"')
+        # Only the selected tag is rendered as an option
+        self.assertContains(response, ">Algebra</option>")
+        self.assertNotContains(response, ">Geometry</option>")
+
+
+class DatabaseProfileTests(TestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_router_only_reroutes_read_blocks_outside_transactions(self):
+        router = ReadDatabaseRouter()
+        self.assertIsNone(router.db_for_read(Problem))
+        with read_database():
+            # TestCase runs inside a transaction
+            self.assertIsNone(router.db_for_read(Problem))
+            with mock.patch.object(connection, "in_atomic_block", False):
+                self.assertEqual(router.db_for_read(Problem), "readonly")
+        self.assertFalse(router.allow_migrate("readonly", "vonty"))
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.problem = Problem.objects.create(
+            desc="Cyclic quad", source="ISL 2020/G1", hardness=15,
+        )
+        cls.problem.tags.add(cls.geometry)
+
+    def setUp(self):
+        versioning.clear_responses()
+
+    async def test_async_endpoints_match_sync_ones(self):
+        for sync_name, async_name, args, params in (
+            ("problems", "aproblems", [], {"tags": "geometry"}),
+            ("problem_detail", "aproblem_detail", [self.problem.pk], {}),
+            ("tags", "atags", [], {}),
+        ):
+            expected = await sync_to_async(self.client.get)(
+                reverse(sync_name, args=args), params
+            )
+            response = await self.async_client.get(
+                reverse(async_name, args=args), params
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_async_errors(self):
+        response = await self.async_client.get(
+            reverse("aproblem_detail", args=[0])
+        )
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(
+            reverse("aproblems"), {"tags": "nope"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SyntheticDataTests(TestCase):
+    def test_taxonomy_nests_headings_under_earlier_tags(self):
+        trees = dict(parse_taxonomy())
+        self.assertIn("nt", trees)
+        algebra = dict(trees["alg"])
+        self.assertIn("cauchy", dict(algebra["fe"]))
+        self.assertNotIn("fe", trees)
+
+        deep = dict(deepen([("fe", [("cauchy", [])])], depth=2, fanout=2))
+        cauchy = dict(deep["fe"])["cauchy"]
+        self.assertEqual(len(cauchy), 2)
+        self.assertEqual(dict(cauchy)["cauchy-x1"][0], ("cauchy-x1-x1", []))
+
+    def test_generated_archive(self):
+        tags = create_tags(deepen(parse_taxonomy(), depth=1, fanout=2))
+        self.assertEqual(Tag.objects.count(), len(tags))
+        self.assertEqual(
+            Tag.objects.get_parent(Tag.objects.get(name="cauchy")).name, "fe"
+        )
+
+        self.assertEqual(generate_problems(300, batch_size=100), 300)
+        hardness = set(Problem.objects.values_list("hardness", flat=True))
+        self.assertTrue(hardness - {None} <= set(range(0, 61, 5)))
+        self.assertFalse(tagcounts.find_mismatches().exists())
+        # The most used tag is far more common than the median one
+        counts = sorted(Tag.objects.values_list("problem_count", flat=True))
+        self.assertGreater(counts[-1], 10 * max(counts[len(counts) // 2], 1))
+
+
+class BenchmarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_tags(deepen(parse_taxonomy(), depth=0, fanout=0))
+        generate_problems(100)
+
+    def test_benchmarks_roll_back_their_writes(self):
+        results = benchmarks.run(repeat=1)
+        self.assertEqual(set(results), {*benchmarks.BENCHMARKS, "_dataset"})
+        self.assertEqual(results["_dataset"]["problems"], 100)
+        self.assertFalse(Tag.objects.filter(name="benchmark-tag").exists())
+        for name in benchmarks.BENCHMARKS:
+            self.assertGreater(results[name]["queries"], 0, name)
+
+    def test_compare(self):
+        baseline = {
+            "search": {"time": 0.1, "queries": 4},
+            "export": {"time": 1.0, "queries": 3},
+        }
+        results = {
+            "search": {"time": 0.12, "queries": 5},
+            "export": {"time": 2.0, "queries": 3},
+            "tag_form": {"time": 1.0, "queries": 9},
+            "_dataset": {},
+        }
+        self.assertEqual(benchmarks.compare(results, baseline, tolerance=1.5), [
+            "search: 5 queries, baseline 4",
+            "export: 2.000s, baseline 1.000s",
+        ])
+
+
+@override_settings(VONTY_PROFILE_SAMPLE_RATE=1.0)
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user("staff", is_staff=True)
+        for i in range(6):
+            Tag.objects.add_root({"name": f"tag{i}"})
+
+    def setUp(self):
+        versioning.clear_responses()
+        clear_records()
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT 1 FROM t WHERE name = 'a''b' AND id IN (%s, %s)"),
+            "SELECT %s FROM t WHERE name = %s AND id IN (...)",
+        )
+
+    def test_repeated_queries_are_flagged(self):
+        def view(request):
+            for name in ("tag0", "tag1", "tag2", "tag3", "tag4", "nope"):
+                Tag.objects.filter(name=name).exists()
+            return HttpResponse()
+
+        middleware = ProfilingMiddleware(view)
+        with self.assertLogs("vonty.profiling", "WARNING"):
+            response = middleware(RequestFactory().get("/slow/"))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^sql;desc="6 queries";dur=[\d.]+, app;dur=[\d.]+$',
+        )
+        [record] = get_records()
+        self.assertEqual(record["path"], "/slow/")
+        self.assertEqual(record["queries"], 6)
+        self.assertEqual(len(record["slowest"]), 5)
+        [repeated] = record["repeated"]
+        self.assertEqual(repeated["count"], 6)
+        self.assertIn('WHERE "vonty_tag"."name" = %s', repeated["sql"])
+
+    async def test_async_queries_are_recorded(self):
+        async def view(request):
+            await Tag.objects.filter(name="tag0").aexists()
+            return HttpResponse(str(await Tag.objects.acount()))
+
+        middleware = ProfilingMiddleware(view)
+        response = await middleware(RequestFactory().get("/async/"))
+        self.assertEqual(response.content, b"6")
+        self.assertTrue(response["Server-Timing"].startswith('sql;desc="2 queries"'))
+        [record] = get_records()
+        self.assertEqual(record["queries"], 2)
+
+    @override_settings(VONTY_PROFILE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.client.get(reverse("tags"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(get_records(), [])
+
+    def test_staff_endpoint(self):
+        self.client.get(reverse("tags"))
+        self.assertEqual(self.client.get(reverse("profiling")).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("profiling"), {"path": "/tags/"})
+        [record] = response.json()["results"]
+        self.assertEqual(record["queries"], 1)
+        response = self.client.get(reverse("profiling"), {"n_plus_one": "1"})
+        self.assertEqual(response.json()["results"], [])
+
+    def test_default_sample_rate(self):
+        self.client.force_login(self.staff)
+        with self.settings():
+            del settings.VONTY_PROFILE_SAMPLE_RATE
+            response = self.client.get(reverse("profiling"))
+        self.assertEqual(response.json()["sample_rate"], 0.01)
+
+
+class PickerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        for year in range(2000, 2010):
+            for number, hardness in enumerate((10, 20, 30, 40), start=1):
+                problem = Problem.objects.create(
+                    desc=f"Problem {year}/{number}",
+                    source=f"USAMO {year}/{number}",
+                    hardness=hardness,
+                )
+                if year % 2:
+                    problem.tags.add(cls.algebra)
+                elif number % 2:
+                    problem.tags.add(cls.inversion)
+                else:
+                    problem.tags.add(cls.geometry)
+
+    def setUp(self):
+        picker.invalidate()
+
+    def test_pick_follows_the_curve_and_constraints(self):
+        problems = picker.pick_problems(
+            [10, 20, 20, 40], required=[self.geometry], seed=1
+        )
+        self.assertEqual([p.hardness for p in problems], [10, 20, 20, 40])
+        years = [p.source.split("/")[0] for p in problems]
+        self.assertEqual(len(set(years)), 4)
+        for problem in problems:
+            self.assertIn(problem.tags.get().name, ("geometry", "inversion"))
+
+        problems = picker.pick_problems(
+            [20, 40], required=[self.geometry], excluded=[self.inversion],
+        )
+        self.assertEqual({p.tags.get() for p in problems}, {self.geometry})
+
+    def test_seed_is_reproducible(self):
+        curve = [10, 20, 30, 40, 10, 20]
+        with self.assertNumQueries(4):
+            first = picker.pick_problems(curve, seed=42)
+        self.assertEqual(picker.pick_problems(curve, seed=42), first)
+        self.assertNotEqual(
+            [picker.pick_problems(curve, seed=seed) for seed in range(5)],
+            [first] * 5,
+        )
+
+    def test_spread_and_errors(self):
+        problems = picker.pick_problems([15, 35], spread=5, seed=3)
+        self.assertIn(problems[0].hardness, (10, 20))
+        self.assertIn(problems[1].hardness, (30, 40))
+        with self.assertRaises(picker.PickError):
+            picker.pick_problems([15], spread=0)
+        # Only 5 papers have inversion problems
+        with self.assertRaises(picker.PickError):
+            picker.pick_problems([10] * 6, required=[self.inversion])
+
+    def test_changes_earlier_picks_when_stuck(self):
+        combinatorics = Tag.objects.add_root({"name": "combinatorics"})
+        for source, hardness in (
+            ("ELMO 2001/1", 10), ("ELMO 2002/1", 10), ("ELMO 2003/2", 20),
+        ):
+            problem = Problem.objects.create(
+                desc=source, source=source, hardness=hardness,
+            )
+            problem.tags.add(combinatorics)
+        # The 15 is filled first and prefers a 10, which the 10s need
+        for seed in range(5):
+            problems = picker.pick_problems(
+                [15, 10, 10], required=[combinatorics], seed=seed,
+            )
+            self.assertEqual([p.hardness for p in problems], [20, 10, 10])
+
+    def test_pool_follows_changes(self):
+        picker.pick_problems([10])
+        problem = Problem.objects.create(
+            desc="Lonely", source="ELMO 2020/1", hardness=60,
+        )
+        [picked] = picker.pick_problems([60], spread=0)
+        self.assertEqual(picked, problem)
+
+    def test_endpoint(self):
+        params = {"hardness": "10,20,30", "tags": "algebra", "seed": 7}
+        response = self.client.get(reverse("pick"), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["seed"], 7)
+        self.assertEqual([p["hardness"] for p in data["results"]], [10, 20, 30])
+        again = self.client.get(reverse("pick"), params)
+        self.assertEqual(again.json(), data)
+
+        fragments = tempfile.TemporaryDirectory()
+        self.addCleanup(fragments.cleanup)
+        with self.settings(VONTY_SHEET_FRAGMENTS=fragments.name):
+            response = self.client.get(reverse("pick"), {**params, "format": "tex"})
+        self.assertEqual(response.content.decode().count(r"\item{}"), 3)
+        self.assertIn("Mock contest 7", response.content.decode())
+
+        for bad in (
+            {"hardness": "12"},
+            {"hardness": "10", "format": "pdf"},
+            {"hardness": "10", "tags": "nope"},
+            {"hardness": "50"},
+        ):
+            response = self.client.get(reverse("pick"), bad)
+            self.assertEqual(response.status_code, 400, bad)
+
+    def test_build_sheet_command(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        output = os.path.join(tmp.name, "sheet.tex")
+        stdout = io.StringIO()
+        with self.settings(VONTY_SHEET_FRAGMENTS=os.path.join(tmp.name, "fragments")):
+            call_command(
+                "build_sheet", output, pick="10,40", tags=["geometry"], seed=5,
+                stdout=stdout,
+            )
+        self.assertIn("Picked 2 problems with seed 5", stdout.getvalue())
+        with open(output) as file:
+            self.assertEqual(file.read().count(r"\item{}"), 2)
+
+
+class TagIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.combo = Tag.objects.add_root({"name": "combo"})
+        cls.invariant = Tag.objects.add_child(cls.combo, {"name": "invariant"})
+        cls.extreme = Tag.objects.add_child(cls.combo, {"name": "extreme"})
+        cls.grid = Tag.objects.add_root({"name": "grid"})
+        cls.p1 = Problem.objects.create(desc="Monovariant", source="A")
+        cls.p1.tags.add(cls.invariant)
+        cls.p2 = Problem.objects.create(desc="Extremal grid", source="B")
+        cls.p2.tags.add(cls.extreme, cls.grid)
+        cls.p3 = Problem.objects.create(desc="Plain combo", source="C")
+        cls.p3.tags.add(cls.combo)
+        cls.p4 = Problem.objects.create(desc="Untagged", source="D")
+
+    def setUp(self):
+        versioning.clear_responses()
+        tagindex.invalidate()
+
+    def matching(self, query):
+        return set(tagindex.filter_problems(Problem.objects.all(), query))
+
+    def test_parse(self):
+        self.assertEqual(
+            tagindex.parse_tag_query("a AND (b or c) not d"),
+            ("and",
+             ("and", ("tag", "a"), ("or", ("tag", "b"), ("tag", "c"))),
+             ("not", ("tag", "d"))),
+        )
+        self.assertEqual(
+            tagindex.parse_tag_query("a OR b AND c"),
+            ("or", ("tag", "a"), ("and", ("tag", "b"), ("tag", "c"))),
+        )
+        for query in ("", "a AND", "(a", "a)", "a ! b", "OR a"):
+            with self.assertRaises(tagindex.TagQueryError, msg=query):
+                tagindex.parse_tag_query(query)
+
+    def test_queries_fold_in_descendants(self):
+        self.assertEqual(self.matching("combo"), {self.p1, self.p2, self.p3})
+        self.assertEqual(
+            self.matching("combo AND (invariant OR extreme) AND NOT grid"),
+            {self.p1},
+        )
+        self.assertEqual(self.matching("NOT combo"), {self.p4})
+        self.assertEqual(self.matching("grid OR invariant"), {self.p1, self.p2})
+        self.assertEqual(self.matching("invariant extreme"), set())
+
+    def test_incremental_updates(self):
+        index = tagindex.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.p4.tags.add(self.grid)
+            self.p1.tags.remove(self.invariant)
+            self.extreme.problem_set.add(self.p3)
+        self.assertEqual(self.matching("grid"), {self.p2, self.p4})
+        self.assertEqual(self.matching("combo"), {self.p2, self.p3})
+        self.assertEqual(self.matching("extreme"), {self.p2, self.p3})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grid.problem_set.clear()
+            p5 = Problem.objects.create(desc="New", source="E")
+            self.p3.delete()
+        self.assertEqual(self.matching("grid"), set())
+        self.assertEqual(self.matching("NOT combo"), {self.p1, self.p4, p5})
+        self.assertIs(tagindex.get_index(), index)
+
+    def test_rare_tags_are_sparse(self):
+        tags = [(1, "common", "0001"), (2, "rare", "00010001")]
+        problems = [(pk, None) for pk in range(1, 1001)]
+        tag_rows = [(pk, 1) for pk in range(1, 1001)] + [(500, 2), (7, 2)]
+        index = tagindex.TagIndex(tags, problems, tag_rows)
+        self.assertEqual((list(index.bitmaps), list(index.rows)), ([1], [2]))
+        query = tagindex.parse_tag_query("common NOT rare")
+        self.assertEqual(len(index.ids(index.evaluate(query))), 998)
+
+        index.set_problem(9, [2])
+        index.set_problem(500, [1])
+        self.assertEqual(index.members(2), [7, 9])
+        self.assertEqual(index.ids(index.bitmap(2)), [7, 9])
+        self.assertEqual(index.counts(), {1: 1000, 2: 2})
+
+    def test_rebuild_does_not_block_queries(self):
+        index = tagindex.get_index()
+        loading, release = threading.Event(), threading.Event()
+        new = tagindex.TagIndex.load(index.generation + 1)
+
+        def load(generation):
+            loading.set()
+            release.wait(5)
+            return new
+
+        tagindex.invalidate()
+        with mock.patch.object(tagindex.TagIndex, "load", load):
+            thread = threading.Thread(target=tagindex.get_index)
+            thread.start()
+            loading.wait(5)
+            # The expired index is served while the other thread rebuilds
+            self.assertIs(tagindex.get_index(), index)
+            release.set()
+            thread.join()
+        self.assertIs(tagindex.get_index(), new)
+
+    def test_new_tags_rebuild_the_index(self):
+        index = tagindex.get_index()
+        [ramsey] = self.combo.add_children(["ramsey"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.p4.tags.add(ramsey)
+        self.assertEqual(self.matching("ramsey"), {self.p4})
+        self.assertIsNot(tagindex.get_index(), index)
+
+    def test_search_form(self):
+        response = self.client.get(
+            reverse("problems"), {"tag_query": "combo AND NOT grid"}
+        )
+        self.assertEqual(
+            [p["source"] for p in response.json()["results"]], ["A", "C"]
+        )
+        for query in ("combo AND", "combo OR nope"):
+            response = self.client.get(reverse("problems"), {"tag_query": query})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("tag_query", response.json()["errors"])
+
+
+class QueryLanguageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="evan")
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.projective = Tag.objects.add_child(cls.geometry, {"name": "projective"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.problems = {}
+        for source, hardness, tags in (
+            ("ISL 2005/G1", 15, [cls.geometry]),
+            ("ISL 2010/G7", 35, [cls.inversion]),
+            ("ISL 2012/G8", 45, [cls.inversion, cls.projective]),
+            ("USAMO 2004/5", 25, [cls.algebra]),
+            ("USAMO 2008/2", 20, [cls.projective]),
+        ):
+            problem = Problem.objects.create(
+                desc=source, source=source, hardness=hardness,
+                author="Evan Chen" if "USAMO" in source else "",
+                proposer=cls.user if hardness == 25 else None,
+            )
+            problem.tags.add(*tags)
+            cls.problems[source] = problem
+
+    def setUp(self):
+        versioning.clear_responses()
+        query.clear_plans()
+
+    def sources(self, text):
+        return set(
+            query.filter_problems(Problem.objects.all(), text)
+            .values_list("source", flat=True)
+        )
+
+    def test_parse(self):
+        self.assertEqual(
+            query.parse_query(
+                "geometry inversion -projective hardness>=25 source:ISL*"
+            ),
+            ("and", [
+                ("tag", "geometry"),
+                ("tag", "inversion"),
+                ("not", ("tag", "projective")),
+                ("hardness", "gte", 25),
+                ("source", "prefix", "ISL"),
+            ]),
+        )
+        self.assertEqual(
+            query.parse_query('(a OR b) author:"Evan Chen"'),
+            ("and", [
+                ("or", [("tag", "a"), ("tag", "b")]),
+                ("author", "exact", "Evan Chen"),
+            ]),
+        )
+        for text in ("", "hardness>=x", "year:2004", "(a", "a OR", "a)"):
+            with self.assertRaises(query.QueryError, msg=text):
+                query.parse_query(text)
+
+    def test_queries(self):
+        self.assertEqual(
+            self.sources("geometry inversion -projective hardness>=25 source:ISL*"),
+            {"ISL 2010/G7"},
+        )
+        self.assertEqual(
+            self.sources("geometry -inversion"), {"ISL 2005/G1", "USAMO 2008/2"}
+        )
+        self.assertEqual(
+            self.sources("algebra OR projective hardness<30"),
+            {"USAMO 2004/5", "USAMO 2008/2"},
+        )
+        self.assertEqual(
+            self.sources("hardness>15 hardness<=35 NOT source:ISL*"),
+            {"USAMO 2004/5", "USAMO 2008/2"},
+        )
+        self.assertEqual(self.sources('source:"USAMO 2004/5"'), {"USAMO 2004/5"})
+        self.assertEqual(self.sources("source:USAMO"), set())
+        self.assertEqual(
+            self.sources("author:chen hardness:20"), {"USAMO 2008/2"}
+        )
+        self.assertEqual(self.sources("proposer:evan"), {"USAMO 2004/5"})
+        self.assertEqual(self.sources("hardness>30 hardness<30"), set())
+        with self.assertRaisesMessage(query.QueryError, "Unknown tags: nope"):
+            query.get_plan("geometry nope")
+
+    def test_plans_are_cached_until_tags_change(self):
+        text = "geometry -projective hardness>=25"
+        with self.assertNumQueries(1):
+            query.get_plan(text)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                query.filter_problems(Problem.objects.all(), text).count(), 1
+            )
+        with self.assertNumQueries(0):
+            query.get_plan("  geometry   -projective hardness>=25 ")
+        self.assertEqual(self.sources('source:"USAMO 2004/5"'), {"USAMO 2004/5"})
+        self.assertEqual(self.sources('source:"USAMO  2004/5"'), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.move(self.inversion, self.algebra, "first-child")
+        self.assertEqual(self.sources(text), set())
+        self.assertEqual(self.sources("algebra hardness>=25"), {
+            "USAMO 2004/5", "ISL 2010/G7", "ISL 2012/G8",
+        })
+
+    def test_search_form(self):
+        response = self.client.get(
+            reverse("problems"), {"query": "inversion -projective"}
+        )
+        self.assertEqual(
+            [p["source"] for p in response.json()["results"]], ["ISL 2010/G7"]
+        )
+        response = self.client.get(reverse("problems"), {"query": "nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("query", response.json()["errors"])
+
+
+class SourceKeyTests(TestCase):
+    def setUp(self):
+        versioning.clear_responses()
+
+    def test_parse_source(self):
+        for source, key in (
+            ("IMO 2023/6", ("IMO", 2023, "", 6)),
+            ("ISL 2005/G10", ("ISL", 2005, "G", 10)),
+            ("Putnam 2010 B6", ("Putnam", 2010, "B", 6)),
+            ("USA TST 2019/3", ("USA TST", 2019, "", 3)),
+            ("Fiendish", ("Fiendish", None, "", None)),
+            ("Shortlist/7", ("Shortlist", None, "", 7)),
+            ("Marathon/99999999999", ("Marathon", None, "", None)),
+            (None, ("", None, "", None)),
+        ):
+            self.assertEqual(sources.parse_source(source), key, msg=source)
+
+    def test_save_keeps_key_in_sync(self):
+        problem = Problem.objects.create(desc="P", source="IMO 2023/6")
+        problem.refresh_from_db()
+        self.assertEqual(
+            (problem.source_contest, problem.source_year, problem.source_number),
+            ("IMO", 2023, 6),
+        )
+        problem.source = "USAMO 2004/5"
+        problem.save(update_fields=["source"])
+        problem.refresh_from_db()
+        self.assertEqual(problem.source_contest, "USAMO")
+        self.assertEqual(problem.source_number, 5)
+
+    def test_backfill_command(self):
+        problem = Problem.objects.create(desc="P", source="IMO 2023/6")
+        Problem.objects.update(source="ISL 2005/G1")
+        out = io.StringIO()
+        call_command("backfill_source_keys", stdout=out)
+        self.assertIn("Updated 1 problems", out.getvalue())
+        problem.refresh_from_db()
+        self.assertEqual(
+            (
+                problem.source_contest, problem.source_year,
+                problem.source_part, problem.source_number,
+            ),
+            ("ISL", 2005, "G", 1),
+        )
+
+    def test_contest_order_pages(self):
+        for source in (
+            "USAMO 2004/10", "IMO 2023/6", "USAMO 2004/2", None,
+            "IMO 2019/1", "USAMO 1999/3", "ISL 2005/G1", "ISL 2005/A2",
+            "ISL 2005/C1",
+        ):
+            Problem.objects.create(desc=str(source), source=source)
+        ids, cursor = [], None
+        while True:
+            params = {"order": "contest", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.client.get(reverse("problems"), params).json()
+            ids += [row["id"] for row in data["results"]]
+            cursor = data["next"]
+            if cursor is None:
+                break
+        self.assertEqual(
+            [Problem.objects.get(pk=pk).source for pk in ids],
+            [
+                None, "IMO 2019/1", "IMO 2023/6",
+                "ISL 2005/A2", "ISL 2005/C1", "ISL 2005/G1",
+                "USAMO 1999/3", "USAMO 2004/2", "USAMO 2004/10",
+            ],
+        )
+
+
+class DuplicateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser("admin")
+        cls.original = Problem.objects.create(
+            source="USAMO 2004/5", author="Titu Andreescu",
+            desc="Fiendish inequality",
+        )
+        Problem.objects.create(
+            source="IMO 2023/2", author="Someone", desc="Tangent circles",
+        )
+
+    def test_similar_problems_share_buckets(self):
+        first = duplicates.shingles("USAMO 2004/5 Titu Andreescu Fiendish inequality")
+        second = duplicates.shingles("USAMO 2004 P5 Titu Andreescu Fiendish inequality.")
+        self.assertGreater(duplicates.similarity(first, second), 0.8)
+        self.assertTrue(
+            set(duplicates.bucket_keys(first)) & set(duplicates.bucket_keys(second))
+        )
+        self.assertEqual(duplicates.bucket_keys(set()), [])
+
+    def test_find_duplicates(self):
+        copy = Problem(
+            source="USAMO 2004 P5", author="Titu Andreescu",
+            desc="Fiendish inequality.",
+        )
+        again = Problem(
+            source="USAMO 2004 #5", author="Titu Andreescu",
+            desc="Fiendish inequality",
+        )
+        unrelated = Problem(source="ISL 2005/G1", desc="Cyclic quadrilateral")
+        with self.assertNumQueries(2):
+            results = duplicates.find_duplicates([copy, again, unrelated])
+        self.assertEqual([other for _score, other in results[0]], [self.original])
+        # The second copy matches the archive and the first one
+        self.assertCountEqual(
+            [other for _score, other in results[1]], [self.original, copy],
+        )
+        self.assertEqual(results[2], [])
+
+    def test_buckets_follow_saves(self):
+        self.assertEqual(
+            SimilarityBucket.objects.filter(problem=self.original).count(),
+            duplicates.NUM_BANDS,
+        )
+        problem = Problem.objects.create(desc="Fiendish inequality", source="X")
+        self.assertEqual(
+            [other for _score, other in duplicates.find_duplicates([problem])[0]],
+            [],
+        )
+        problem.source = "USAMO 2004 P5"
+        problem.author = "Titu Andreescu"
+        problem.save()
+        self.assertEqual(
+            [other for _score, other in duplicates.find_duplicates([problem])[0]],
+            [self.original],
+        )
+        problem.delete()
+        self.assertEqual(
+            duplicates.find_duplicates([self.original])[0], []
+        )
+
+    def test_import_reports_duplicates(self):
+        importer = ProblemImporter()
+        importer.write([
+            (Problem(source="USAMO 2004 P5", author="Titu Andreescu",
+                     desc="Fiendish inequality"), []),
+            (Problem(source="ISL 2005/G1", desc="Cyclic quadrilateral"), []),
+        ])
+        self.assertEqual(len(importer.duplicates), 1)
+        problem, matches = importer.duplicates[0]
+        self.assertEqual(problem.source, "USAMO 2004 P5")
+        self.assertEqual(matches[0][1], self.original)
+        # Imported problems are indexed
+        self.assertEqual(
+            SimilarityBucket.objects.filter(problem=problem).count(),
+            duplicates.NUM_BANDS,
+        )
+
+    def test_admin_save_warns(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse("admin:vonty_problem_add"),
+            {"source": "USAMO 2004 P5", "author": "Titu Andreescu",
+             "desc": "Fiendish inequality"},
+            follow=True,
+        )
+        self.assertContains(response, "This problem looks like")
+        self.assertContains(
+            response,
+            reverse("admin:vonty_problem_change", args=[self.original.pk]),
+        )
+
+    def test_find_duplicates_command(self):
+        copy = Problem.objects.create(
+            source="USAMO 2004 P5", author="Titu Andreescu",
+            desc="Fiendish inequality",
+        )
+        SimilarityBucket.objects.all().delete()
+        stdout = io.StringIO()
+        call_command("find_duplicates", rebuild=True, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn("Indexed 3 problems", output)
+        self.assertIn(
+            f"#{self.original.pk} 'USAMO 2004/5'  #{copy.pk} 'USAMO 2004 P5'",
+            output,
+        )
+        self.assertIn("Found 1 likely duplicate pairs", output)
+
+    def test_import_without_check(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "problems.jsonl")
+        with open(path, "w") as file:
+            file.write(json.dumps({
+                "source": "USAMO 2004 P5", "author": "Titu Andreescu",
+                "desc": "Fiendish inequality",
+            }) + "\n")
+        stderr = io.StringIO()
+        call_command(
+            "import_problems", path, check_duplicates=False,
+            stdout=io.StringIO(), stderr=stderr,
+        )
+        self.assertNotIn("Possible duplicate", stderr.getvalue())
+        copy = Problem.objects.get(source="USAMO 2004 P5")
+        self.assertFalse(SimilarityBucket.objects.filter(problem=copy).exists())
+
+        # Indexed by the next find_duplicates run, which reports it
+        stdout = io.StringIO()
+        call_command("find_duplicates", stdout=stdout)
+        self.assertIn("Indexed 1 problems", stdout.getvalue())
+        self.assertIn("Found 1 likely duplicate pairs", stdout.getvalue())
+        self.assertEqual(duplicates.index_missing(), 0)
+
+
+class SimilarProblemsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(geometry, {"name": "inversion"})
+        projective = Tag.objects.add_child(geometry, {"name": "projective"})
+        algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.problems = {}
+        for source, hardness, tags in (
+            ("A", 20, [cls.inversion]),
+            ("B", 25, [cls.inversion]),
+            ("C", 50, [cls.inversion]),
+            ("D", 20, [projective]),
+            ("E", 20, [algebra]),
+            ("F", 20, [algebra]),
+        ):
+            problem = Problem.objects.create(
+                desc=source, source=source, hardness=hardness,
+            )
+            problem.tags.add(*tags)
+            cls.problems[source] = problem
+
+    def setUp(self):
+        versioning.clear_responses()
+        tagindex.invalidate()
+
+    def similar_sources(self, source, **params):
+        response = self.client.get(
+            reverse("similar", args=[self.problems[source].pk]), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return [row["source"] for row in response.json()["results"]]
+
+    def test_ranking(self):
+        # Same tag at the closest hardness, then further, then a sibling tag
+        self.assertEqual(self.similar_sources("A"), ["B", "C", "D"])
+        self.assertEqual(self.similar_sources("A", limit=1), ["B"])
+        self.assertEqual(self.similar_sources("E"), ["F"])
+
+    def test_scores(self):
+        scores = similar.similar_problems(self.problems["A"].pk)
+        self.assertEqual(scores[0], (1 - similar.HARDNESS_WEIGHT / 6, self.problems["B"].pk))
+        self.assertTrue(all(0 < score <= 1 for score, _pk in scores))
+
+    def test_common_tags_rank_candidates(self):
+        tags = [
+            (1, "geometry", "0001"), (2, "inversion", "00010001"),
+            (3, "algebra", "0002"),
+        ]
+        tag_rows = [(6, 2), (7, 2), (7, 3), (8, 2), (8, 3)]
+        tag_rows += [(pk, 3) for pk in range(1, 6)]
+        index = tagindex.TagIndex(
+            tags, [(pk, None) for pk in range(1, 9)], tag_rows
+        )
+        weights, _norms = similar.get_weights(index)
+        # Even inversion has more problems than the limit, 7 shares algebra too
+        self.assertEqual(similar.candidates(index, 8, weights, limit=1), [7])
+
+    def test_follows_tag_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problems["E"].tags.set([self.inversion])
+        self.assertEqual(self.similar_sources("E")[0], "A")
+        self.assertNotIn("F", self.similar_sources("E"))
+
+    def test_errors(self):
+        response = self.client.get(reverse("similar", args=[0]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("similar", args=[self.problems["A"].pk]), {"limit": 0}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class VersioningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.problem = Problem.objects.create(desc="Circles", source="A")
+
+    def setUp(self):
+        versioning.get_cache().clear()
+        versioning.clear_responses()
+
+    def test_conditional_get(self):
+        url = reverse("problem_detail", args=[self.problem.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        response = self.client.get(
+            url, headers={"If-Modified-Since": response["Last-Modified"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.geometry)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["tags"], ["geometry"])
+
+    def test_cached_responses(self):
+        url = reverse("problems")
+        first = self.client.get(url, {"tags": "geometry"})
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, {"tags": "geometry"})
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(cached["Content-Type"], "application/json")
+        # Errors are not cached
+        self.client.get(url, {"tags": "nope"})
+        with self.assertNumQueries(1):
+            self.client.get(url, {"tags": "nope"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.geometry)
+        response = self.client.get(url, {"tags": "geometry"})
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_version_follows_changes(self):
+        version, _modified = versioning.get_version()
+        for change in (
+            lambda: Problem.objects.create(desc="Lines"),
+            lambda: Tag.objects.add_child(self.geometry, {"name": "inversion"}),
+            lambda: self.problem.tags.add(self.geometry),
+            lambda: self.problem.delete(),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertGreater(versioning.get_version()[0], version)
+            version = versioning.get_version()[0]
+        # Without a commit nothing is visible yet
+        Tag.objects.add_root({"name": "algebra"})
+        self.assertEqual(versioning.get_version()[0], version)
+
+    def test_bumps_from_other_processes(self):
+        url = reverse("problems")
+        first = self.client.get(url, {"tags": "geometry"})
+        # Written by a command, e.g. import_problems, which bumps on commit
+        Problem.tags.through.objects.create(
+            problem=self.problem, tag=self.geometry
+        )
+        result = subprocess.run(
+            [sys.executable, "manage.py", "shell", "-c", (
+                "from django.test import override_settings\n"
+                "from vonty import versioning\n"
+                f"with override_settings(CACHES={settings.CACHES!r}):\n"
+                "    versioning.bump()\n"
+            )],
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        response = self.client.get(
+            url, {"tags": "geometry"}, headers={"If-None-Match": first["ETag"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    async def test_async_lookup_off_the_event_loop(self):
+        def get_version():
+            # Raises outside of the event loop thread
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            return 1, 0.0
+
+        with mock.patch.object(versioning, "get_version", get_version):
+            response = await self.async_client.get(reverse("aproblems"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], '"1"')
+
+    @override_settings(VONTY_RESPONSE_CACHE_SIZE=400)
+    def test_eviction(self):
+        versioning.get_response("a", 1)
+        for key in "abcdefgh":
+            versioning.store_response(key, 1, HttpResponse(b"x" * 50))
+        # Use a, so that b is the least recently used
+        self.assertIsNotNone(versioning.get_response("a", 1))
+        versioning.store_response("i", 1, HttpResponse(b"x" * 50))
+        self.assertIsNone(versioning.get_response("b", 1))
+        self.assertIsNotNone(versioning.get_response("a", 1))
+        self.assertIsNotNone(versioning.get_response("i", 1))
+        # Too large to be kept at all
+        versioning.store_response("j", 1, HttpResponse(b"x" * 51))
+        self.assertIsNone(versioning.get_response("j", 1))
+        # Another version drops everything
+        self.assertIsNone(versioning.get_response("a", 2))
+        versioning.store_response("k", 1, HttpResponse(b"x"))
+        self.assertIsNone(versioning.get_response("k", 2))
+
+
+class TagTreeTests(TestCase):
+    def setUp(self):
+        autocomplete.invalidate()
+
+    def load(self, nodes, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            loader = tagtree.TagTreeLoader(nodes)
+            loader.load(**kwargs)
+        return loader
+
+    def tree(self):
+        return [
+            (tag.name, tag.depth, tag.numchild, tag.use_filter)
+            for tag in Tag.objects.order_by("path")
+        ]
+
+    def test_fixture(self):
+        call_command("load_tags", stdout=io.StringIO())
+        self.assertEqual(self.tree(), [
+            ("algebra", 1, 0, True),
+            ("geometry", 1, 1, True),
+            ("angle-chase", 2, 0, True),
+        ])
+        # Loading it again changes nothing
+        loader = self.load(tagtree.read_tree(
+            os.path.join(os.path.dirname(__file__), "fixtures", "tags.json")
+        ))
+        self.assertEqual(loader.added, [])
+        self.assertEqual(loader.changed, [])
+
+    def test_merge(self):
+        geometry = Tag.objects.add_root({"name": "geometry"})
+        inversion = Tag.objects.add_child(geometry, {"name": "invert"})
+        Tag.objects.add_child(geometry, {"name": "projective"})
+        Tag.objects.add_root({"name": "legacy"})
+        tagindex.get_index()
+
+        # The savepoint, diff, renames, updates, inserts, changes and release
+        with self.assertNumQueries(7):
+            loader = self.load([
+                {"data": {"name": "algebra"}, "children": [
+                    {"data": {"name": "inequalities", "desc": "Bounds"}},
+                ]},
+                {"data": {"name": "geometry", "use_filter": False}, "children": [
+                    {"id": inversion.pk, "data": {"name": "inversion"}},
+                    {"data": {"name": "projective"}},
+                    {"data": {"name": "spiral"}},
+                ]},
+            ])
+        self.assertEqual(self.tree(), [
+            ("geometry", 1, 3, False),
+            ("inversion", 2, 0, True),
+            ("projective", 2, 0, True),
+            ("spiral", 2, 0, True),
+            ("legacy", 1, 0, True),
+            ("algebra", 1, 1, True),
+            ("inequalities", 2, 0, True),
+        ])
+        self.assertEqual([tag.name for tag, _ in loader.renamed], ["inversion"])
+        self.assertEqual(loader.missing, ["legacy"])
+        self.assertEqual(Tag.objects.get(name="inequalities").desc, "Bounds")
+        self.assertEqual(
+            Tag.objects.get_parent(Tag.objects.get(name="spiral")).name,
+            "geometry",
+        )
+        self.assertIn("spiral", tagindex.get_index().names)
+        Tag.objects.fix_tree()
+        self.assertEqual(self.tree()[0], ("geometry", 1, 3, False))
+
+    def test_swapped_names_and_moves(self):
+        a = Tag.objects.add_root({"name": "a"})
+        b = Tag.objects.add_child(a, {"name": "b"})
+        loader = self.load([
+            {"id": a.pk, "data": {"name": "b"}},
+            {"id": b.pk, "data": {"name": "a"}},
+        ])
+        self.assertEqual(self.tree(), [("b", 1, 1, True), ("a", 2, 0, True)])
+        self.assertEqual(loader.moved, [(Tag.objects.get(pk=b.pk), None)])
+
+        loader = self.load([{"data": {"name": "a"}}], dry_run=True)
+        self.assertEqual(loader.missing, ["b"])
+        self.assertEqual(self.tree(), [("b", 1, 1, True), ("a", 2, 0, True)])
+
+    def test_errors(self):
+        Tag.objects.add_root({"name": "taken"})
+        for nodes, message in (
+            ({}, "Expected a list"),
+            ([{"data": {"name": "a b"}}], "node 1: name: Enter a valid"),
+            ([{"data": {"name": "a", "colour": 1}}], "unknown field 'colour'"),
+            ([{"data": {"name": "a"}, "children": [{"data": {"name": "a"}}]}],
+             "a > a: duplicate name, also at a"),
+            ([{"data": {"name": "a"}, "children": [{"nope": 1}]}],
+             "a > child 1: expected an object"),
+        ):
+            with self.assertRaisesMessage(tagtree.TreeError, message):
+                tagtree.TagTreeLoader(nodes)
+
+        # Validated against the table, before writing anything
+        loader = tagtree.TagTreeLoader([
+            {"data": {"name": "new"}},
+            {"id": Tag.objects.get().pk, "data": {"name": "other"}},
+            {"data": {"name": "taken"}},
+        ])
+        with self.assertRaisesMessage(tagtree.TreeError, "already at other"):
+            loader.load()
+        self.assertEqual(self.tree(), [("taken", 1, 0, True)])
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+            file.write('[{"data": {"name": "a"}}, {"data": {}}]')
+            file.flush()
+            with self.assertRaisesMessage(CommandError, "1 errors"):
+                call_command("load_tags", file.name, stderr=io.StringIO())
+        self.assertEqual(self.tree(), [("taken", 1, 0, True)])
+
+
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.problems = {}
+        for source, hardness, tags in (
+            ("ISL 2019/G3", 25, [cls.inversion]),
+            ("ISL 2005/G1", 20, [cls.geometry]),
+            ("ISL 2010/A2", 30, [cls.algebra]),
+            ("IMO 2019/2", 20, [cls.inversion]),
+            (None, None, []),
+        ):
+            problem = Problem.objects.create(
+                source=source, desc=f"Problem {source}", hardness=hardness,
+            )
+            problem.tags.add(*tags)
+            cls.problems[source] = problem
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "vonty.snapshot")
+
+    def run_cli(self, *args):
+        stdout = io.StringIO()
+        with mock.patch("sys.stdout", stdout), mock.patch("sys.stderr", io.StringIO()):
+            status = cli.main(["--snapshot", self.path, *args])
+        self.assertEqual(status, 0)
+        return stdout.getvalue()
+
+    def search(self, *args):
+        return [
+            json.loads(line)["source"]
+            for line in self.run_cli("search", "--json", *args).splitlines()
+        ]
+
+    def test_queries(self):
+        self.assertEqual(exporter.build_snapshot(self.path), (5, 5))
+        # Rows are in contest, year and number order
+        self.assertEqual(self.search("-t", "geometry"), [
+            "IMO 2019/2", "ISL 2005/G1", "ISL 2019/G3",
+        ])
+        self.assertEqual(
+            self.search("-c", "ISL", "-t", "geometry", "-H", "25-30"),
+            ["ISL 2019/G3"],
+        )
+        self.assertEqual(self.search("-c", "ISL", "-y", "2006-"), [
+            "ISL 2010/A2", "ISL 2019/G3",
+        ])
+        self.assertEqual(self.search("-y", "2019", "-H", "-20"), ["IMO 2019/2"])
+        self.assertEqual(self.search("-c", "USAMO"), [])
+
+        problem = json.loads(self.run_cli("show", "--json", "ISL 2019/G3"))
+        self.assertEqual(problem["id"], self.problems["ISL 2019/G3"].pk)
+        self.assertEqual(problem["tags"], ["inversion"])
+        self.assertEqual(problem["hardness"], 25)
+        unsourced = self.problems[None].pk
+        self.assertIn("desc: Problem None", self.run_cli("show", f"#{unsourced}"))
+        self.assertEqual(
+            self.run_cli("tags", "geometry"), "geometry (3)\n  inversion (2)\n"
+        )
+        with mock.patch("sys.stderr", io.StringIO()) as stderr:
+            self.assertEqual(cli.main(["--snapshot", self.path, "show", "X"]), 1)
+            self.assertEqual(
+                cli.main(["--snapshot", self.path + "x", "tags"]), 1
+            )
+        self.assertIn("No problem 'X'", stderr.getvalue())
+        self.assertIn("export_snapshot", stderr.getvalue())
+
+    def test_large_hardness(self):
+        Problem.objects.filter(pk=self.problems["IMO 2019/2"].pk).update(
+            hardness=200
+        )
+        exporter.build_snapshot(self.path, full=True)
+        self.assertEqual(self.search("-H", "100-"), ["IMO 2019/2"])
+        problem = json.loads(self.run_cli("show", "--json", "IMO 2019/2"))
+        self.assertEqual(problem["hardness"], 200)
+
+    def test_incremental_rebuild(self):
+        exporter.build_snapshot(self.path)
+        Problem.objects.update(modified=timezone.now() - timedelta(days=1))
+        self.assertEqual(exporter.build_snapshot(self.path, full=True), (5, 5))
+
+        problem = self.problems["IMO 2019/2"]
+        problem.hardness = 35
+        problem.save(update_fields=["hardness"])
+        self.problems["ISL 2010/A2"].tags.add(self.inversion)
+        self.problems["ISL 2005/G1"].delete()
+        self.inversion.name = "inverse"
+        self.inversion.save()
+        self.assertEqual(exporter.build_snapshot(self.path), (4, 2))
+
+        self.assertEqual(self.search("-t", "inverse", "-H", "30-"), [
+            "IMO 2019/2", "ISL 2010/A2",
+        ])
+        with snapshot.Snapshot(self.path) as fresh:
+            rows = sorted(fresh.rows())
+        exporter.build_snapshot(self.path, full=True)
+        with snapshot.Snapshot(self.path) as full:
+            self.assertEqual(sorted(full.rows()), rows)
+
+    def test_rebuild_after_backfill(self):
+        # Problems whose sources were not parsed yet
+        Problem.objects.update(
+            source_contest="", source_year=None, source_part="",
+            source_number=None, modified=timezone.now() - timedelta(days=1),
+        )
+        self.assertEqual(exporter.build_snapshot(self.path, full=True), (5, 5))
+        self.assertEqual(self.search("-c", "ISL"), [])
+
+        self.assertEqual(sources.backfill(Problem), 4)
+        self.assertEqual(exporter.build_snapshot(self.path), (5, 4))
+        self.assertEqual(self.search("-c", "ISL", "-y", "2006-"), [
+            "ISL 2010/A2", "ISL 2019/G3",
+        ])
+
+    def test_cli_does_not_import_django(self):
+        exporter.build_snapshot(self.path)
+        result = subprocess.run(
+            [sys.executable, "-c", (
+                "import sys; from vonty import cli; "
+                f"cli.main(['--snapshot', {self.path!r}, 'tags']); "
+                "sys.exit('django' in sys.modules)"
+            )],
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("inversion (2)", result.stdout)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry", "use_filter": True})
+        cls.chase = Tag.objects.add_child(cls.geometry, {
+            "name": "angle-chase", "use_filter": False,
+            "subtree_problem_count": 40,
+        })
+        cls.chasing = Tag.objects.add_child(cls.geometry, {
+            "name": "chasing", "desc": "Chase the angles", "use_filter": False,
+            "subtree_problem_count": 3,
+        })
+        cls.angles = Tag.objects.add_child(cls.geometry, {
+            "name": "angles", "use_filter": True, "subtree_problem_count": 5,
+        })
+        cls.anchor = Tag.objects.add_root({
+            "name": "anchor", "use_filter": False, "subtree_problem_count": 90,
+        })
+        cls.admin = get_user_model().objects.create_superuser("admin")
+
+    def setUp(self):
+        autocomplete.invalidate()
+
+    def names(self, text, limit=autocomplete.DEFAULT_LIMIT):
+        return [row[1] for row in autocomplete.complete(text, limit)]
+
+    def test_name_and_word_prefixes(self):
+        for text in ("angle chase", "Angle-Chase", "anglecha", "  ANGLE_ch"):
+            self.assertEqual(self.names(text), ["angle-chase"], text)
+        # Name matches, then name word matches, then description matches
+        self.assertEqual(self.names("chas"), ["chasing", "angle-chase"])
+        self.assertEqual(self.names("chase"), ["angle-chase", "chasing"])
+        self.assertEqual(self.names("nope"), [])
+
+    def test_rank_by_use_filter_and_count(self):
+        self.assertEqual(
+            self.names("an"), ["angles", "anchor", "angle-chase", "chasing"],
+        )
+        self.assertEqual(self.names("an", limit=1), ["angles"])
+        self.assertEqual(len(self.names("")), 5)
+
+    def test_sync_on_commit(self):
+        autocomplete.complete("an")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.anchor.name = "bound"
+            self.anchor.save()
+            self.angles.delete()
+            Tag.objects.add_child(
+                self.geometry, {"name": "angle-bisector", "use_filter": False}
+            )
+        self.assertEqual(
+            self.names("an"), ["angle-chase", "angle-bisector", "chasing"],
+        )
+        self.assertEqual(self.names("bo"), ["bound"])
+
+        # Counts change without signals, they are synced after the TTL
+        Tag.objects.filter(pk=self.chase.pk).update(subtree_problem_count=0)
+        self.assertEqual(self.names("an")[0], "angle-chase")
+        with override_settings(VONTY_AUTOCOMPLETE_TTL=-1):
+            self.assertEqual(
+                self.names("an"), ["angle-bisector", "angle-chase", "chasing"],
+            )
+
+    def test_sync_fetches_the_changed_tags(self):
+        autocomplete.complete("an")
+        # Not seen until the TTL, as the other tags are not fetched
+        Tag.objects.filter(pk=self.chase.pk).update(name="zigzag")
+        self.anchor.name = "bound"
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.anchor.save()
+        # The row of the saved tag only
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(self.names("bo"), ["bound"])
+        self.assertEqual(self.names("zig"), [])
+
+    def test_bulk_changes(self):
+        autocomplete.complete("an")
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("admin:vonty_tag_changelist"), {
+                "action": "use_filter", "_selected_action": [self.anchor.pk],
+            })
+        self.assertEqual(self.names("an")[:2], ["anchor", "angles"])
+
+        form = TagForm(instance=self.anchor, data={
+            "name": "anchor", "use_filter": True,
+            "treebeard_position": "first-child",
+            "children_names": "anchored",
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save()
+        self.assertEqual(self.names("anchored"), ["anchored"])
+
+    def test_warm_lookups_skip_the_database(self):
+        autocomplete.complete("g")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names("geo"), ["geometry"])
+            self.assertEqual(self.names("xyz"), [])
+
+    def test_endpoint(self):
+        response = self.client.get(
+            reverse("tag_autocomplete"), {"q": "chase", "limit": 1},
+        )
+        self.assertEqual(response.json()["results"], [{
+            "name": "angle-chase", "label": "Angle Chase", "desc": "",
+            "use_filter": False, "subtree_problem_count": 40,
+        }])
+        response = self.client.get(reverse("tag_autocomplete"), {"limit": 100})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("limit", response.json()["errors"])
+
+    def test_admin_autocomplete(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "vonty", "model_name": "problem",
+            "field_name": "tags", "term": "chase",
+        })
+        self.assertEqual(
+            [result["text"] for result in response.json()["results"]],
+            ["Angle Chase", "Chasing"],
+        )
+
+
+class ChangeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.geometry = Tag.objects.add_root({"name": "geometry"})
+        cls.inversion = Tag.objects.add_child(cls.geometry, {"name": "inversion"})
+        cls.algebra = Tag.objects.add_root({"name": "algebra"})
+        cls.p1 = Problem.objects.create(desc="Circles", source="A")
+        cls.p2 = Problem.objects.create(desc="Polynomials", source="B")
+
+    def feed(self, since=0, **params):
+        """The changes after since, the next cursor and whether more follow."""
+        response = self.client.get(reverse("changes"), {"since": since, **params})
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        return (
+            [json.loads(line) for line in lines],
+            int(response["Vonty-Cursor"]),
+            response["Vonty-More"] == "true",
+        )
+
+    def summary(self, changes_):
+        return [
+            (change["type"], change["id"], change["deleted"])
+            for change in changes_
+        ]
+
+    def test_writes_append_changes(self):
+        _changes, cursor, more = self.feed()
+        self.assertFalse(more)
+        self.p1.tags.add(self.inversion)
+        self.algebra.problem_set.add(self.p2)
+        self.p2.hardness = 20
+        self.p2.save()
+        self.p1.tags.add(self.inversion)  # Already there, no change
+        inversion = self.inversion.pk
+        self.inversion.delete()
+        gone = Problem.objects.create(desc="Gone", source="C")
+        gone_pk = gone.pk
+        gone.delete()
+
+        changes_, cursor, more = self.feed(cursor)
+        self.assertEqual(self.summary(changes_), [
+            ("problem", self.p1.pk, False),
+            ("problem", self.p2.pk, False),
+            ("tag", inversion, True),
+            ("problem", gone_pk, True),
+        ])
+        self.assertEqual(changes_[0]["data"]["tags"], [])
+        self.assertEqual(changes_[1]["data"]["tags"], ["algebra"])
+        self.assertEqual(changes_[1]["data"]["hardness"], 20)
+        self.assertNotIn("data", changes_[2])
+        self.assertEqual(self.feed(cursor)[:2], ([], cursor))
+
+    def test_tags(self):
+        _changes, cursor, _more = self.feed()
+        Tag.objects.move(
+            Tag.objects.get(pk=self.inversion.pk), self.algebra, "last-child"
+        )
+        [ring] = self.algebra.add_children(["ring"], use_filter=False)
+        changes_, cursor, _more = self.feed(cursor)
+        self.assertEqual([change["data"] for change in changes_], [
+            {"id": self.inversion.pk, "name": "inversion",
+             "parent": self.algebra.pk, "desc": "", "use_filter": True},
+            {"id": ring.pk, "name": "ring",
+             "parent": self.algebra.pk, "desc": "", "use_filter": False},
+        ])
+
+        loader = tagtree.TagTreeLoader([
+            {"data": {"name": "algebra", "use_filter": False}},
+            {"data": {"name": "geometry"}},
+        ])
+        loader.load()
+        changes_, _cursor, _more = self.feed(cursor)
+        self.assertEqual(self.summary(changes_), [("tag", self.algebra.pk, False)])
+
+    def test_pages_and_compaction(self):
+        start = Change.objects.latest("pk").pk
+        for hardness in range(5):
+            self.p1.hardness = hardness
+            self.p1.save()
+            self.p2.tags.add(self.algebra)
+            self.p2.tags.remove(self.algebra)
+        p2 = self.p2.pk
+        self.p2.delete()
+
+        cursor, pages = start, []
+        # The page bounds, the changes, the problems and their tags
+        with self.assertNumQueries(4):
+            changes_, cursor, more = self.feed(cursor, limit=4)
+        self.assertTrue(more)
+        while more:
+            pages.append(self.summary(changes_))
+            changes_, cursor, more = self.feed(cursor, limit=4)
+        pages.append(self.summary(changes_))
+        self.assertEqual(pages[-1], [
+            ("problem", self.p1.pk, False), ("problem", p2, True),
+        ])
+
+        # Compaction keeps the last change of every object,
+        # so that old cursors still reach the same state
+        # Every change of the two problems but the last ones
+        self.assertEqual(changes.compact(), 2 + 15 + 1 - 2)
+        self.assertEqual(changes.compact(), 0)
+        changes_, end, more = self.feed(start)
+        self.assertEqual((end, more), (cursor, False))
+        self.assertEqual(self.summary(changes_), pages[-1])
+        self.assertEqual(changes_[0]["data"]["hardness"], 4)
+
+    def test_invalid(self):
+        for params in ({"since": -1}, {"since": "x"}, {"limit": 0}):
+            response = self.client.get(reverse("changes"), params)
+            self.assertEqual(response.status_code, 400)
@@ -4,5 +4,23 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("problems/", views.problems, name="problems"),
+    path("problems/<int:pk>/", views.problem_detail, name="problem_detail"),
+    path("problems/<int:pk>/similar/", views.similar, name="similar"),
+    path("tags/", views.tags, name="tags"),
+    path(
+        "tags/autocomplete/", views.tag_autocomplete, name="tag_autocomplete",
+    ),
+    path("pick/", views.pick, name="pick"),
+    path("changes/", views.change_feed, name="changes"),
+    # Asynchronous versions, for ASGI deployments
+    path("async/problems/", views.aproblems, name="aproblems"),
+    path(
+        "async/problems/<int:pk>/",
+        views.aproblem_detail,
+        name="aproblem_detail",
+    ),
+    path("async/tags/", views.atags, name="atags"),
+    path("export/", views.export, name="export"),
+    path("profiling/", views.profiling, name="profiling"),
 ]
-
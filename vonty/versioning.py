@@ -0,0 +1,200 @@
+"""
+Vonty data version and response cache.
+
+The archive changes a few times a day and is read all the time, so the
+read endpoints are served by version: a number stored in the
+VONTY_VERSION_CACHE cache, bumped once the transactions changing
+problems or tags commit. It gives the ETag and Last-Modified headers
+of the responses, so clients revalidate with a 304, and keys
+an in-memory LRU cache of the response bodies. While the version does
+not change, a request for a cached page never touches the database.
+
+The version lives in a Django cache shared by every process, so that the
+bumps of the management commands and of the other workers are seen.
+A bump sets a new value rather than incrementing, as file and database
+caches do not increment atomically: of two concurrent bumps, the last
+one written still leaves a version no response was cached under.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import Problem, Tag
+from .signals import tag_moved
+
+VERSION_KEY = "vonty:data-version"
+MODIFIED_KEY = "vonty:data-modified"
+# Headers kept with a cached response
+CACHED_HEADERS = ("Content-Type", "Content-Disposition")
+
+_responses = OrderedDict()
+_responses_version = None
+_responses_size = 0
+_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, "VONTY_VERSION_CACHE", "default")]
+
+
+def get_max_size():
+    return getattr(settings, "VONTY_RESPONSE_CACHE_SIZE", 32 * 1024 * 1024)
+
+
+def get_version():
+    """The current data version and the time it was set at."""
+    cache = get_cache()
+    values = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+    if len(values) < 2:
+        # Lost by the cache, start from the current time in microseconds
+        # as bump() does, so that the version still moves forward
+        now = time.time()
+        cache.add(VERSION_KEY, int(now * 1000000), timeout=None)
+        cache.add(MODIFIED_KEY, now, timeout=None)
+        values = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+        # A dummy cache keeps nothing, every request is then a new version
+        values.setdefault(VERSION_KEY, int(now * 1000000))
+        values.setdefault(MODIFIED_KEY, now)
+    return values[VERSION_KEY], values[MODIFIED_KEY]
+
+
+def bump(**kwargs):
+    """Move to a new version, now."""
+    cache = get_cache()
+    now = time.time()
+    # The time in microseconds, unique to this bump, yet above the
+    # previous version even when the clock went back
+    version = max(int(now * 1000000), cache.get(VERSION_KEY, 0) + 1)
+    cache.set_many({VERSION_KEY: version, MODIFIED_KEY: now}, timeout=None)
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(tag_moved)
+def bump_on_commit(**kwargs):
+    """Move to a new version once the current transaction commits."""
+    transaction.on_commit(bump)
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_on_commit()
+
+
+def get_response(key, version):
+    global _responses_version, _responses_size
+    with _lock:
+        if version != _responses_version:
+            # Every cached response is stale
+            _responses.clear()
+            _responses_version = version
+            _responses_size = 0
+            return None
+        entry = _responses.get(key)
+        if entry is not None:
+            _responses.move_to_end(key)
+        return entry
+
+
+def store_response(key, version, response):
+    global _responses_size
+    content = response.content
+    headers = [
+        (name, response[name]) for name in CACHED_HEADERS if name in response
+    ]
+    entry = (response.status_code, content, headers)
+    max_size = get_max_size()
+    if len(content) > max_size // 8:
+        return
+    with _lock:
+        if version != _responses_version or key in _responses:
+            return
+        _responses[key] = entry
+        _responses_size += len(content)
+        while _responses_size > max_size:
+            _key, (_status, old, _headers) = _responses.popitem(last=False)
+            _responses_size -= len(old)
+
+
+def clear_responses():
+    global _responses_version, _responses_size
+    with _lock:
+        _responses.clear()
+        _responses_version = None
+        _responses_size = 0
+
+
+def cache_key(request):
+    return request.path, tuple(
+        (name, tuple(values)) for name, values in sorted(request.GET.lists())
+    )
+
+
+def finish(response, version, modified):
+    response.headers.setdefault("ETag", f'"{version}"')
+    response.headers.setdefault("Last-Modified", http_date(modified))
+    # Clients may keep the response but must revalidate it first
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def versioned(view):
+    """
+    Decorate a read-only view, sync or async, to answer 304
+    to conditional requests for the current version
+    and serve its successful responses from the response cache.
+    """
+
+    def lookup(request):
+        version, modified = get_version()
+        response = get_conditional_response(
+            request, etag=f'"{version}"', last_modified=int(modified),
+        )
+        if response is None:
+            entry = get_response(cache_key(request), version)
+            if entry is not None:
+                status, content, headers = entry
+                response = HttpResponse(content, status=status)
+                for name, value in headers:
+                    response[name] = value
+        return version, modified, response
+
+    def save(request, response, version, modified):
+        if response.status_code == 200 and not response.streaming:
+            store_response(cache_key(request), version, response)
+        return finish(response, version, modified)
+
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # The version cache may read files or the network
+            version, modified, response = await sync_to_async(lookup)(request)
+            if response is not None:
+                return finish(response, version, modified)
+            response = await view(request, *args, **kwargs)
+            return save(request, response, version, modified)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            version, modified, response = lookup(request)
+            if response is not None:
+                return finish(response, version, modified)
+            response = view(request, *args, **kwargs)
+            return save(request, response, version, modified)
+
+    return wrapper
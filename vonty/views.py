@@ -1,6 +1,258 @@
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from . import changes
+from .autocomplete import TagAutocompleteForm
+from .db import iter_from_read_database, reads_from_read_database
+from .exporter import FORMATS, encode, export_lines, ndjson_lines
+from .models import Problem, Tag
+from .picker import PickError, ProblemPickForm
+from .profiling import get_records, get_sample_rate
+from .search import ProblemSearchForm, serialize_problem
+from .similar import DEFAULT_LIMIT, SimilarProblemsForm, similar_problems
+from .sheets import FORMATS as SHEET_FORMATS, SheetBuilder
+from .versioning import versioned
 
 
 def index(request):
     return HttpResponse("Welcome to vonty!")
 
+
+@require_GET
+@versioned
+@reads_from_read_database
+def problems(request):
+    form = ProblemSearchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    page, next_cursor = form.get_page()
+    return JsonResponse({
+        "results": [serialize_problem(problem) for problem in page],
+        "next": next_cursor,
+    })
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+async def aproblems(request):
+    form = ProblemSearchForm(request.GET)
+    # Form validation resolves the tags through the sync ORM
+    if not await sync_to_async(form.is_valid)():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    page, next_cursor = await form.aget_page()
+    return JsonResponse({
+        "results": [serialize_problem(problem) for problem in page],
+        "next": next_cursor,
+    })
+
+
+def problem_queryset():
+    return Problem.objects.select_related("proposer").prefetch_related(
+        Prefetch("tags", queryset=Tag.objects.only("name"))
+    )
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+def problem_detail(request, pk):
+    try:
+        problem = problem_queryset().get(pk=pk)
+    except Problem.DoesNotExist:
+        raise Http404("No such problem")
+    return JsonResponse(serialize_problem(problem))
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+async def aproblem_detail(request, pk):
+    try:
+        problem = await problem_queryset().aget(pk=pk)
+    except Problem.DoesNotExist:
+        raise Http404("No such problem")
+    return JsonResponse(serialize_problem(problem))
+
+
+def serialize_tag_tree(tags):
+    """
+    Serialize tags fetched in path order into a flat list,
+    each tag pointing to its parent by name.
+    """
+    names = {}
+    rows = []
+    for tag in tags:
+        names[tag.path] = tag.name
+        rows.append({
+            "name": tag.name,
+            "parent": names.get(tag.path[:-Tag.steplen]),
+            "depth": tag.depth,
+            "desc": tag.desc,
+            "use_filter": tag.use_filter,
+            "problem_count": tag.problem_count,
+            "subtree_problem_count": tag.subtree_problem_count,
+        })
+    return rows
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+def tags(request):
+    return JsonResponse({
+        "results": serialize_tag_tree(Tag.objects.order_by("path")),
+    })
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+async def atags(request):
+    tags = [tag async for tag in Tag.objects.order_by("path")]
+    return JsonResponse({"results": serialize_tag_tree(tags)})
+
+
+@require_GET
+@reads_from_read_database
+def tag_autocomplete(request):
+    """The tags completing a query, see vonty.autocomplete."""
+    form = TagAutocompleteForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    return JsonResponse({
+        "results": [
+            {
+                "name": name,
+                "label": str(Tag(name=name)),
+                "desc": desc,
+                "use_filter": use_filter,
+                "subtree_problem_count": count,
+            }
+            for _pk, name, desc, use_filter, count in form.get_tags()
+        ],
+    })
+
+
+@require_GET
+@versioned
+@reads_from_read_database
+def similar(request, pk):
+    """The problems most similar to a problem, see vonty.similar."""
+    form = SimilarProblemsForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    scores = similar_problems(pk, form.cleaned_data["limit"] or DEFAULT_LIMIT)
+    if scores is None:
+        raise Http404("No such problem")
+    problems = problem_queryset().in_bulk(other for _score, other in scores)
+    return JsonResponse({
+        "results": [
+            {**serialize_problem(problems[other]), "score": round(score, 4)}
+            for score, other in scores if other in problems
+        ],
+    })
+
+
+@require_GET
+@reads_from_read_database
+def pick(request):
+    """
+    Pick a random problem set, see vonty.picker.
+    ?format=tex or ?format=typ returns the problem sheet source.
+    """
+    form = ProblemPickForm(request.GET)
+    fmt = request.GET.get("format")
+    if fmt and fmt not in SHEET_FORMATS:
+        form.add_error(None, f"Choose one of {', '.join(SHEET_FORMATS)}")
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    try:
+        problems = form.pick()
+    except PickError as exc:
+        return JsonResponse({"errors": {"__all__": [str(exc)]}}, status=400)
+
+    if fmt:
+        title = f"Mock contest {form.cleaned_data['seed']}"
+        return HttpResponse(
+            SheetBuilder(fmt).build(problems, title=title),
+            content_type="text/plain; charset=utf-8",
+        )
+    return JsonResponse({
+        "seed": form.cleaned_data["seed"],
+        "results": [serialize_problem(problem) for problem in problems],
+    })
+
+
+@require_GET
+@staff_member_required
+def export(request):
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return JsonResponse(
+            {"errors": {"format": [f"Choose one of {', '.join(FORMATS)}"]}},
+            status=400,
+        )
+    compress = request.GET.get("gzip") in ("1", "true")
+
+    filename = f"problems.{fmt}" + (".gz" if compress else "")
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        content_type = "application/gzip"
+    response = StreamingHttpResponse(
+        iter_from_read_database(encode(export_lines(fmt), compress=compress)),
+        content_type=content_type,
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@require_GET
+@reads_from_read_database
+def change_feed(request):
+    """
+    The changes after ?since=, see vonty.changes, streamed as JSON lines.
+    The Vonty-Cursor header is the since of the next request,
+    and Vonty-More tells whether it would return changes already.
+    """
+    form = changes.ChangeFeedForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    since = form.cleaned_data["since"] or 0
+    end, more = changes.bounds(
+        since, form.cleaned_data["limit"] or changes.DEFAULT_LIMIT
+    )
+    response = StreamingHttpResponse(
+        iter_from_read_database(
+            encode(ndjson_lines(changes.iter_changes(since, end)))
+        ),
+        content_type="application/x-ndjson",
+    )
+    response["Vonty-Cursor"] = str(end)
+    response["Vonty-More"] = "true" if more else "false"
+    return response
+
+
+@require_GET
+@staff_member_required
+def profiling(request):
+    """
+    The last profiled requests, most recent first.
+    ?n_plus_one=1 keeps the requests with repeated queries,
+    ?path=... the requests whose path starts with the given prefix.
+    """
+    records = get_records()
+    if request.GET.get("n_plus_one") in ("1", "true"):
+        records = [record for record in records if record["repeated"]]
+    if request.GET.get("path"):
+        prefix = request.GET["path"]
+        records = [r for r in records if r["path"].startswith(prefix)]
+    return JsonResponse({
+        "sample_rate": get_sample_rate(),
+        "results": records,
+    })
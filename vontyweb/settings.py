@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 X_FRAME_OPTIONS = "SAMEORIGIN"
 
 MIDDLEWARE = [
+    'vonty.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,9 +80,43 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so that
+            # busy_timeout applies instead of failing on lock upgrades.
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Read-only connection used by search, export and stats.
+    # Point NAME to a replica file to move those reads off the main file.
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/ref/settings/#caches
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by the processes of this host through files.
+    # Use Redis or Memcached when serving from several hosts.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'versions',
+    },
 }
 
+DATABASE_ROUTERS = ['vonty.db.ReadDatabaseRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -123,3 +158,70 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Vonty
+
+# Backend used to compile problem sheets into PDFs.
+VONTY_SHEET_BACKEND = 'vonty.sheets.SubprocessCompileBackend'
+
+# Directory holding the rendered problem fragments of the sheets,
+# shared by every process. It can be deleted at any time.
+VONTY_SHEET_FRAGMENTS = BASE_DIR / 'sheet-fragments'
+
+# Directory holding the local bare mirrors of problem repositories.
+VONTY_GIT_MIRROR_ROOT = BASE_DIR / 'git-mirrors'
+
+# Database alias that read-only views query, see vonty.db.
+VONTY_READ_DATABASE = 'readonly'
+
+# Pragmas applied to every SQLite connection.
+VONTY_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,  # 64 MiB
+    'mmap_size': 268435456,  # 256 MiB
+    'temp_store': 'MEMORY',
+}
+
+# JSON file of the baseline results of the benchmark command.
+VONTY_BENCHMARK_BASELINE = BASE_DIR / 'benchmarks' / 'baseline.json'
+
+# Fraction of the requests profiled by vonty.profiling.ProfilingMiddleware,
+# the number of profiled requests kept in memory per process,
+# and the number of runs of a query shape flagged as a possible N+1.
+VONTY_PROFILE_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+VONTY_PROFILE_BUFFER_SIZE = 200
+VONTY_PROFILE_REPEAT_THRESHOLD = 5
+
+# Seconds the problem-set picker keeps its pool of problem ids
+# before reloading it, to see the changes made by other processes.
+VONTY_PICKER_POOL_TTL = 300
+
+# Seconds the in-memory tag index is kept before being rebuilt,
+# to see the changes made by other processes.
+VONTY_TAG_INDEX_TTL = 300
+
+# Number of compiled von-style queries cached per process,
+# and the seconds they are kept, see vonty.query.
+VONTY_QUERY_CACHE_SIZE = 256
+VONTY_QUERY_PLAN_TTL = 300
+
+# Trigram similarity from which problems are reported as likely
+# duplicates, see vonty.duplicates.
+VONTY_DUPLICATE_THRESHOLD = 0.6
+
+# Cache holding the data version of vonty.versioning, shared by every
+# process so that they all see the bumps, and the bytes of responses
+# cached per process.
+VONTY_VERSION_CACHE = 'versions'
+VONTY_RESPONSE_CACHE_SIZE = 32 * 1024 * 1024  # 32 MiB
+
+# Snapshot file written by the export_snapshot command
+# and queried offline by python -m vonty, see vonty.snapshot.
+VONTY_SNAPSHOT_PATH = BASE_DIR / 'vonty.snapshot'
+
+# Seconds after which the tag autocomplete trie is synced with the tags,
+# to see the problem counts and the changes made by other processes.
+VONTY_AUTOCOMPLETE_TTL = 300